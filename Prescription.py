@@ -12,6 +12,9 @@ import datetime
 import sys
 from pathlib import Path
 import time
+import uuid
+
+from components.http_cache import conditional_get
 
 # Load environment variables
 load_dotenv()
@@ -191,9 +194,94 @@ if 'backend_url' not in st.session_state:
     st.session_state.backend_url = backend_url
 
 def initialize_cart():
-    """Ensures we have a 'cart' dict in session_state."""
+    """Ensures we have a 'cart' dict in session_state, and an id the backend holds its stock under."""
     if 'cart' not in st.session_state:
         st.session_state.cart = {}
+    if 'cart_id' not in st.session_state:
+        st.session_state.cart_id = uuid.uuid4().hex
+
+def update_cart(all_matches):
+    """Sets the cart from the quantities chosen for the matches in the update_cart_form."""
+    for med, matches in all_matches:
+        if isinstance(matches, list) and len(matches) > 0:
+            for row in matches:
+                item_name = row.get('name', 'Unknown')
+                if item_name:
+                    item_name = item_name[0].upper() + item_name[1:].lower()
+                price = float(row.get('price', 0))
+
+                key_qty = f"{item_name}_qty"
+                if key_qty in st.session_state:
+                    chosen_qty = st.session_state[key_qty]
+                    if chosen_qty > 0:
+                        st.session_state.cart[item_name] = {
+                            "id": row.get('id'),
+                            "price": price,
+                            "quantity": chosen_qty
+                        }
+                    elif item_name in st.session_state.cart:
+                        # If zero and item exists in cart, remove it
+                        st.session_state.cart.pop(item_name, None)
+
+def cart_lines():
+    """The cart as backend order lines."""
+    return [
+        {"medicine_id": details['id'], "quantity": details['quantity']}
+        for details in st.session_state.cart.values() if details.get('id') is not None
+    ]
+
+def show_oversold(resp, action):
+    """Shows the lines of a 409 response that asked for more than is available."""
+    names = {details.get('id'): name for name, details in st.session_state.cart.items()}
+    for line in resp.json()["detail"]["oversold"]:
+        st.error(
+            f"⚠️ Only {line['available']} available of {names.get(line['medicine_id'], line['medicine_id'])} "
+            f"({line['requested']} requested). {action}"
+        )
+
+def reserve_cart():
+    """
+    Holds the cart's quantities on the backend so other carts cannot take them, until the order is
+    placed or the reservation expires. Returns the reservation, or None after showing why not.
+    """
+    try:
+        resp = requests.put(
+            f"{st.session_state.backend_url}/reservations/{st.session_state.cart_id}",
+            json={"lines": cart_lines()},
+            timeout=10
+        )
+    except requests.exceptions.RequestException as exc:
+        st.error(f"Network error while reserving stock: {str(exc)}")
+        return None
+    if resp.status_code == 409:
+        show_oversold(resp, "Nothing was reserved.")
+        return None
+    if resp.status_code != 200:
+        st.error(f"Could not reserve stock: {resp.status_code}")
+        return None
+    return resp.json()
+
+def release_cart():
+    """Releases whatever the cart still holds on the backend."""
+    try:
+        requests.delete(f"{st.session_state.backend_url}/reservations/{st.session_state.cart_id}", timeout=10)
+    except requests.exceptions.RequestException:
+        pass
+
+def start_new_cart(order):
+    """
+    Empties the cart once its order is placed, so ordering again only takes what is chosen anew;
+    the placed items are kept for the invoice. Holds the order did not use are released and the
+    next cart gets a new id.
+    """
+    st.session_state.placed_order = dict(st.session_state.cart)
+    st.session_state.placed_notice = f"Order placed: {len(order['lines'])} item(s), ₹{order['total']:.2f}"
+    release_cart()
+    st.session_state.cart = {}
+    st.session_state.cart_id = uuid.uuid4().hex
+    # The quantity inputs would put the ordered quantities back into the cart on the next run
+    for key in [key for key in st.session_state if key.endswith("_qty")]:
+        del st.session_state[key]
 
 def analyze_prescription(image, prompt):
     """Calls Gemini with [prompt, image], returns text or an error string."""
@@ -245,38 +333,66 @@ def generate_invoice():
     
     return pdf.output(dest='S').encode('latin1')
 
-def process_substitutes(substitutes, original_med_info):
+def process_substitutes(medicine_id, original_med_info):
     """Process substitutes and return their details"""
     results = []
-    for substitute in substitutes:
+    try:
+        # The backend resolves the substitute names itself and returns the in-stock ones in one call
+        status_code, data = conditional_get(
+            f"{st.session_state.backend_url}/medicine/{medicine_id}/substitutes",
+            params={"in_stock": "true"},
+            timeout=10
+        )
+        if status_code != 200:
+            return results
+        substitute_matches = data.get("substitutes", [])
+    except requests.exceptions.RequestException as exc:
+        st.error(f"Network error while searching for substitutes: {str(exc)}")
+        return results
+
+    for best_match in substitute_matches:
+        substitute = best_match.get('substitute', best_match.get('name', 'Unknown'))
         try:
-            resp = requests.get(
-                f"{st.session_state.backend_url}/search_medicine/",
-                params={"query": substitute},
-                timeout=10
-            )
-            if resp.status_code == 200:
-                sub_matches = resp.json()
-                if isinstance(sub_matches, list) and len(sub_matches) > 0:
-                    best_match = sub_matches[0]
-                    if int(best_match.get('quantity_available', 0)) > 0:
-                        sub_med_info = {
-                            "name": best_match.get('name', 'Unknown'),
-                            "composition": best_match.get('short_composition1', ''),
-                            "therapeutic_class": best_match.get('therapeutic_class', ''),
-                            "uses": [best_match.get(f'use{i}', '') for i in range(5) if best_match.get(f'use{i}')],
-                            "action": best_match.get('action', ''),
-                            "price": float(best_match.get('price', 0)),
-                            "quantity_available": int(best_match.get('quantity_available', 0)),
-                            "pack_size_label": best_match.get('pack_size_label', '')
-                        }
-                        results.append((substitute, sub_med_info, best_match))
-        except requests.exceptions.RequestException as exc:
-            st.error(f"Network error while searching for substitute {substitute}: {str(exc)}")
+            if int(best_match.get('quantity_available', 0)) > 0:
+                sub_med_info = {
+                    "id": best_match.get('id'),
+                    "name": best_match.get('name', 'Unknown'),
+                    "composition": best_match.get('short_composition1', ''),
+                    "therapeutic_class": best_match.get('therapeutic_class', ''),
+                    "uses": [best_match.get(f'use{i}', '') for i in range(5) if best_match.get(f'use{i}')],
+                    "action": best_match.get('action', ''),
+                    "price": float(best_match.get('price', 0)),
+                    "quantity_available": int(best_match.get('quantity_available', 0)),
+                    "pack_size_label": best_match.get('pack_size_label', '')
+                }
+                results.append((substitute, sub_med_info, best_match))
         except Exception as exc:
             st.error(f"Error processing substitute {substitute}: {str(exc)}")
     return results
 
+def place_order():
+    """
+    Take the stock of the cart on the backend (POST /orders): every line is taken or none is.
+    Returns the placed order, or None after showing why it was refused.
+    """
+    try:
+        resp = requests.post(
+            f"{st.session_state.backend_url}/orders",
+            json={"lines": cart_lines(), "cart_id": st.session_state.cart_id},
+            timeout=10
+        )
+    except requests.exceptions.RequestException as exc:
+        st.error(f"Network error while placing the order: {str(exc)}")
+        return None
+
+    if resp.status_code == 409:
+        show_oversold(resp, "The order was not placed.")
+        return None
+    if resp.status_code != 200:
+        st.error(f"Could not place the order: {resp.status_code}")
+        return None
+    return resp.json()
+
 def process_prescription(image, prompt):
     """Process the prescription image and return analysis results."""
     gemini_text = analyze_prescription(image, prompt)
@@ -514,7 +630,9 @@ if uploaded_file:
     with col1:
         if st.button("Analyze"):
             # Clear previous cart and search results when analyzing new prescription
+            release_cart()
             st.session_state.cart = {}
+            st.session_state.pop('placed_order', None)
             if 'search_results' in st.session_state:
                 del st.session_state.search_results
             
@@ -528,18 +646,17 @@ if uploaded_file:
                     # Call FastAPI for fuzzy matching
                     st.subheader("*Available Medicines & Alternatives*")
 
-                    all_matches = []
-                    for med in med_names:
-                        with st.spinner(f"Searching DB for '{med}'..."):
-                            try:
-                                resp = requests.get(f"{backend_url}/search_medicine/", params={"query": med})
-                                if resp.status_code == 200:
-                                    data = resp.json()
-                                    all_matches.append((med, data))
-                                else:
-                                    all_matches.append((med, f"Error: {resp.status_code}"))
-                            except Exception as exc:
-                                all_matches.append((med, f"Error calling FastAPI: {exc}"))
+                    # One batched request for every extracted medicine name
+                    with st.spinner("Searching DB for prescribed medicines..."):
+                        try:
+                            resp = requests.post(f"{backend_url}/search_medicine/batch", json={"queries": med_names})
+                            if resp.status_code == 200:
+                                results = resp.json().get("results", [])
+                                all_matches = [(res["query"], res["matches"]) for res in results]
+                            else:
+                                all_matches = [(med, f"Error: {resp.status_code}") for med in med_names]
+                        except Exception as exc:
+                            all_matches = [(med, f"Error calling FastAPI: {exc}") for med in med_names]
 
                     # Save results so they persist across reruns
                     st.session_state.search_results = all_matches
@@ -564,12 +681,17 @@ if uploaded_file:
                         if name:
                             name = name[0].upper() + name[1:].lower()  # Title-case
                         price = float(row.get('price', 0))
-                        qty_avail = int(row.get('quantity_available', 0))
+                        # Stock reserved by other open carts cannot be sold from this one
+                        qty_avail = int(row.get('available_to_sell', row.get('quantity_available', 0)))
+                        held = int(row.get('held', 0))
                         similarity = float(row.get('similarity_score', 0))
 
                         # Create tile with basic info and handle out of stock
                         stock_status = "text-danger" if qty_avail == 0 else ""
-                        stock_text = "Out of Stock" if qty_avail == 0 else f"{qty_avail} available"
+                        if qty_avail == 0:
+                            stock_text = "Reserved in other carts" if held else "Out of Stock"
+                        else:
+                            stock_text = f"{qty_avail} available" + (f" ({held} reserved)" if held else "")
                         
                         st.markdown(f"""
                             <div class="medicine-tile">
@@ -726,7 +848,7 @@ if uploaded_file:
                                     }
                                     
                                     # Process all substitutes
-                                    substitute_results = process_substitutes(substitutes, original_med_info)
+                                    substitute_results = process_substitutes(row.get('id'), original_med_info)
                                     
                                     for substitute, sub_med_info, best_match in substitute_results:
                                         # Calculate suggested quantity for substitute based on remaining need
@@ -862,6 +984,7 @@ if uploaded_file:
                                                     # Update cart when quantity changes
                                                     if new_qty > 0:
                                                         st.session_state.cart[sub_name] = {
+                                                            "id": sub_med_info['id'],
                                                             "price": sub_med_info['price'],
                                                             "quantity": new_qty
                                                         }
@@ -892,39 +1015,32 @@ if uploaded_file:
 
                     st.markdown('</div>', unsafe_allow_html=True)
 
-            # Update Cart button
-            submitted = st.form_submit_button("Generate Order")
+            # Reserving holds the chosen quantities for a while; generating the order takes the stock
+            col_reserve, col_order = st.columns(2)
+            with col_reserve:
+                reserve_submitted = st.form_submit_button("Reserve Quantities")
+            with col_order:
+                submitted = st.form_submit_button("Generate Order")
+            if reserve_submitted:
+                update_cart(all_matches)
+                reservation = reserve_cart()
+                if reservation is not None:
+                    minutes = reservation['expires_in_seconds'] / 60
+                    st.success(f"Reserved {len(reservation['lines'])} item(s) for {minutes:.0f} minutes.")
             if submitted:
-                cart_updated = False  # Flag to track if any changes were made
                 # Update the cart based on all the number inputs
-                for med, matches in all_matches:
-                    if isinstance(matches, list) and len(matches) > 0:
-                        for row in matches:
-                            item_name = row.get('name', 'Unknown')
-                            if item_name:
-                                item_name = item_name[0].upper() + item_name[1:].lower()
-                            price = float(row.get('price', 0))
-                            qty_avail = int(row.get('quantity_available', 0))
-
-                            key_qty = f"{item_name}_qty"
-                            if key_qty in st.session_state:
-                                chosen_qty = st.session_state[key_qty]
-                                if chosen_qty > 0:
-                                    st.session_state.cart[item_name] = {
-                                        "price": price,
-                                        "quantity": chosen_qty
-                                    }
-                                    cart_updated = True
-                                elif item_name in st.session_state.cart:
-                                    # If zero and item exists in cart, remove it
-                                    st.session_state.cart.pop(item_name, None)
-                                    cart_updated = True
-                
-                st.success("Cart updated successfully!")
-                # if cart_updated:
-                #     st.success("Cart updated successfully!")
-                # else:
-                #     st.info("No changes made to cart. Select quantities and try again.")
+                update_cart(all_matches)
+
+                if not st.session_state.cart:
+                    st.info("Select quantities to generate an order.")
+                else:
+                    order = place_order()
+                    if order is not None:
+                        start_new_cart(order)
+                        st.rerun()
+            placed_notice = st.session_state.pop('placed_notice', None)
+            if placed_notice:
+                st.success(placed_notice)
 
         # End of update_cart_form
         
@@ -937,8 +1053,10 @@ if uploaded_file:
                 'date': datetime.datetime.now()
             }
         
-        # Display order summary and invoice generation outside the cart form
-        if st.session_state.cart:
+        # Display order summary and invoice generation outside the cart form: of the cart, or of
+        # the order placed last until a new cart is started
+        invoice_items = st.session_state.cart or st.session_state.get('placed_order', {})
+        if invoice_items:
             st.markdown("""
                 <div style='margin-top: 20px; padding: 20px; border: 1px solid #eee; border-radius: 8px;'>
                     <div style='display: flex; align-items: center; gap: 8px; margin-bottom: 15px;'>
@@ -948,7 +1066,7 @@ if uploaded_file:
             """, unsafe_allow_html=True)
             
             total = 0
-            for item, details in st.session_state.cart.items():
+            for item, details in invoice_items.items():
                 qty = details['quantity']
                 price = details['price']
                 subtotal = qty * price
@@ -1021,7 +1139,7 @@ if uploaded_file:
                     # Table rows
                     total = 0
                     pdf.set_font('Arial', '', 12)
-                    for med, details in st.session_state.cart.items():
+                    for med, details in invoice_items.items():
                         qty = details['quantity']
                         price = details['price']
                         subtotal = price * qty
@@ -0,0 +1,33 @@
+import requests
+import streamlit as st
+
+# Backend responses remembered per browser session for revalidation
+MAX_CACHED_RESPONSES = 64
+
+def conditional_get(url, params=None, timeout=30):
+    """
+    GET a JSON endpoint of the backend, revalidating the copy cached for this session with its
+    ETag: an unchanged response comes back as an empty 304 and the cached JSON is reused.
+    Returns (status_code, json); a 304 is reported as 200.
+    """
+    cache = st.session_state.setdefault("http_cache", {})
+    key = (url, tuple(sorted((name, str(value)) for name, value in (params or {}).items())))
+    cached = cache.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+
+    response = requests.get(url, params=params, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        # Most recently used entries are kept when the cache is trimmed
+        cache[key] = cache.pop(key)
+        return 200, cached[1]
+    if response.status_code != 200:
+        return response.status_code, None
+
+    data = response.json()
+    etag = response.headers.get("ETag")
+    if etag:
+        cache.pop(key, None)
+        cache[key] = (etag, data)
+        while len(cache) > MAX_CACHED_RESPONSES:
+            cache.pop(next(iter(cache)))
+    return 200, data
@@ -5,6 +5,8 @@ from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 
+from components.http_cache import conditional_get
+
 # Load environment variables
 load_dotenv()
 
@@ -193,24 +195,71 @@ with col2:
 with col3:
     out_of_stock_btn = st.button("❌ Out of Stock", key="out_of_stock_btn", use_container_width=True)
 
+# Export of the whole inventory (or of the current search) as a file
+col1, col2 = st.columns([1, 2])
+with col1:
+    export_format = st.selectbox(
+        "Export format", ["csv", "ndjson"], key="export_format", label_visibility="collapsed"
+    )
+with col2:
+    export_btn = st.button("⬇️ Export Inventory", key="export_btn", use_container_width=True)
+
+def fetch_export(export_format, search):
+    """Read the backend's streamed export chunk by chunk; returns (status_code, file contents)."""
+    params = {"format": export_format}
+    if search:
+        params["search"] = search
+    with requests.get(f"{backend_url}/management/medicines/export", params=params, stream=True) as response:
+        if response.status_code != 200:
+            return response.status_code, b""
+        return response.status_code, b"".join(response.iter_content(chunk_size=65536))
+
+if export_btn:
+    with st.spinner("Exporting inventory..."):
+        try:
+            status_code, data = fetch_export(export_format, search_term)
+            if status_code == 200:
+                st.download_button(
+                    f"💾 Download medicines.{export_format}",
+                    data=data,
+                    file_name=f"medicines.{export_format}",
+                    mime="text/csv" if export_format == "csv" else "application/x-ndjson",
+                    key="export_download",
+                    use_container_width=True
+                )
+            else:
+                st.error("Error exporting data from the server.")
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+
+# Rows requested per page when walking the backend's cursors
+PAGE_SIZE = 500
+# The only medicine fields the inventory tables show
+TABLE_FIELDS = "name,price,quantity_available,expiry_date"
+
+def fetch_all_medicines(params, limit):
+    """Fetch up to `limit` medicines page by page, following next_cursor; returns (status_code, medicines)."""
+    medicines = []
+    page_params = dict(params, page_size=PAGE_SIZE, fields=TABLE_FIELDS)
+    while len(medicines) < limit:
+        # Pages unchanged since the last visit are revalidated (304) instead of downloaded again
+        status_code, data = conditional_get(f"{backend_url}/management/medicines", params=page_params)
+        if status_code != 200:
+            return status_code, medicines
+        medicines.extend(data.get("medicines", []))
+        next_cursor = data.get("next_cursor")
+        if not next_cursor:
+            return status_code, medicines[:limit]
+        page_params = {"cursor": next_cursor, "page_size": PAGE_SIZE, "fields": TABLE_FIELDS}
+    return 200, medicines[:limit]
+
 # Function to fetch and display medicines based on status
 def fetch_medicines_by_status(status):
     with st.spinner(f'Fetching {status.replace("_", " ").title()} medicines...'):
         try:
-            params = {
-                "status_filter": [status],
-                "page": 1,
-                "page_size": 5000  # Increased to show all results
-            }
-            
-            response = requests.get(
-                f"{backend_url}/management/medicines",
-                params=params
-            )
+            status_code, medicines = fetch_all_medicines({"status_filter": [status]}, limit=5000)
             
-            if response.status_code == 200:
-                data = response.json()
-                medicines = data.get("medicines", [])
+            if status_code == 200:
                 
                 if medicines:
                     display_data = []
@@ -331,20 +380,9 @@ if search_button or search_term:
     with st.spinner(f'Searching medicines...'):
         try:
             # Call FastAPI endpoint for full inventory search
-            params = {
-                "search": search_term if search_term else "",
-                "page": 1,
-                "page_size": 1000  # Increased to show all results
-            }
-            
-            response = requests.get(
-                f"{backend_url}/management/medicines",
-                params=params
-            )
+            status_code, medicines = fetch_all_medicines({"search": search_term if search_term else ""}, limit=1000)
             
-            if response.status_code == 200:
-                data = response.json()
-                medicines = data.get("medicines", [])
+            if status_code == 200:
                 
                 if medicines:
                     # Prepare data for display
@@ -0,0 +1,68 @@
+"""
+TF-IDF engine vs WRatio: recall of the intended name and latency, single queries and batches.
+
+Usage:
+    python benchmarks/bench_tfidf_engine.py                      # synthetic 50k-name catalog
+    python benchmarks/bench_tfidf_engine.py --csv medicines.csv  # real export of the medicine table
+
+Queries are catalog names, half of them misspelled; recall@k is the share of queries whose intended
+name is among the k results. Also reports fit, save and load times of the persisted engine.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import catalog_frame, load_names, make_queries, percentile
+from catalog import CatalogIndex, clean_text
+from tfidf_index import TfidfIndex
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def recall(index, results, queries):
+    return sum(
+        clean_text(name) in {index.names[position] for position, _ in hits}
+        for hits, (_, name) in zip(results, queries)
+    ) / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", help="CSV export of the medicine table")
+    parser.add_argument("--column", default="name")
+    parser.add_argument("--size", type=int, default=50000, help="synthetic catalog size")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    names = load_names(args.csv, args.column, args.size)
+    frame = catalog_frame(names)
+    index = CatalogIndex(frame)
+    queries = make_queries(names, args.queries)
+    cleaned = [clean_text(query) for query, _ in queries]
+    print(f"catalog: {len(names)} names, {len(queries)} queries, top_k={args.top_k}")
+
+    tfidf, fit_ms = timed(TfidfIndex.fit, index.names)
+    path = os.path.join(tempfile.mkdtemp(), "tfidf_index.npz")
+    _, save_ms = timed(tfidf.save, path, index.medicine_ids(frame))
+    _, load_ms = timed(TfidfIndex.load, path)
+    print(f"fit {fit_ms / 1000:.1f}s   save {save_ms:.0f} ms   load {load_ms:.0f} ms   "
+          f"size {os.path.getsize(path) / 2**20:.1f} MiB   in memory {tfidf.memory_bytes() / 2**20:.1f} MiB")
+
+    engines = {
+        "wratio (prefilter)": lambda batch: index.search_many(batch, 50, args.top_k),
+        "tfidf": lambda batch: tfidf.search_many(batch, 50, args.top_k),
+    }
+    for label, search in engines.items():
+        single = [timed(search, [query])[1] for query in cleaned[:100]]
+        results, batch_ms = timed(search, cleaned)
+        _, prescription_ms = timed(search, cleaned[:10])
+        print(f"\n{label}")
+        print(f"  recall@{args.top_k}: {recall(index, results, queries):.4f}")
+        print(f"  single query p50 {percentile(single, 50):7.2f} ms   p95 {percentile(single, 95):7.2f} ms")
+        print(f"  10-name prescription {prescription_ms:8.1f} ms   {len(cleaned)} queries {batch_ms:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
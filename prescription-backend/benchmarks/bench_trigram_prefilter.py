@@ -0,0 +1,63 @@
+"""
+Trigram prefilter vs exhaustive WRatio search: recall and latency.
+
+Usage:
+    python benchmarks/bench_trigram_prefilter.py                      # synthetic 50k-name catalog
+    python benchmarks/bench_trigram_prefilter.py --csv medicines.csv  # real export of the medicine table
+
+Recall@k is the share of the exhaustive top-k positions that the prefiltered search also returns.
+Many names score the same, so tie-aware recall also counts a different name with a score at least
+the exhaustive k-th best. Top-1 agreement compares the best score.
+"""
+import argparse
+import time
+
+from common import catalog_frame, load_names, make_queries, percentile
+from catalog import CatalogIndex, clean_text
+
+def run(index, queries, top_k, prefilter):
+    results, timings = [], []
+    for query, _ in queries:
+        query_clean = clean_text(query)
+        start = time.perf_counter()
+        results.append(index.search(query_clean, threshold=50, top_k=top_k, prefilter=prefilter))
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", help="CSV export of the medicine table")
+    parser.add_argument("--column", default="name")
+    parser.add_argument("--size", type=int, default=50000, help="synthetic catalog size")
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    names = load_names(args.csv, args.column, args.size)
+    start = time.perf_counter()
+    index = CatalogIndex(catalog_frame(names))
+    print(f"catalog: {len(names)} names, index built in {time.perf_counter() - start:.2f}s")
+    queries = make_queries(names, args.queries)
+
+    for top_k in (3, 100):
+        exhaustive, full_ms = run(index, queries, top_k, prefilter=False)
+        prefiltered, pre_ms = run(index, queries, top_k, prefilter=True)
+        recalls = [
+            len({p for p, _ in got} & {p for p, _ in want}) / len(want)
+            for got, want in zip(prefiltered, exhaustive) if want
+        ]
+        tie_aware = [
+            sum(1 for _, score in got if score >= want[-1][1]) / len(want)
+            for got, want in zip(prefiltered, exhaustive) if want
+        ]
+        top1 = [
+            got[0][1] == want[0][1]
+            for got, want in zip(prefiltered, exhaustive) if want and got
+        ]
+        print(f"\ntop_k={top_k}")
+        print(f"  recall@{top_k}: {sum(recalls) / len(recalls):.4f}   tie-aware: {sum(tie_aware) / len(tie_aware):.4f}")
+        print(f"  top-1 score agreement: {sum(top1) / len(top1):.4f}")
+        print(f"  exhaustive  p50 {percentile(full_ms, 50):7.2f} ms   p95 {percentile(full_ms, 95):7.2f} ms")
+        print(f"  prefilter   p50 {percentile(pre_ms, 50):7.2f} ms   p95 {percentile(pre_ms, 95):7.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Shared helpers for the search benchmarks: catalog names and perturbed queries."""
+import os
+import random
+import sys
+
+import pandas as pd
+
+# Benchmarks import the backend modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+SYLLABLES = [
+    "pa", "ra", "ce", "ta", "mol", "azi", "thral", "zit", "rol", "pan", "dol", "cin", "xa",
+    "lo", "vi", "fen", "met", "for", "min", "cal", "de", "xo", "pro", "zo", "lin", "tri", "gab",
+]
+SUFFIXES = ["", "", " 10", " 20", " 40", " 250", " 500", " 650", " SR", " DSR", " Plus", " Forte", " Syrup", " Tablet"]
+
+def load_names(csv_path=None, column="name", size=50000, seed=0):
+    """Catalog names from a CSV export of the medicine table, or a synthetic brand-like catalog."""
+    if csv_path:
+        return pd.read_csv(csv_path, usecols=[column])[column].dropna().astype(str).tolist()
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title() + rng.choice(SUFFIXES)
+        for _ in range(size)
+    ]
+
+def catalog_frame(names):
+    """Minimal catalog frame for building a CatalogIndex over the names."""
+    return pd.DataFrame({
+        "id": range(1, len(names) + 1), "name": names,
+        "short_composition1": None, "short_composition2": None,
+    })
+
+def perturb(name, rng):
+    """A misspelled variant of a name: dropped, swapped, replaced or doubled letters, or a lost token."""
+    chars = list(name)
+    for _ in range(rng.randint(1, 2)):
+        if len(chars) < 4:
+            break
+        i = rng.randrange(1, len(chars) - 1)
+        edit = rng.choice(["drop", "swap", "replace", "double"])
+        if edit == "drop":
+            del chars[i]
+        elif edit == "swap":
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        elif edit == "replace":
+            chars[i] = rng.choice("aeiouklmnrst")
+        else:
+            chars.insert(i, chars[i])
+    text = "".join(chars)
+    if " " in text and rng.random() < 0.2:
+        text = text.split(" ")[0]
+    return text
+
+def make_queries(names, count=500, seed=1):
+    """(query, intended name) pairs: half exact names, half perturbed."""
+    rng = random.Random(seed)
+    picked = rng.sample(names, min(count, len(names)))
+    return [(name if i % 2 == 0 else perturb(name, rng), name) for i, name in enumerate(picked)]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
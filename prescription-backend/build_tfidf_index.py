@@ -0,0 +1,61 @@
+"""
+Fit the TF-IDF search engine offline and persist it, so the backend loads it at startup instead of fitting.
+
+Usage (from prescription-backend/):
+    python build_tfidf_index.py                        # read the medicine table from the database
+    python build_tfidf_index.py --csv medicines.csv    # or from a CSV export of it
+    python build_tfidf_index.py --out /data/tfidf_index.npz
+
+The backend picks the file up from TFIDF_INDEX_PATH (default: tfidf_index.npz next to main.py).
+Rows added or edited after the build are re-vectorized at startup, so a stale file is still usable.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from catalog import search_texts
+from db import DatabasePool
+from tfidf_index import TfidfIndex
+
+COLUMNS = ["id", "name", "short_composition1", "short_composition2"]
+
+def fetch_from_database():
+    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
+    db = DatabasePool(
+        minconn=1,
+        maxconn=1,
+        user=os.getenv("user"),
+        password=os.getenv("password"),
+        host=os.getenv("host"),
+        port=os.getenv("port"),
+        dbname=os.getenv("dbname")
+    )
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM medicine")
+            return pd.DataFrame(cursor.fetchall(), columns=COLUMNS)
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", help="CSV export of the medicine table instead of the database")
+    parser.add_argument("--out", default=os.getenv(
+        "TFIDF_INDEX_PATH", os.path.join(os.path.dirname(__file__), "tfidf_index.npz")
+    ))
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, usecols=COLUMNS) if args.csv else fetch_from_database()
+    start = time.perf_counter()
+    # Same rows and texts as the backend's catalog index: every medicine with a name
+    rows = np.flatnonzero(df["name"].notna().to_numpy())
+    index = TfidfIndex.fit(search_texts(df, rows))
+    index.save(args.out, df["id"].to_numpy()[rows])
+    print(f" Fitted TF-IDF engine on {len(rows)} medicines in {time.perf_counter() - start:.1f}s -> {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import io
+
+import psycopg2
+
+from catalog import MEDICINE_FIELDS
+
+# Columns an import file may carry; updated_at is stamped by the database
+IMPORT_COLUMNS = MEDICINE_FIELDS
+# Parquet batch converted to CSV and sent to COPY at a time
+PARQUET_BATCH_ROWS = 16_384
+# Written as whole numbers even when a Parquet file stores them as floats (pandas does so for
+# integer columns with missing values), since "12.0" is not valid input for an integer column
+INTEGER_COLUMNS = ["id", "quantity_available"]
+
+class ImportRejected(Exception):
+    """The file cannot be imported (bad header, unreadable file, invalid value); nothing was written."""
+
+class ChunkStream(io.RawIOBase):
+    """Readable file over an iterator of byte chunks, for feeding generated data to COPY."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+def check_columns(columns):
+    """Reject a header naming unknown or repeated columns, lacking id, or carrying nothing else."""
+    unknown = [column for column in columns if column not in IMPORT_COLUMNS]
+    if unknown:
+        raise ImportRejected(
+            f"Unknown columns: {', '.join(unknown)}. Choose from: {', '.join(IMPORT_COLUMNS)}."
+        )
+    if len(set(columns)) < len(columns):
+        raise ImportRejected("Columns must not repeat.")
+    if "id" not in columns:
+        raise ImportRejected("An id column is required.")
+    if len(columns) < 2:
+        raise ImportRejected("Nothing to import besides id.")
+
+def csv_columns(file):
+    """Column names on the header line of a CSV file, leaving the file at its start."""
+    import csv
+
+    try:
+        header = file.readline().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ImportRejected("The CSV file must be UTF-8 encoded.")
+    file.seek(0)
+    columns = next(csv.reader([header]), [])
+    return [column.strip() for column in columns]
+
+def parquet_csv_chunks(parquet_file):
+    """Record batches of a Parquet file as headerless CSV chunks, in file column order."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+
+    options = pa_csv.WriteOptions(include_header=False)
+    for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS):
+        arrays = []
+        for name, array in zip(batch.schema.names, batch.columns):
+            if pa.types.is_dictionary(array.type):
+                array = array.dictionary_decode()
+            if name in INTEGER_COLUMNS and pa.types.is_floating(array.type):
+                array = pc.cast(array, pa.int64())
+            elif name == "expiry_date" and pa.types.is_timestamp(array.type):
+                array = pc.cast(array, pa.date32())
+            arrays.append(array)
+        out = io.BytesIO()
+        pa_csv.write_csv(pa.RecordBatch.from_arrays(arrays, names=batch.schema.names), out, options)
+        yield out.getvalue()
+
+def build_upsert_sql(columns, returning):
+    """
+    One statement applying the staged rows: the last line of each id wins, new ids are inserted,
+    and existing rows are only updated where an imported value differs, so unchanged rows keep
+    their updated_at. Each result row is (inserted, values of `returning`).
+    """
+    names = ", ".join(f'"{column}"' for column in columns)
+    values = [column for column in columns if column != "id"]
+    assignments = ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in values)
+    current = ", ".join(f'm."{column}"' for column in values)
+    excluded = ", ".join(f'EXCLUDED."{column}"' for column in values)
+    returned = ", ".join(f'm."{column}"' for column in returning)
+    return f"""
+    INSERT INTO medicine AS m ({names})
+    SELECT DISTINCT ON (id) {names} FROM medicine_import ORDER BY id, import_line DESC
+    ON CONFLICT (id) DO UPDATE SET {assignments}
+    WHERE ROW({current}) IS DISTINCT FROM ROW({excluded})
+    RETURNING m.xmax = 0, {returned}
+    """
+
+def import_medicines(cursor, file, file_format, returning):
+    """
+    Upsert the rows of a CSV or Parquet file (binary, seekable) into the medicine table in one
+    transaction: the file is streamed into a temporary staging table with COPY and applied with a
+    single INSERT ... ON CONFLICT. Columns left out of the file keep their values; rows are never
+    deleted. Raises ImportRejected on a bad file; the caller must then roll back, which the
+    connection context of DatabasePool does for any exception.
+    Returns (lines read, distinct medicines, medicines inserted, changed rows as values of `returning`).
+    """
+    parquet_file = None
+    if file_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportRejected("Parquet imports need pyarrow installed on the server.")
+        try:
+            parquet_file = pq.ParquetFile(file)
+        except Exception as e:
+            raise ImportRejected(f"Unreadable Parquet file: {e}")
+        columns = parquet_file.schema_arrow.names
+    else:
+        columns = csv_columns(file)
+    check_columns(columns)
+
+    names = ", ".join(f'"{column}"' for column in columns)
+    try:
+        # Staging columns take the medicine table's types, so COPY validates every value
+        cursor.execute(f"""
+        CREATE TEMP TABLE medicine_import ON COMMIT DROP AS SELECT {names} FROM medicine WITH NO DATA;
+        ALTER TABLE medicine_import ADD COLUMN import_line bigserial
+        """)
+        if parquet_file is not None:
+            copy = f"COPY medicine_import ({names}) FROM STDIN WITH (FORMAT csv)"
+            cursor.copy_expert(copy, ChunkStream(parquet_csv_chunks(parquet_file)))
+        else:
+            copy = f"COPY medicine_import ({names}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+            cursor.copy_expert(copy, file)
+        cursor.execute("SELECT count(*), count(DISTINCT id) FROM medicine_import")
+        lines, medicines = cursor.fetchone()
+        cursor.execute(build_upsert_sql(columns, returning))
+        results = cursor.fetchall()
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        raise ImportRejected(str(e).strip())
+
+    inserted = sum(1 for was_inserted, *_ in results if was_inserted)
+    return lines, medicines, inserted, [row for _, *row in results]
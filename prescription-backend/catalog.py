@@ -0,0 +1,929 @@
+import copy
+import math
+import re
+import secrets
+import threading
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz
+
+from pagination import SortIndex, sort_keys_for
+from composition_index import COMPOSITION_COLUMNS, CompositionIndex
+from flat_arrays import IntTable, PackedStrings, strings_memory_bytes
+from json_fragments import Raw, RowFragments, close_object, dumps, open_object
+from phonetic_index import PhoneticIndex
+from substitute_graph import SUBSTITUTE_COLUMNS, SubstituteGraph
+from tfidf_index import TfidfIndex
+from trigram_index import TrigramIndex
+
+NS_PER_DAY = 86_400 * 10**9
+
+# Trigram prefilter: candidates reranked by WRatio, and the fewest worth reranking before
+# falling back to a full scan
+TRIGRAM_CANDIDATES = 2000
+# Candidates scored per requested hit when top_k is large
+TRIGRAM_CANDIDATES_PER_HIT = 100
+TRIGRAM_MIN_CANDIDATES = 50
+# Changed names tracked in the trigram overlay before the postings are rebuilt
+TRIGRAM_OVERLAY_LIMIT = 5000
+
+# Phonetic mode: names sharing a Double Metaphone key with the query that are reranked by WRatio
+PHONETIC_CANDIDATES = 2000
+
+# Changed texts kept as TF-IDF overlay vectors before the engine is refitted
+TFIDF_OVERLAY_LIMIT = 5000
+
+# Stock-only versions Catalog remembers for stock_delta; when there are more, the older half is forgotten
+STOCK_JOURNAL_LIMIT = 10000
+
+# Columns the search, substitute and composition indexes are built from; rows where only other
+# columns change (stock, price, expiry...) keep their index entries
+INDEXED_COLUMNS = ["name", *COMPOSITION_COLUMNS, *SUBSTITUTE_COLUMNS]
+
+# Columns returned for every medicine match, in response order
+MEDICINE_FIELDS = [
+    "id", "name", "price", "quantity_available", "pack_size_label",
+    "short_composition1", "short_composition2",
+    "substitute0", "substitute1", "substitute2", "substitute3", "substitute4",
+    "sideEffect0", "sideEffect1", "sideEffect2", "sideEffect3", "sideEffect4",
+    "use0", "use1", "use2", "use3", "use4",
+    "therapeutic_class", "action_class", "expiry_date"
+]
+
+def clean_text(text):
+    """Removes non-alphanumeric chars and converts to lowercase for fuzzy matching."""
+    if pd.isna(text) or not isinstance(text, str):
+        return ""
+    return re.sub(r'[^a-zA-Z0-9 ]', '', text).lower().strip()
+
+def search_text(name, *compositions):
+    """Text vectorized by the TF-IDF engine: the cleaned name followed by the cleaned compositions."""
+    return " ".join(text for text in map(clean_text, (name, *compositions)) if text)
+
+def search_texts(df, rows):
+    """search_text of each of the given DataFrame row positions."""
+    columns = [df[column].iloc[rows] for column in ("name", "short_composition1", "short_composition2")]
+    return [search_text(*values) for values in zip(*columns)]
+
+def parse_quantity(values):
+    """Quantities as int64; missing or unparsable values count as 0."""
+    return pd.to_numeric(values, errors='coerce').fillna(0).astype(np.int64).to_numpy()
+
+def parse_price(values):
+    """Prices as float64; missing or unparsable values count as 0.0."""
+    return pd.to_numeric(values, errors='coerce').fillna(0.0).astype(np.float64).to_numpy()
+
+def parse_expiry(values):
+    """Expiry dates (YYYY-MM-DD) as datetime64[ns]; missing or unparsable values become NaT."""
+    values = pd.Series(values)
+    as_text = values.where(values.notna(), "").astype(str)
+    return pd.to_datetime(as_text, format='%Y-%m-%d', errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+# Repetitive text columns stored dictionary-encoded (pandas categoricals). Columns in one group
+# share a single dictionary, e.g. substitutes are product names, so they reuse the name dictionary.
+DICTIONARY_GROUPS = [
+    ["name", "substitute0", "substitute1", "substitute2", "substitute3", "substitute4"],
+    ["sideEffect0", "sideEffect1", "sideEffect2", "sideEffect3", "sideEffect4"],
+    ["use0", "use1", "use2", "use3", "use4"],
+    ["short_composition1", "short_composition2"],
+    ["pack_size_label"],
+    ["therapeutic_class"],
+    ["action_class"],
+]
+DICTIONARY_COLUMNS = [column for group in DICTIONARY_GROUPS for column in group]
+
+try:
+    import pyarrow  # noqa: F401
+
+    # Dictionaries held as Arrow strings (flat offsets plus bytes) rather than Python objects,
+    # so a catalog mapped from shared memory (see catalog_store.attach_shared) keeps them in the mapping
+    DICTIONARY_DTYPE = "string[pyarrow]"
+except ImportError:
+    DICTIONARY_DTYPE = object
+
+def group_dtype(columns, categories=None, strings=DICTIONARY_DTYPE):
+    """
+    One categorical dtype covering every value of `columns`, extending `categories` if given, with
+    its dictionary held as `strings`.
+    """
+    values = pd.unique(pd.concat([column.dropna().astype(object) for column in columns], ignore_index=True))
+    if categories is not None:
+        values = categories.append(pd.Index(values, dtype=strings).difference(categories, sort=False))
+    return pd.CategoricalDtype(pd.Index(values, dtype=strings))
+
+def compact_frame(df):
+    """
+    Columnar, compact copy of a raw medicine frame:
+    - id and quantity_available as int64 (missing quantity counts as 0), price as float64 (NaN if missing)
+    - expiry_date as datetime64 (NaT if missing or unparsable), updated_at as UTC datetime64
+    - repetitive text columns dictionary-encoded as categoricals, one dictionary per DICTIONARY_GROUPS entry
+    """
+    compact = pd.DataFrame(index=pd.RangeIndex(len(df)))
+    for column in df.columns:
+        values = df[column].reset_index(drop=True)
+        if column == "id":
+            compact[column] = pd.to_numeric(values).astype(np.int64)
+        elif column == "quantity_available":
+            compact[column] = parse_quantity(values)
+        elif column == "price":
+            compact[column] = pd.to_numeric(values, errors='coerce').astype(np.float64)
+        elif column == "expiry_date":
+            compact[column] = parse_expiry(values)
+        elif column == "updated_at":
+            compact[column] = pd.to_datetime(values, utc=True)
+        else:
+            compact[column] = values.astype(object)
+    for group in DICTIONARY_GROUPS:
+        group = [column for column in group if column in compact]
+        if group:
+            # Codes are looked up against the values themselves (hashing Python strings already in
+            # the frame), then the dictionary is swapped for its DICTIONARY_DTYPE form
+            lookup = group_dtype([compact[column] for column in group], strings=object)
+            dtype = pd.CategoricalDtype(lookup.categories.astype(DICTIONARY_DTYPE))
+            for column in group:
+                codes = compact[column].astype(lookup).cat.codes
+                compact[column] = pd.Categorical.from_codes(codes, dtype=dtype)
+    return compact
+
+def differing(old, new):
+    """Element-wise inequality of two aligned columns of one dtype; two missing values are equal."""
+    old_missing, new_missing = old.isna().to_numpy(), new.isna().to_numpy()
+    unequal = np.asarray(old.array != new.array, dtype=bool)
+    return np.where(old_missing | new_missing, old_missing != new_missing, unequal)
+
+def plain_values(values):
+    """One compact frame column as JSON-friendly values (None for missing, ISO text for dates)."""
+    if values.name == "expiry_date" and values.dtype == "datetime64[ns]":
+        days = values.to_numpy()
+        return np.where(np.isnat(days), None, np.datetime_as_string(days, unit='D')).tolist()
+    if values.name in ("expiry_date", "updated_at"):
+        return [
+            None if pd.isna(value) else
+            value.strftime('%Y-%m-%d') if values.name == "expiry_date" else value.isoformat()
+            for value in values
+        ]
+    if pd.api.types.is_integer_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+        return values.tolist()
+    plain = []
+    for value in values.tolist():
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is pd.NA or isinstance(value, float) and math.isnan(value):
+            value = None
+        plain.append(value)
+    return plain
+
+def plain_records(frame):
+    """Rows of a compact frame as JSON-friendly dicts, built column by column (see plain_values)."""
+    if not len(frame.columns):
+        return [{} for _ in range(len(frame))]
+    columns = list(frame.columns)
+    return [dict(zip(columns, row)) for row in zip(*(plain_values(frame[column]) for column in columns))]
+
+def frame_memory_bytes(df):
+    """Deep memory usage of a frame, counting each shared categorical dictionary once."""
+    total = int(df.index.memory_usage(deep=True))
+    seen_dictionaries = set()
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            total += int(values.cat.codes.memory_usage(index=False))
+            categories = values.cat.categories
+            if id(categories) not in seen_dictionaries:
+                seen_dictionaries.add(id(categories))
+                total += int(categories.memory_usage(deep=True))
+        else:
+            total += int(values.memory_usage(index=False, deep=True))
+    return total
+
+class CatalogIndex:
+    """
+    Search index over the medicine catalog, built once per catalog load.
+    - names: cleaned medicine names as one contiguous list (the rapidfuzz choices); pickled as
+      PackedStrings, which copies turn back into a list
+    - row_ids: position in `names` -> row position in the source DataFrame
+    - trigrams: TrigramIndex over `names`, used to prefilter candidates for WRatio
+    - phonetic: PhoneticIndex over `names`, candidate generator for phonetic search
+    - tfidf: TfidfIndex over the name and compositions of each position, or None until one is
+      installed (see TfidfFitter); a persisted engine (TfidfIndex.load) can be passed in and is
+      aligned to the catalog instead of refitted
+    Result rows are materialized from the compact catalog only for the k hits (see CatalogSnapshot.matches).
+    """
+
+    def __init__(self, df, tfidf=None):
+        has_name = df["name"].notna().to_numpy()
+        self.names = [clean_text(name) for name in df["name"][has_name]]
+        self.row_ids = np.flatnonzero(has_name)
+        # Inverse mapping, row position -> position in `names` (-1 for rows without a name)
+        self.position_of_row = np.full(len(df), -1, dtype=np.int64)
+        self.position_of_row[self.row_ids] = np.arange(len(self.row_ids))
+        self.trigrams = TrigramIndex(self.names)
+        self.phonetic = PhoneticIndex(self.names)
+
+        # Fitting is left to TfidfFitter, off the load path
+        self.tfidf = None
+        if tfidf is not None:
+            self.tfidf = self.aligned_tfidf(df, tfidf)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if not isinstance(self.names, PackedStrings):
+            state["names"] = PackedStrings(self.names)
+        return state
+
+    def aligned_tfidf(self, df, tfidf):
+        """A TF-IDF engine fitted elsewhere, (TfidfIndex, medicine ids of its positions), lined up with these positions."""
+        engine, engine_ids = tfidf
+        return engine.aligned(self.medicine_ids(df), engine_ids, search_texts(df, self.row_ids))
+
+    def medicine_ids(self, df):
+        """Medicine id of every position, e.g. for persisting the TF-IDF engine."""
+        return df["id"].to_numpy()[self.row_ids]
+
+    def copy(self):
+        """Copy whose name list can be updated without touching this index (the arrays are replaced, not mutated)."""
+        clone = object.__new__(type(self))
+        clone.names = list(self.names)
+        clone.row_ids = self.row_ids
+        clone.position_of_row = self.position_of_row
+        clone.trigrams = self.trigrams.copy()
+        clone.phonetic = self.phonetic.copy()
+        clone.tfidf = self.tfidf.copy() if self.tfidf is not None else None
+        return clone
+
+    def update(self, df, rows):
+        """Re-index the given DataFrame row positions, appending rows not indexed yet."""
+        position_of_row = np.concatenate([
+            self.position_of_row, np.full(len(df) - len(self.position_of_row), -1, dtype=np.int64)
+        ])
+        appended_rows, changed, previous = [], [], {}
+        for row, name in zip(rows, df["name"].iloc[rows]):
+            position = position_of_row[row]
+            if position < 0:
+                if pd.isna(name):
+                    continue
+                position = position_of_row[row] = len(self.names)
+                previous[int(position)] = ""
+                self.names.append(clean_text(name))
+                appended_rows.append(row)
+            else:
+                # A row whose name was cleared keeps its slot but can no longer match
+                previous.setdefault(int(position), self.names[position])
+                self.names[position] = clean_text(name)
+            changed.append((int(position), self.names[position]))
+        self.position_of_row = position_of_row
+        if appended_rows:
+            self.row_ids = np.concatenate([self.row_ids, np.array(appended_rows, dtype=np.int64)])
+
+        if len(self.trigrams.overlay) + len(changed) > TRIGRAM_OVERLAY_LIMIT:
+            self.trigrams = TrigramIndex(self.names)
+        else:
+            self.trigrams.update(changed)
+        self.phonetic.update(changed, previous)
+
+        # An overlay grown past TFIDF_OVERLAY_LIMIT is refitted by TfidfFitter, not here
+        if self.tfidf is not None:
+            positions = [position for position, _ in changed]
+            self.tfidf.update(zip(positions, search_texts(df, self.row_ids[positions])))
+
+    def __len__(self):
+        return len(self.names)
+
+    def names_at(self, positions):
+        """Cleaned names at the given positions, as a list."""
+        if isinstance(self.names, PackedStrings):
+            return self.names.take(positions)
+        return [self.names[position] for position in positions]
+
+    def search(self, query_clean, threshold=50, top_k=3, prefilter=True, candidates=None):
+        """
+        WRatio search over the cleaned names, returning (position, score) pairs.
+        With `prefilter`, only the names sharing the most trigrams with the query are scored (at most
+        `candidates`, by default TRIGRAM_CANDIDATES); if that yields too few candidates or fewer than
+        top_k hits, the whole list is scanned instead.
+        """
+        if prefilter:
+            limit = candidates or max(TRIGRAM_CANDIDATES, top_k * TRIGRAM_CANDIDATES_PER_HIT)
+            candidates = self.trigrams.candidates(query_clean, limit)
+            if len(candidates) >= TRIGRAM_MIN_CANDIDATES:
+                hits = process.extract(
+                    query_clean, self.names_at(candidates),
+                    scorer=fuzz.WRatio, limit=top_k, score_cutoff=threshold
+                )
+                if len(hits) >= top_k:
+                    return [(int(candidates[i]), score) for _, score, i in hits]
+
+        hits = process.extract(
+            query_clean, self.names, scorer=fuzz.WRatio, limit=top_k, score_cutoff=threshold
+        )
+        return [(position, score) for _, score, position in hits]
+
+    def search_phonetic(self, query_clean, threshold=50, top_k=3):
+        """
+        WRatio search restricted to names with a token that sounds like a query token (Double Metaphone),
+        for OCR and handwriting misspellings; returns (position, score) pairs like `search`.
+        """
+        candidates = self.phonetic.candidates(query_clean, max(PHONETIC_CANDIDATES, top_k))
+        if not len(candidates):
+            return []
+        hits = process.extract(
+            query_clean, self.names_at(candidates),
+            scorer=fuzz.WRatio, limit=top_k, score_cutoff=threshold
+        )
+        return [(int(candidates[i]), score) for _, score, i in hits]
+
+    def search_many(self, queries_clean, threshold=50, top_k=3):
+        """
+        `search` for each of a batch of cleaned queries (trigram prefilter included), returning a
+        list of (position, score) pairs per query; the batch runs on the calling thread only.
+        """
+        return [self.search(query_clean, threshold=threshold, top_k=top_k) for query_clean in queries_clean]
+
+    def memory_bytes(self):
+        """Approximate footprint of the name list, row mappings and candidate indexes."""
+        return (
+            strings_memory_bytes(self.names) + self.row_ids.nbytes + self.position_of_row.nbytes
+            + self.trigrams.memory_bytes() + self.phonetic.memory_bytes()
+            + (self.tfidf.memory_bytes() if self.tfidf is not None else 0)
+        )
+
+
+class InventoryCounters:
+    """
+    Running inventory aggregates, kept in step with catalog row changes.
+    - total, out_of_stock and low_stock are adjusted per changed row
+    - expiring_soon counts rows expiring before now + expiring_soon_days; it is derived from a
+      per-day histogram of expiry dates and only recomputed when the cutoff day rolls over
+    """
+
+    def __init__(self, low_stock_threshold=5, expiring_soon_days=15):
+        self.low_stock_threshold = low_stock_threshold
+        self.expiring_soon_days = expiring_soon_days
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def copy(self):
+        with self._lock:
+            clone = InventoryCounters(self.low_stock_threshold, self.expiring_soon_days)
+            clone.total, clone.out_of_stock, clone.low_stock = self.total, self.out_of_stock, self.low_stock
+            clone._expiry_days = Counter(self._expiry_days)
+            clone._cutoff_day, clone._expiring_soon = self._cutoff_day, self._expiring_soon
+            return clone
+
+    def rebuild(self, quantity, expiry):
+        """Recompute every aggregate from the full typed columns."""
+        with self._lock:
+            self.total = len(quantity)
+            self.out_of_stock = int(np.count_nonzero(quantity <= 0))
+            self.low_stock = int(np.count_nonzero(self._is_low_stock(quantity)))
+            days, counts = np.unique(self._expiry_days_of(expiry), return_counts=True)
+            self._expiry_days = Counter(dict(zip(days.tolist(), counts.tolist())))
+            self._cutoff_day = None
+            self._expiring_soon = 0
+
+    def replace_rows(self, old_quantity, old_expiry, new_quantity, new_expiry):
+        """Swap the old contribution of changed rows for the new one (old arrays are empty for new rows)."""
+        with self._lock:
+            self.total += len(new_quantity) - len(old_quantity)
+            self.out_of_stock += int(np.count_nonzero(new_quantity <= 0)) - int(np.count_nonzero(old_quantity <= 0))
+            self.low_stock += (
+                int(np.count_nonzero(self._is_low_stock(new_quantity)))
+                - int(np.count_nonzero(self._is_low_stock(old_quantity)))
+            )
+            for day in self._expiry_days_of(old_expiry).tolist():
+                self._expiry_days[day] -= 1
+                if self._cutoff_day is not None and day < self._cutoff_day:
+                    self._expiring_soon -= 1
+            for day in self._expiry_days_of(new_expiry).tolist():
+                self._expiry_days[day] += 1
+                if self._cutoff_day is not None and day < self._cutoff_day:
+                    self._expiring_soon += 1
+
+    def stats(self, now):
+        """Current aggregates; O(1) except for one histogram pass per day."""
+        cutoff = np.datetime64(now + timedelta(days=self.expiring_soon_days), 'ns')
+        # Expiry dates are midnights, so day d counts while d < cutoff, i.e. d < ceil(cutoff in days)
+        cutoff_day = math.ceil(cutoff.astype(np.int64) / NS_PER_DAY)
+        with self._lock:
+            if cutoff_day != self._cutoff_day:
+                self._expiring_soon = sum(
+                    count for day, count in self._expiry_days.items() if day < cutoff_day
+                )
+                self._cutoff_day = cutoff_day
+            return {
+                "total_items": self.total,
+                "low_stock_items": self.low_stock,
+                "out_of_stock": self.out_of_stock,
+                "expiring_soon": self._expiring_soon
+            }
+
+    def _is_low_stock(self, quantity):
+        return (quantity > 0) & (quantity < self.low_stock_threshold)
+
+    @staticmethod
+    def _expiry_days_of(expiry):
+        """Day numbers (days since epoch) of the non-missing expiry dates."""
+        return expiry[~np.isnat(expiry)].astype('datetime64[D]').astype(np.int64)
+
+def new_epoch():
+    """Random id of a catalog lineage; versions only count up within one epoch."""
+    return secrets.token_hex(4)
+
+class CatalogSnapshot:
+    """
+    Immutable view of the catalog at one version; request handlers read it without copying.
+    - df: the compact, columnar medicine frame (see compact_frame; RangeIndex, one row per medicine)
+    - index: CatalogIndex over the names
+    - substitutes: SubstituteGraph resolving each row's substitute names to catalog rows
+    - compositions: CompositionIndex grouping rows with the same normalized composition
+    - quantity/price/expiry: typed numpy columns aligned with DataFrame rows (missing price as 0.0)
+    - counters: running inventory aggregates (see InventoryCounters)
+    - row_of_id: medicine id -> row position (flat_arrays.IntTable)
+    - watermark: latest `updated_at` seen, used to pull only changed rows
+    - fragments: pre-encoded JSON of rows already served (see json_fragments.RowFragments)
+    - epoch: random id given to every full load and restored snapshot and inherited by the snapshots
+      derived from it, so (epoch, version) names one content even across restarts and processes
+    Nothing here is mutated once the snapshot is published (sort indexes and fragments are derived
+    lazily); updates build a new snapshot.
+    """
+
+    def __init__(self, version, df, index, substitutes, compositions, counters, row_of_id, watermark,
+                 fragments=None, epoch=None):
+        self.version = version
+        self.epoch = epoch or new_epoch()
+        self.df = df
+        self.index = index
+        self.substitutes = substitutes
+        self.compositions = compositions
+        self.quantity = df["quantity_available"].to_numpy()
+        self.price = np.nan_to_num(df["price"].to_numpy(), nan=0.0)
+        self.expiry = df["expiry_date"].to_numpy()
+        self.counters = counters
+        self.row_of_id = row_of_id
+        self.watermark = watermark
+        self.fragments = fragments if fragments is not None else RowFragments()
+        self._sort_indexes = {}
+        self._memory_bytes = None
+
+    def __getstate__(self):
+        # Sort indexes are cheap to rebuild lazily and not worth persisting
+        state = self.__dict__.copy()
+        state["_sort_indexes"] = {}
+        return state
+
+    def sort_index(self, sort_by):
+        """SortIndex for a column, built on first use and kept for the life of this snapshot."""
+        index = self._sort_indexes.get(sort_by)
+        if index is None:
+            index = SortIndex(sort_keys_for(self, sort_by), self.df["id"].to_numpy())
+            self._sort_indexes[sort_by] = index
+        return index
+
+    def records(self, rows, fields=None):
+        """JSON-friendly dicts for the given row positions; only these rows (and fields) are materialized."""
+        if fields is None:
+            return plain_records(self.df.iloc[rows])
+        return plain_records(self.df.iloc[rows, [self.df.columns.get_loc(field) for field in fields]])
+
+    def values(self, rows, column):
+        """JSON-friendly values of one column at the given row positions (see plain_values)."""
+        return plain_values(self.df[column].iloc[rows])
+
+    def medicine_fragments(self, rows):
+        """Open JSON fragments (see json_fragments.open_object) of the MEDICINE_FIELDS records of rows."""
+        return self.fragments.get(
+            "medicine", [int(row) for row in rows],
+            lambda missing: [open_object(record) for record in self.records(missing, MEDICINE_FIELDS)]
+        )
+
+    def hit_rows(self, hits):
+        """Row positions of (index position, score) search hits."""
+        return [int(self.index.row_ids[position]) for position, _ in hits]
+
+    def matches(self, hits, fields=None):
+        """
+        Encoded results for (index position, score) search hits, tagged with their similarity score.
+        `fields` limits each result to those MEDICINE_FIELDS (and "similarity_score"), in that order;
+        other names in it are left to the caller.
+        """
+        rows = self.hit_rows(hits)
+        if fields is not None:
+            matched = self.records(rows, [field for field in fields if field in MEDICINE_FIELDS])
+            if "similarity_score" in fields:
+                for match, (_, score) in zip(matched, hits):
+                    match["similarity_score"] = score / 100.0
+            return [Raw(dumps(match)) for match in matched]
+
+        fragments = self.medicine_fragments(rows)
+        return [
+            close_object(fragment, {"similarity_score": score / 100.0})
+            for fragment, (_, score) in zip(fragments, hits)
+        ]
+
+    def memory_bytes(self):
+        """Approximate resident size of the catalog data and its derived indexes (measured once)."""
+        if self._memory_bytes is None:
+            self._memory_bytes = (
+                frame_memory_bytes(self.df) + self.index.memory_bytes() + self.substitutes.memory_bytes()
+                + self.compositions.memory_bytes()
+            )
+        return self._memory_bytes
+
+    @classmethod
+    def build(cls, version, df, low_stock_threshold=5, expiring_soon_days=15, tfidf=None):
+        """Snapshot of a fully loaded (raw) catalog frame; `tfidf` is a persisted engine to reuse."""
+        df = compact_frame(df)
+        counters = InventoryCounters(low_stock_threshold, expiring_soon_days)
+        counters.rebuild(df["quantity_available"].to_numpy(), df["expiry_date"].to_numpy())
+        index = CatalogIndex(df, tfidf)
+        return cls(
+            version=version,
+            df=df,
+            index=index,
+            substitutes=SubstituteGraph(df, clean_text),
+            compositions=CompositionIndex(df),
+            counters=counters,
+            row_of_id=IntTable(df["id"].to_numpy(), np.arange(len(df))),
+            watermark=df["updated_at"].max() if len(df) else None
+        )
+
+    def with_changes(self, changed_df):
+        """
+        Upsert changed rows (matched on id) into a new snapshot.
+        Returns (snapshot, rows applied), or None if nothing differs from this snapshot.
+        Untouched structures are shared; the ones that change are copied first, and only rows
+        whose INDEXED_COLUMNS changed are re-indexed.
+        """
+        columns = list(self.df.columns)
+        changed = compact_frame(changed_df[columns])
+        watermark = changed["updated_at"].max()
+        if self.watermark is not None and not watermark > self.watermark:
+            watermark = self.watermark
+
+        existing = self.row_of_id.lookup(changed["id"].to_numpy())
+        new_at = np.flatnonzero(existing < 0)
+        known_at = np.flatnonzero(existing >= 0)
+
+        df = self.df.copy()
+        # Grow each group dictionary with unseen values so both frames share one categorical dtype
+        for group in DICTIONARY_GROUPS:
+            group = [column for column in group if column in df]
+            if not group:
+                continue
+            dtype = df[group[0]].dtype
+            extended = group_dtype([changed[column] for column in group], dtype.categories)
+            if len(extended.categories) > len(dtype.categories):
+                dtype = extended
+                for column in group:
+                    df[column] = df[column].astype(dtype)
+            for column in group:
+                changed[column] = changed[column].astype(dtype)
+
+        # Compare the known rows column by column against what is loaded
+        row_changed = np.zeros(len(known_at), dtype=bool)
+        reindex = np.zeros(len(known_at), dtype=bool)
+        for column in columns:
+            column_changed = differing(
+                df[column].iloc[existing[known_at]].reset_index(drop=True),
+                changed[column].iloc[known_at].reset_index(drop=True)
+            )
+            row_changed |= column_changed
+            if column in INDEXED_COLUMNS:
+                reindex |= column_changed
+        updated_rows = existing[known_at[row_changed]].tolist()
+        updated_at = known_at[row_changed]
+        if not updated_rows and not len(new_at):
+            return None
+
+        if updated_rows:
+            for column in columns:
+                df.iloc[updated_rows, df.columns.get_loc(column)] = changed[column].iloc[updated_at].array
+        rows = list(updated_rows)
+        indexed_rows = existing[known_at[reindex]].tolist()
+        row_of_id = self.row_of_id
+        if len(new_at):
+            start = len(df)
+            appended = changed.iloc[new_at]
+            df = pd.concat([df, appended], ignore_index=True)
+            row_of_id = row_of_id.with_entries(appended["id"].to_numpy(), np.arange(start, len(df)))
+            rows.extend(range(start, len(df)))
+            indexed_rows.extend(range(start, len(df)))
+
+        index, substitutes, compositions = self.index, self.substitutes, self.compositions
+        if indexed_rows:
+            index = index.copy()
+            index.update(df, indexed_rows)
+            substitutes = substitutes.copy()
+            substitutes.update(df, indexed_rows)
+            compositions = compositions.copy()
+            compositions.update(df, indexed_rows)
+
+        counters = self.counters.copy()
+        counters.replace_rows(
+            self.quantity[updated_rows], self.expiry[updated_rows],
+            df["quantity_available"].to_numpy()[rows], df["expiry_date"].to_numpy()[rows]
+        )
+
+        return CatalogSnapshot(
+            version=self.version + 1,
+            df=df,
+            index=index,
+            substitutes=substitutes,
+            compositions=compositions,
+            counters=counters,
+            row_of_id=row_of_id,
+            watermark=watermark,
+            fragments=self.fragments.without(rows),
+            epoch=self.epoch
+        ), len(rows)
+
+    def with_tfidf(self, tfidf):
+        """
+        New snapshot whose index uses a TF-IDF engine fitted elsewhere, (TfidfIndex, medicine ids
+        of its positions); rows fitted with other texts than they have now go to its overlay.
+        """
+        index = self.index.copy()
+        index.tfidf = index.aligned_tfidf(self.df, tfidf)
+        return CatalogSnapshot(
+            version=self.version + 1,
+            df=self.df,
+            index=index,
+            substitutes=self.substitutes,
+            compositions=self.compositions,
+            counters=self.counters,
+            row_of_id=self.row_of_id,
+            watermark=self.watermark,
+            fragments=self.fragments,
+            epoch=self.epoch
+        )
+
+    def renumbered(self, version):
+        """The same content under another version, e.g. a published version that changed nothing here."""
+        clone = copy.copy(self)
+        clone.version = version
+        return clone
+
+    def with_stock(self, stock):
+        """
+        New snapshot where only the quantity_available and updated_at of existing rows change, as
+        after an order: names and texts are untouched, so every index is shared as it is.
+        `stock` maps medicine ids to (quantity, updated_at). The watermark is left alone, so the
+        next refresh still reads these rows (and finds them unchanged).
+        Returns (snapshot, rows applied), or None if nothing differs from this snapshot.
+        """
+        rows, quantities, updated_ats = [], [], []
+        current_updated = self.df["updated_at"].array
+        for medicine_id, (quantity, updated_at) in stock.items():
+            row = self.row_of_id.get(medicine_id)
+            if row is not None and (self.quantity[row] != quantity or current_updated[row] != updated_at):
+                rows.append(row)
+                quantities.append(quantity)
+                updated_ats.append(updated_at)
+        if not rows:
+            return None
+
+        quantity = self.quantity.copy()
+        quantity[rows] = quantities
+        updated = current_updated.copy()
+        updated[rows] = pd.to_datetime(updated_ats, utc=True)
+        df = self.df.copy(deep=False)
+        df["quantity_available"] = quantity
+        df["updated_at"] = updated
+
+        counters = self.counters.copy()
+        counters.replace_rows(self.quantity[rows], self.expiry[rows], quantity[rows], self.expiry[rows])
+
+        return CatalogSnapshot(
+            version=self.version + 1,
+            df=df,
+            index=self.index,
+            substitutes=self.substitutes,
+            compositions=self.compositions,
+            counters=counters,
+            row_of_id=self.row_of_id,
+            watermark=self.watermark,
+            fragments=self.fragments.without(rows),
+            epoch=self.epoch
+        ), len(rows)
+
+class Catalog:
+    """
+    Holder of the current CatalogSnapshot. Handlers grab `catalog.snapshot` once per request and
+    read from it; writers build a new snapshot under a lock and swap the reference atomically.
+    The version increases by one every time the catalog content changes.
+    Changed rows are applied by `apply_changes` (`apply_stock` when only quantities changed);
+    deletions need a full `replace`. The stock applied by each `apply_stock` since the last other
+    change is journaled, so the versions it made can be passed on as a delta (see stock_delta).
+    Pass `snapshot` instead of `df` to serve a previously saved snapshot (see catalog_store).
+    """
+
+    def __init__(self, df=None, low_stock_threshold=5, expiring_soon_days=15, tfidf=None, snapshot=None):
+        self.low_stock_threshold = low_stock_threshold
+        self.expiring_soon_days = expiring_soon_days
+        self._lock = threading.Lock()
+        self._stock_journal = []
+        self._journal_start = None
+        self.snapshot = None
+        if snapshot is None:
+            self.replace(df, tfidf)
+        else:
+            self._install(snapshot)
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def watermark(self):
+        return self.snapshot.watermark
+
+    def replace(self, df, tfidf=None):
+        """
+        Swap in a fully reloaded catalog. The new snapshot is built outside the lock, so updates
+        carry on against the current one meanwhile and are dropped by the swap: refresh afterwards
+        to re-apply rows changed while `df` was being built.
+        """
+        snapshot = CatalogSnapshot.build(0, df, self.low_stock_threshold, self.expiring_soon_days, tfidf)
+        with self._lock:
+            snapshot.version = self.snapshot.version + 1 if self.snapshot is not None else 1
+            self._install(snapshot)
+
+    def _install(self, snapshot, stock=None):
+        """Make `snapshot` current (under the lock); `stock` is what it changed if it only changed stock."""
+        self.snapshot = snapshot
+        if stock is None:
+            self._stock_journal = []
+            self._journal_start = snapshot.version
+            return
+        self._stock_journal.append((snapshot.version, stock))
+        if len(self._stock_journal) > STOCK_JOURNAL_LIMIT:
+            forgotten = len(self._stock_journal) // 2
+            self._journal_start = self._stock_journal[forgotten - 1][0]
+            del self._stock_journal[:forgotten]
+
+    def stock_delta(self, since):
+        """
+        (current snapshot, {medicine id: (quantity, updated_at)}) if every version after `since`
+        only changed stock, with the latest stock of each row changed since then; None if anything
+        else changed, or too long ago to tell.
+        """
+        with self._lock:
+            if self._journal_start is None or not self._journal_start <= since <= self.snapshot.version:
+                return None
+            stock = {}
+            for version, changes in self._stock_journal:
+                if version > since:
+                    stock.update(changes)
+            return self.snapshot, stock
+
+    def install_tfidf(self, tfidf):
+        """
+        Publish the current catalog with a TF-IDF engine fitted elsewhere, (TfidfIndex, medicine ids
+        of its positions). Aligning it to the rows happens outside the lock and is redone if the
+        catalog changed in the meantime.
+        """
+        while True:
+            snapshot = self.snapshot
+            candidate = snapshot.with_tfidf(tfidf)
+            with self._lock:
+                if self.snapshot is snapshot:
+                    self._install(candidate)
+                    return
+
+    def apply_changes(self, changed_df):
+        """
+        Upsert changed rows (matched on id) by publishing a new snapshot.
+        Rows identical to what is already loaded are ignored; returns the number of rows applied.
+        """
+        if changed_df.empty:
+            return 0
+        with self._lock:
+            result = self.snapshot.with_changes(changed_df)
+            if result is None:
+                return 0
+            snapshot, applied = result
+            self._install(snapshot)
+            return applied
+
+    def apply_stock(self, stock):
+        """
+        Publish new quantities of existing rows, {medicine id: (quantity, updated_at)}, without
+        touching the indexes (see CatalogSnapshot.with_stock); returns the number of rows applied.
+        """
+        with self._lock:
+            result = self.snapshot.with_stock(stock)
+            if result is None:
+                return 0
+            snapshot, applied = result
+            self._install(snapshot, stock)
+            return applied
+
+    def swap(self, snapshot):
+        """Serve a snapshot built elsewhere, e.g. published by another process (see shared_catalog)."""
+        with self._lock:
+            self._install(snapshot)
+
+class CatalogRefresher(threading.Thread):
+    """
+    Background thread that polls for rows changed since the catalog watermark and applies them.
+    `fetch_changes(since)` must return a DataFrame of rows with updated_at >= since.
+    Rows are stamped with the start of the transaction writing them, so one committing after
+    later writes moved the watermark can be stamped well before it: polls re-read a short overlap
+    window, and with `fetch_horizon()`, the start of the oldest transaction still open (see
+    fetch_transaction_horizon in main.py), back to the horizon taken by the previous poll.
+    """
+
+    def __init__(self, catalog, fetch_changes, interval=30.0, overlap=5.0, fetch_horizon=None):
+        super().__init__(name="catalog-refresher", daemon=True)
+        self.catalog = catalog
+        self.fetch_changes = fetch_changes
+        self.interval = interval
+        self.overlap = overlap
+        self.fetch_horizon = fetch_horizon
+        self._horizon = fetch_horizon() if fetch_horizon is not None else None
+        self._stop_event = threading.Event()
+
+    def refresh_once(self):
+        # Taken before reading, so every transaction the read cannot see yet started after it
+        horizon = self.fetch_horizon() if self.fetch_horizon is not None else None
+        since = self.catalog.watermark
+        if since is not None and self._horizon is not None and self._horizon < since:
+            since = self._horizon
+        if since is not None:
+            since -= pd.Timedelta(seconds=self.overlap)
+        applied = self.catalog.apply_changes(self.fetch_changes(since))
+        if horizon is not None:
+            self._horizon = horizon
+        return applied
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                applied = self.refresh_once()
+                if applied:
+                    print(f" Catalog refreshed: {applied} rows changed, version {self.catalog.version}")
+            except Exception as e:
+                print(f"Error refreshing catalog: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
+
+class TfidfFitter(threading.Thread):
+    """
+    Background thread keeping the catalog's TF-IDF engine fitted, so no load or update waits for
+    a fit: a catalog loaded in full starts without an engine, and one whose overlay of changed
+    texts outgrew TFIDF_OVERLAY_LIMIT is refitted here.
+    - load_persisted(): a persisted (TfidfIndex, medicine ids) to try before fitting, or None
+    - on_fitted(index, medicine ids): called after every fresh fit, e.g. to persist it
+    """
+
+    def __init__(self, catalog, load_persisted=None, on_fitted=None, interval=5.0):
+        super().__init__(name="tfidf-fitter", daemon=True)
+        self.catalog = catalog
+        self.load_persisted = load_persisted
+        self.on_fitted = on_fitted
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def fit_once(self):
+        """Install a fitted engine if the catalog needs one; returns whether it did."""
+        snapshot = self.catalog.snapshot
+        current = snapshot.index.tfidf
+        if current is not None and len(current.overlay) <= TFIDF_OVERLAY_LIMIT:
+            return False
+        if current is None and self.load_persisted is not None:
+            persisted = self.load_persisted()
+            if persisted is not None:
+                # A file far out of date comes with a large overlay and is refitted on the next pass
+                self.catalog.install_tfidf(persisted)
+                return True
+        engine = TfidfIndex.fit(search_texts(snapshot.df, snapshot.index.row_ids))
+        ids = snapshot.index.medicine_ids(snapshot.df)
+        if self.on_fitted is not None:
+            self.on_fitted(engine, ids)
+        self.catalog.install_tfidf((engine, ids))
+        return True
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                if self.fit_once():
+                    print(f" TF-IDF engine ready, catalog version {self.catalog.version}")
+                    continue
+            except Exception as e:
+                print(f"Error fitting TF-IDF engine: {str(e)}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,190 @@
+import gc
+import io
+import mmap
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from catalog import new_epoch
+
+# Bump whenever the pickled structure of CatalogSnapshot or its indexes changes
+SNAPSHOT_FORMAT = 4
+
+def save_snapshot(snapshot, path, stamp):
+    """
+    Write a catalog snapshot (data plus prebuilt indexes) to `path`, replacing it atomically.
+    `stamp` describes what the snapshot was built for (columns, thresholds, ...); load_snapshot
+    only accepts files whose stamp matches.
+    """
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "stamp": stamp,
+        "version": snapshot.version,
+        "watermark": snapshot.watermark,
+        "saved_at": time.time(),
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def load_snapshot(path, stamp):
+    """
+    The CatalogSnapshot saved at `path`, or None if there is none or it was saved for another stamp.
+    The file is a pickle: only point this at files the backend wrote itself.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if header.get("format") != SNAPSHOT_FORMAT or header.get("stamp") != stamp:
+                return None
+            # Unpickling allocates millions of small objects; collector passes would only slow it down
+            gc.disable()
+            try:
+                snapshot = pickle.load(f)
+            finally:
+                gc.enable()
+    except FileNotFoundError:
+        return None
+    # Versions after the save may have been served before this restart with other content
+    snapshot.epoch = new_epoch()
+    return snapshot
+
+# Numpy buffers at least this large are stored outside the pickle, page-aligned, and mapped in place
+# by attach_shared; smaller ones are cheaper to copy than to map
+SHARED_BUFFER_MIN_BYTES = 4096
+SHARED_ALIGNMENT = 4096
+
+def _aligned(offset):
+    return -(-offset // SHARED_ALIGNMENT) * SHARED_ALIGNMENT
+
+def _view_as(values, dtype):
+    return values.view(dtype)
+
+class _SharedPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        # datetime64/timedelta64 arrays expose no buffer, so they would be copied into the pickle;
+        # their int64 view goes out of band like any other array
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in "mM" and obj.flags.c_contiguous:
+            return _view_as, (obj.view(np.int64), obj.dtype)
+        return NotImplemented
+
+def publish_shared(snapshot, directory, stamp):
+    """
+    Write a catalog snapshot to a new file in `directory` laid out for memory mapping: a small
+    header, the pickled object graph, then the raw numpy buffers (pickle protocol 5 out-of-band).
+    Returns the file name; readers open it with attach_shared.
+    """
+    buffers = []
+
+    def out_of_band(buffer):
+        # Returning True keeps the buffer inside the pickle
+        if buffer.raw().nbytes < SHARED_BUFFER_MIN_BYTES:
+            return True
+        buffers.append(buffer)
+        return False
+
+    pickled = io.BytesIO()
+    _SharedPickler(pickled, protocol=5, buffer_callback=out_of_band).dump(snapshot)
+    data = pickled.getvalue()
+
+    layout = []
+    offset = 0
+    for buffer in buffers:
+        layout.append((offset, buffer.raw().nbytes))
+        offset = _aligned(offset + buffer.raw().nbytes)
+    header = pickle.dumps({
+        "format": SNAPSHOT_FORMAT,
+        "stamp": stamp,
+        "version": snapshot.version,
+        "watermark": snapshot.watermark,
+        "saved_at": time.time(),
+        "data_bytes": len(data),
+        "buffers": layout,
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    # Buffer offsets are relative to the first aligned position after header and data
+    base = _aligned(8 + len(header) + len(data))
+
+    name = f"catalog-{snapshot.version}-{os.getpid()}-{time.monotonic_ns()}.bin"
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            f.write(data)
+            for buffer, (buffer_offset, _) in zip(buffers, layout):
+                f.seek(base + buffer_offset)
+                f.write(buffer.raw())
+        os.replace(temporary, os.path.join(directory, name))
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return name
+
+def attach_shared(path, stamp):
+    """
+    The CatalogSnapshot in a file written by publish_shared, or None if it was written for another
+    stamp. Its numpy arrays are read-only views of the mapped file, so every process attached to
+    the same file shares one copy of them in the page cache; the file may be deleted meanwhile.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    header_bytes = int.from_bytes(view[:8], "little")
+    header = pickle.loads(view[8:8 + header_bytes])
+    if header.get("format") != SNAPSHOT_FORMAT or header.get("stamp") != stamp:
+        view.release()
+        mapped.close()
+        return None
+    start = 8 + header_bytes
+    data = view[start:start + header["data_bytes"]]
+    base = _aligned(start + header["data_bytes"])
+    buffers = [view[base + offset:base + offset + length] for offset, length in header["buffers"]]
+    gc.disable()
+    try:
+        return pickle.loads(data, buffers=buffers)
+    finally:
+        gc.enable()
+
+def publish_stock_delta(snapshot, stock, base, directory, stamp):
+    """
+    Write the stock changed since a published base file, {medicine id: (quantity, updated_at)}, to
+    a new file in `directory`: attached to the base with with_stock, it gives `snapshot`, so a
+    version that only changed stock is passed on without writing the whole catalog again.
+    Returns the file name; readers open it with load_stock_delta.
+    """
+    delta = {
+        "format": SNAPSHOT_FORMAT,
+        "stamp": stamp,
+        "base": base,
+        "epoch": snapshot.epoch,
+        "version": snapshot.version,
+        "stock": stock,
+    }
+    name = f"delta-{snapshot.version}-{os.getpid()}-{time.monotonic_ns()}.bin"
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".delta-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(delta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, os.path.join(directory, name))
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return name
+
+def load_stock_delta(path, stamp):
+    """The delta in a file written by publish_stock_delta, or None if it was written for another stamp."""
+    with open(path, "rb") as f:
+        delta = pickle.load(f)
+    if delta.get("format") != SNAPSHOT_FORMAT or delta.get("stamp") != stamp:
+        return None
+    return delta
@@ -0,0 +1,141 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from flat_arrays import PackedStrings, Postings
+
+COMPOSITION_COLUMNS = ["short_composition1", "short_composition2"]
+
+# "Amoxycillin  (500mg)" -> salt "Amoxycillin", strength "500", unit "mg"
+INGREDIENT_PATTERN = re.compile(r"^(?P<salt>[^(]*?)\s*(?:\((?P<amount>[\d.]+)\s*(?P<unit>[a-zµ%/ ]*?)\s*\))?\s*$")
+
+# Strength units folded into one canonical unit, with the factor to convert to it
+UNIT_SCALE = {
+    "g": ("mg", 1000.0), "gm": ("mg", 1000.0), "mg": ("mg", 1.0),
+    "mcg": ("mg", 0.001), "µg": ("mg", 0.001), "ug": ("mg", 0.001),
+    "l": ("ml", 1000.0), "ml": ("ml", 1.0),
+    "iu": ("iu", 1.0), "%": ("%", 1.0), "%w/w": ("%", 1.0), "%w/v": ("%", 1.0), "%v/v": ("%", 1.0),
+}
+
+def canonical_ingredient(text):
+    """'Clavulanic Acid (0.125g)' -> 'clavulanic acid 125mg'; None for empty text."""
+    text = text.strip().lower()
+    match = INGREDIENT_PATTERN.match(text)
+    if not match:
+        # Unusual formats are still keyed, just without strength canonicalization
+        return " ".join(re.sub(r"[^a-z0-9.% ]", " ", text).split()) or None
+    salt = " ".join(re.sub(r"[^a-z0-9 ]", " ", match["salt"]).split())
+    if not salt:
+        return None
+    if match["amount"] is None:
+        return salt
+    try:
+        amount = float(match["amount"])
+    except ValueError:
+        return salt
+    unit = match["unit"].replace(" ", "")
+    unit, scale = UNIT_SCALE.get(unit, (unit, 1.0))
+    return f"{salt} {amount * scale:g}{unit}"
+
+@lru_cache(maxsize=65536)
+def composition_key(*compositions):
+    """
+    Order-independent key of a medicine's active ingredients with canonical salts and strengths,
+    e.g. 'amoxycillin 500mg+clavulanic acid 125mg'; None if nothing parses.
+    """
+    ingredients = set()
+    for composition in compositions:
+        if pd.isna(composition) or not isinstance(composition, str):
+            continue
+        for part in composition.split("+"):
+            ingredient = canonical_ingredient(part)
+            if ingredient:
+                ingredients.add(ingredient)
+    return "+".join(sorted(ingredients)) if ingredients else None
+
+def pack_units(label):
+    """Units per pack from a pack size label ('strip of 10 tablets' -> 10); 1 when none is stated."""
+    if pd.isna(label) or not isinstance(label, str):
+        return 1
+    match = re.search(r"\d+", label)
+    return int(match.group()) if match and int(match.group()) > 0 else 1
+
+class CompositionIndex:
+    """
+    Index from normalized composition key to the catalog rows sharing it (generic equivalents).
+    - key_ids/keys: composition key <-> key id (append-only, shared by copies); pickled as
+      PackedStrings only, the dict being rebuilt once a key is added
+    - key_of_row: row -> key id (-1 when the row has no parsable composition)
+    - rows_of_key: key id -> sorted int64 array of rows, as one CSR pair (flat_arrays.Postings)
+    Arrays are replaced, never mutated, so copies only copy the keys changed since building.
+    """
+
+    def __init__(self, df):
+        self.key_ids = {}
+        self.keys = []
+        keys = [composition_key(*values) for values in zip(*(df[column].astype(object).tolist() for column in COMPOSITION_COLUMNS))]
+        self.key_of_row = np.array([self._intern(key) for key in keys], dtype=np.int32)
+        keyed = np.flatnonzero(self.key_of_row >= 0)
+        offsets = np.zeros(len(self.keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.key_of_row[keyed], minlength=len(self.keys)), out=offsets[1:])
+        self.rows_of_key = Postings(offsets, keyed[np.argsort(self.key_of_row[keyed], kind="stable")])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if not isinstance(self.keys, PackedStrings):
+            state["keys"] = PackedStrings(self.keys)
+        state["key_ids"] = None
+        return state
+
+    def _intern(self, key):
+        if key is None:
+            return -1
+        if self.key_ids is None:
+            self.keys = list(self.keys)
+            self.key_ids = {key: key_id for key_id, key in enumerate(self.keys)}
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            key_id = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        clone.key_ids, clone.keys = self.key_ids, self.keys
+        clone.key_of_row = self.key_of_row
+        clone.rows_of_key = self.rows_of_key.copy()
+        return clone
+
+    def update(self, df, rows):
+        """Re-key the given DataFrame row positions, appending rows not seen yet."""
+        rows = np.asarray(rows, dtype=np.int64)
+        key_of_row = np.concatenate([self.key_of_row, np.full(len(df) - len(self.key_of_row), -1, dtype=np.int32)])
+        previous = key_of_row[rows].copy()
+        compositions = [df[column].iloc[rows].tolist() for column in COMPOSITION_COLUMNS]
+        key_of_row[rows] = [self._intern(composition_key(*values)) for values in zip(*compositions)]
+        self.key_of_row = key_of_row
+
+        for key_id in set(previous.tolist()) | set(key_of_row[rows].tolist()):
+            if key_id < 0:
+                continue
+            members = self.rows_of_key.get(key_id, np.array([], dtype=np.int64))
+            members = np.union1d(np.setdiff1d(members, rows), rows[key_of_row[rows] == key_id])
+            self.rows_of_key.set(key_id, members.astype(np.int64))
+
+    def key_of(self, row):
+        """Composition key of a row, or None."""
+        key_id = int(self.key_of_row[row])
+        return None if key_id < 0 else self.keys[key_id]
+
+    def equivalents(self, row):
+        """Rows sharing the row's composition key, the row itself excluded."""
+        key_id = int(self.key_of_row[row])
+        if key_id < 0:
+            return np.array([], dtype=np.int64)
+        members = self.rows_of_key.get(key_id, np.array([], dtype=np.int64))
+        return members[members != row]
+
+    def memory_bytes(self):
+        return self.key_of_row.nbytes + self.rows_of_key.memory_bytes()
@@ -0,0 +1,76 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class PoolBusy(RuntimeError):
+    """Every worker is busy and the wait queue is full."""
+
+class PoolTimeout(TimeoutError):
+    """The work did not finish within the pool's timeout."""
+
+class CPUPool:
+    """
+    Bounded thread pool for the CPU-heavy part of request handlers (fuzzy scoring, sorting,
+    materializing and encoding pages), so the event loop keeps serving other requests meanwhile.
+    - workers: threads running work; rapidfuzz, numpy and orjson release the GIL for much of it
+    - max_queue: calls allowed to wait for a free worker; beyond that `run` raises PoolBusy at once
+    - timeout: seconds a caller waits (queueing included) before `run` raises PoolTimeout
+    A call that times out still holds its slot until its work finishes (threads cannot be
+    interrupted), so the pool never runs or queues more than workers + max_queue calls.
+    """
+
+    def __init__(self, workers=4, max_queue=64, timeout=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu-pool")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += not future.cancelled()
+
+    async def run(self, fn, *args, **kwargs):
+        """Result of fn(*args, **kwargs) computed on a pool thread."""
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise PoolBusy(f"{self._in_flight} calls already running or queued")
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            # Timing out cancels the work if it is still queued; running work is left to finish
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"no result within {self.timeout:g}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "timeout_seconds": self.timeout,
+                "in_flight": self._in_flight,
+                "queued": max(0, self._in_flight - self.workers),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
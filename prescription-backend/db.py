@@ -0,0 +1,91 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+class DatabasePool:
+    """
+    Thread-safe pool of psycopg2 connections.
+    - minconn/maxconn: pool size bounds
+    - checkout_timeout: seconds to wait for a free connection before giving up
+    - ping_after: connections idle longer than this are health-checked with SELECT 1 on checkout
+    Broken connections (e.g. dropped by the Supabase pooler) are discarded and replaced transparently.
+    """
+
+    def __init__(self, minconn, maxconn, checkout_timeout=10.0, ping_after=30.0, **connect_kwargs):
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        # ThreadedConnectionPool raises instead of blocking when exhausted, so gate checkouts here
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        # Recently returned connections skip the round trip
+        if last_used is not None and time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        # Every broken connection handed back is replaced by a fresh one, so maxconn attempts
+        # are enough to get through a pool full of stale connections.
+        for _ in range(self._pool.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _release(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commits on success, rolls back on error, always returns it to the pool."""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise psycopg2.OperationalError("Timed out waiting for a database connection")
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        conn.close()
+                raise
+            finally:
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        """Per-request cursor on a pooled connection."""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    def close(self):
+        self._pool.closeall()
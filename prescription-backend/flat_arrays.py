@@ -0,0 +1,192 @@
+import sys
+
+import numpy as np
+
+# Medicine ids outside this range cannot be in an int64 id column
+INT64_MIN, INT64_MAX = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+
+class PackedStrings:
+    """
+    Read-only list of strings as two flat arrays instead of one Python object per string, so a
+    catalog mapped from shared memory (see catalog_store.attach_shared) keeps them in the mapping.
+    - data: the UTF-8 bytes of every string, each followed by a NUL separator
+    - offsets: string i is data[offsets[i]:offsets[i + 1] - 1]
+    Strings are decoded on access; `tolist` decodes all of them at once.
+    """
+
+    def __init__(self, strings):
+        encoded = [string.encode() for string in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(raw) + 1 for raw in encoded], out=self.offsets[1:])
+        self.data = np.frombuffer(b"".join(raw + b"\0" for raw in encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1] - 1
+        return str(memoryview(self.data)[start:end], "utf-8")
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def take(self, positions):
+        """The strings at the given positions, as a list."""
+        data = memoryview(self.data)
+        starts = self.offsets[positions].tolist()
+        ends = (self.offsets[np.asarray(positions) + 1] - 1).tolist()
+        return [str(data[start:end], "utf-8") for start, end in zip(starts, ends)]
+
+    def tolist(self):
+        if not len(self):
+            return []
+        strings = str(memoryview(self.data)[:-1], "utf-8").split("\0")
+        if len(strings) != len(self):
+            # Some string contains a NUL itself
+            return self.take(np.arange(len(self)))
+        return strings
+
+    def memory_bytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+def strings_memory_bytes(strings):
+    """Footprint of a list of strings, or of its packed form."""
+    if isinstance(strings, PackedStrings):
+        return strings.memory_bytes()
+    return sys.getsizeof(strings) + sum(sys.getsizeof(string) for string in strings)
+
+class KeyTable:
+    """
+    Read-only str -> int mapping as a sorted fixed-width bytes array (numpy 'S', keys must not end
+    in NUL) plus the aligned values, looked up by binary search instead of hashing Python strings.
+    """
+
+    def __init__(self, mapping):
+        encoded = np.array([key.encode() for key in mapping], dtype=bytes)
+        order = np.argsort(encoded, kind='stable')
+        self.keys = encoded[order]
+        self.values = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        value = int(self.lookup([key])[0])
+        return default if value < 0 else value
+
+    def lookup(self, keys):
+        """Values of many keys at once, -1 for keys not in the table."""
+        encoded = [key.encode() for key in keys]
+        if not len(self.keys) or not encoded:
+            return np.full(len(encoded), -1, dtype=np.int64)
+        width = self.keys.dtype.itemsize
+        # Casting to the table's width truncates longer keys, which therefore never match
+        fits = np.array([len(raw) <= width for raw in encoded])
+        query = np.array(encoded, dtype=self.keys.dtype)
+        at = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        found = fits & (self.keys[at] == query)
+        return np.where(found, self.values[at], -1)
+
+    def keys_by_value(self):
+        """Every key as str, ordered by value."""
+        return [key.decode() for key in self.keys[np.argsort(self.values, kind='stable')].tolist()]
+
+    def memory_bytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+class IntTable:
+    """
+    Read-only int -> int mapping (e.g. medicine id -> row position) as sorted keys plus the aligned
+    values, looked up by binary search instead of a dict holding two Python ints per entry.
+    """
+
+    def __init__(self, keys, values):
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.values = np.asarray(values, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys.tolist())
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        if not INT64_MIN <= key <= INT64_MAX:
+            return default
+        value = int(self.lookup([key])[0])
+        return default if value < 0 else value
+
+    def lookup(self, keys):
+        """Values of many keys at once, -1 for keys not in the table (values must be >= 0)."""
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        at = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[at] == keys, self.values[at], -1)
+
+    def with_entries(self, keys, values):
+        """New table with the given entries added (their keys must not be in this one)."""
+        return type(self)(np.concatenate([self.keys, keys]), np.concatenate([self.values, values]))
+
+    def memory_bytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+class Postings:
+    """
+    Sorted int lists per key in one CSR pair instead of a dict of small arrays: the list of key id
+    k is members[offsets[k]:offsets[k + 1]]. Keys are those ids themselves, or strings mapped to
+    them by a KeyTable (`keys`). Lists set after building go to `changed` (an empty array where a
+    key was removed), so copies share the CSR arrays and only copy that dict.
+    """
+
+    def __init__(self, offsets, members, keys=None):
+        self.offsets = offsets
+        self.members = members
+        self.keys = keys
+        self.changed = {}
+
+    @classmethod
+    def from_lists(cls, lists, dtype):
+        """Postings of a str -> sorted list mapping, its keys held in a KeyTable."""
+        keys = list(lists)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(lists[key]) for key in keys], out=offsets[1:])
+        members = np.concatenate([np.asarray(lists[key], dtype=dtype) for key in keys] or [np.array([], dtype=dtype)])
+        return cls(offsets, members, KeyTable({key: key_id for key_id, key in enumerate(keys)}))
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        clone.offsets, clone.members, clone.keys = self.offsets, self.members, self.keys
+        clone.changed = dict(self.changed)
+        return clone
+
+    def get(self, key, default=None):
+        members = self.changed.get(key)
+        if members is None:
+            key_id = self.keys.get(key) if self.keys is not None else key
+            if key_id is None or not 0 <= key_id < len(self.offsets) - 1:
+                return default
+            members = self.members[self.offsets[key_id]:self.offsets[key_id + 1]]
+        return members if len(members) else default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, members):
+        """Replace the list of a key; an empty list removes the key."""
+        self.changed[key] = members
+
+    def memory_bytes(self):
+        return (
+            self.offsets.nbytes + self.members.nbytes
+            + (self.keys.memory_bytes() if self.keys is not None else 0)
+            + sum(members.nbytes for members in self.changed.values())
+        )
@@ -0,0 +1,149 @@
+import zlib
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+# Bodies smaller than this go out uncompressed; the headers would eat most of the saving
+COMPRESSION_MINIMUM_SIZE = 1024
+GZIP_LEVEL = 6
+# Brotli quality 4 compresses better than gzip -6 at a similar speed; 11 is far too slow per request
+BROTLI_QUALITY = 4
+
+def accepted_encoding(accept_encoding):
+    """'br' or 'gzip' (in that order of preference) if the client accepts it, else None."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(coding.strip())
+    for coding in ("br", "gzip"):
+        if coding in accepted:
+            return coding
+    return None
+
+class Compressor:
+    """Incremental brotli or gzip compressor; every chunk is flushed so streams stay incremental."""
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data):
+        if self.coding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b""):
+        if self.coding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip compression of response bodies of at least `minimum_size` bytes, by the
+    client's Accept-Encoding. Streamed responses are compressed chunk by chunk as they are sent.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        coding = None
+        if scope["type"] == "http":
+            coding = accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compressing is worth it
+                start = message
+                passthrough = "content-encoding" in Headers(raw=message["headers"])
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start is not None:
+                initial, start = start, None
+                if passthrough or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(initial)
+                    await send(message)
+                    return
+                compressor = Compressor(coding)
+                headers = MutableHeaders(raw=initial["headers"])
+                headers["Content-Encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                    body = compressor.chunk(body)
+                else:
+                    body = compressor.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                await send(initial)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            if passthrough:
+                await send(message)
+                return
+            body = compressor.chunk(body) if more_body else compressor.finish(body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header lists `etag` (weak comparison, as RFC 9110 asks for GETs)."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+class ETagMiddleware:
+    """
+    ETags for GET responses whose content is fully determined by a cheap key, such as the
+    catalog version plus the request URL. `tag(scope)` returns the ETag for a request, or None for
+    requests that must not be tagged. A matching If-None-Match is answered with 304 before the
+    endpoint runs, so a revalidation costs neither computation nor body bytes.
+    """
+
+    def __init__(self, app, tag):
+        self.app = app
+        self.tag = tag
+
+    async def __call__(self, scope, receive, send):
+        etag = None
+        if scope["type"] == "http" and scope["method"] == "GET":
+            etag = self.tag(scope)
+        if etag is None:
+            await self.app(scope, receive, send)
+            return
+
+        validator_headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            await send({"type": "http.response.start", "status": 304, "headers": validator_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_tagged(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = dict(message, headers=list(message.get("headers", [])) + validator_headers)
+            await send(message)
+
+        await self.app(scope, receive, send_tagged)
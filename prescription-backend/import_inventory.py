@@ -0,0 +1,87 @@
+"""
+Bulk restock the medicine table from a CSV or Parquet file, e.g. a distributor invoice.
+
+Usage (from prescription-backend/):
+    python import_inventory.py restock.csv                 # through the running backend
+    python import_inventory.py restock.parquet --url http://localhost:8000
+    python import_inventory.py restock.csv --direct        # straight into the database
+
+The file needs an id column plus any medicine fields to set (e.g. quantity_available, price,
+expiry_date); rows with a new id are inserted. Through the backend (POST /management/import) the
+catalog it serves is updated right away; with --direct the backend picks the rows up on its next
+refresh (every CATALOG_REFRESH_INTERVAL seconds), however long the import transaction ran.
+"""
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+from dotenv import load_dotenv
+
+from bulk_import import ImportRejected, import_medicines
+from db import DatabasePool
+
+def import_through_backend(path, file_format, url):
+    with open(path, "rb") as f:
+        request = urllib.request.Request(
+            f"{url.rstrip('/')}/management/import?format={file_format}",
+            data=f,
+            headers={"Content-Length": str(os.path.getsize(path)), "Content-Type": "application/octet-stream"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise SystemExit(f" Import failed ({e.code}): {e.read().decode(errors='replace')}")
+
+def import_into_database(path, file_format):
+    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
+    db = DatabasePool(
+        minconn=1,
+        maxconn=1,
+        user=os.getenv("user"),
+        password=os.getenv("password"),
+        host=os.getenv("host"),
+        port=os.getenv("port"),
+        dbname=os.getenv("dbname")
+    )
+    try:
+        with open(path, "rb") as f, db.cursor() as cursor:
+            lines, medicines, inserted, rows = import_medicines(cursor, f, file_format, ["id"])
+    except ImportRejected as e:
+        raise SystemExit(f" Import failed: {e}")
+    finally:
+        db.close()
+    return {
+        "lines": lines,
+        "medicines": medicines,
+        "inserted": inserted,
+        "updated": len(rows) - inserted,
+        "unchanged": medicines - len(rows),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="CSV (with a header line) or Parquet file")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="default: from the file extension")
+    parser.add_argument("--url", default="http://localhost:8000", help="backend to import through")
+    parser.add_argument("--direct", action="store_true", help="write to the database instead of the backend")
+    args = parser.parse_args()
+
+    file_format = args.format or ("parquet" if args.file.lower().endswith((".parquet", ".pq")) else "csv")
+    start = time.perf_counter()
+    if args.direct:
+        result = import_into_database(args.file, file_format)
+    else:
+        result = import_through_backend(args.file, file_format, args.url)
+    print(
+        f" Imported {result['lines']} lines for {result['medicines']} medicines in "
+        f"{time.perf_counter() - start:.1f}s: {result['inserted']} inserted, {result['updated']} updated, "
+        f"{result['unchanged']} unchanged"
+    )
+
+if __name__ == "__main__":
+    main()
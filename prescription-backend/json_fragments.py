@@ -0,0 +1,97 @@
+import threading
+
+import orjson
+from fastapi.responses import Response
+
+# Row fragments kept per response shape; rows beyond this are encoded per request instead
+FRAGMENT_CACHE_ROWS = 50000
+
+def dumps(value):
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+class Raw(bytes):
+    """Already-encoded JSON, spliced into a response as is."""
+
+def encode(value):
+    """JSON bytes of a value whose dicts and lists may contain Raw fragments."""
+    if isinstance(value, Raw):
+        return value
+    if isinstance(value, dict):
+        return b"{" + b",".join(dumps(str(key)) + b":" + encode(item) for key, item in value.items()) + b"}"
+    if isinstance(value, (list, tuple)):
+        return b"[" + b",".join(map(encode, value)) + b"]"
+    return dumps(value)
+
+def open_object(record):
+    """A record encoded without its closing brace, so fields can still be appended."""
+    return dumps(record)[:-1]
+
+def close_object(fragment, fields=None):
+    """Raw object from an open_object fragment plus the given (key, value) fields."""
+    if not fields:
+        return Raw(fragment + b"}")
+    return Raw(fragment + b"," + b",".join(dumps(key) + b":" + dumps(value) for key, value in fields.items()) + b"}")
+
+def extend_object(encoded, fields):
+    """Raw copy of an encoded JSON object with the given (key, value) fields appended."""
+    if not fields:
+        return Raw(encoded)
+    members = b",".join(dumps(key) + b":" + dumps(value) for key, value in fields.items())
+    return Raw(encoded[:-1] + (b"" if encoded == b"{}" else b",") + members + b"}")
+
+class RawJSONResponse(Response):
+    """JSON response assembled from pre-encoded fragments by byte concatenation (see encode)."""
+    media_type = "application/json"
+
+    def render(self, content):
+        return encode(content)
+
+class RowFragments:
+    """
+    Pre-encoded JSON fragments of catalog rows, per response shape, so a row is serialized once
+    rather than on every response it appears in.
+    - fragments: shape -> {row: fragment}
+    Fragments are encoded on first use, up to `max_rows` per shape. Copies drop only the rows that
+    changed; the fragments themselves are immutable bytes shared by every copy.
+    """
+
+    def __init__(self, max_rows=FRAGMENT_CACHE_ROWS):
+        self.max_rows = max_rows
+        self.fragments = {}
+        self._lock = threading.Lock()
+
+    def get(self, shape, rows, encode_rows):
+        """
+        Fragments of the given rows in the given shape; `encode_rows(rows)` encodes the missing ones
+        (one fragment per row, in order).
+        """
+        with self._lock:
+            cached = self.fragments.setdefault(shape, {})
+            missing = [row for row in dict.fromkeys(rows) if row not in cached]
+        if not missing:
+            return [cached[row] for row in rows]
+
+        encoded = dict(zip(missing, encode_rows(missing)))
+        with self._lock:
+            room = self.max_rows - len(cached)
+            if room > 0:
+                cached.update(list(encoded.items())[:room])
+        return [cached[row] if row in cached else encoded[row] for row in rows]
+
+    def without(self, rows):
+        """Copy that re-encodes the given rows on their next use."""
+        clone = RowFragments(self.max_rows)
+        with self._lock:
+            fragments = {shape: dict(cached) for shape, cached in self.fragments.items()}
+        for cached in fragments.values():
+            for row in rows:
+                cached.pop(row, None)
+        clone.fragments = fragments
+        return clone
+
+    def __getstate__(self):
+        # Fragments are rebuilt on demand; only the configuration is worth persisting
+        return {"max_rows": self.max_rows}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_rows"])
@@ -1,15 +1,43 @@
-from fastapi import FastAPI, HTTPException, Query
-import psycopg2
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+import csv
+import hashlib
+import io
 import os
+import tempfile
+import threading
+import time
+import numpy as np
 import pandas as pd
-from rapidfuzz import process, fuzz
 from dotenv import load_dotenv
-import re
 from typing import Optional, List
 from enum import Enum
 from datetime import datetime, timedelta
+from urllib.parse import parse_qs
 
-app = FastAPI()
+from catalog import (
+    MEDICINE_FIELDS, Catalog, CatalogRefresher, TfidfFitter, clean_text, parse_expiry, parse_price, parse_quantity
+)
+from bulk_import import ImportRejected, import_medicines
+from catalog_store import load_snapshot, save_snapshot
+from composition_index import pack_units
+from cpu_pool import CPUPool, PoolBusy, PoolTimeout
+from db import DatabasePool
+from http_middleware import CompressionMiddleware, ETagMiddleware
+from json_fragments import Raw, RawJSONResponse, close_object, dumps, encode, extend_object, open_object
+from orders import MAX_ORDER_LINES, OrderRejected, merge_lines, take_stock
+from reservations import ReservationBook
+from search_cache import MISSING, SearchCache
+from shared_catalog import SharedCatalog
+from tfidf_index import TfidfIndex
+from pagination import (
+    SORTABLE_COLUMNS, InvalidCursor, build_medicines_sql, cursor_key, decode_cursor,
+    encode_cursor, keyset_page, offset_page, sort_rows
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Load .env from one directory up if needed, adjust the path to match your structure
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
@@ -25,25 +53,68 @@ DBNAME = os.getenv("dbname")
 if not DATABASE_URL:
     raise Exception(" SUPABASE_DATABASE_URL not found in .env file")
 
-# Connect to Supabase (Postgres)
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Connect to Supabase (Postgres) through a connection pool
 try:
-    connection = psycopg2.connect(
+    db = DatabasePool(
+        minconn=DB_POOL_MIN,
+        maxconn=DB_POOL_MAX,
+        checkout_timeout=DB_POOL_TIMEOUT,
         user=USER,
         password=PASSWORD,
         host=HOST,
         port=PORT,
         dbname=DBNAME
     )
-    cursor = connection.cursor()
     print(" Connected to Supabase database")
 except Exception as e:
     print(f" Connection URL being used: {DATABASE_URL}")
     raise Exception(f" Database connection failed: {e}")
 
+# Upper bound on queries accepted by /search_medicine/batch in one request
+MAX_BATCH_QUERIES = 200
+
 class SortOrder(str, Enum):
     asc = "asc"
     desc = "desc"
 
+class SearchMode(str, Enum):
+    fuzzy = "fuzzy"
+    phonetic = "phonetic"
+
+class SearchEngine(str, Enum):
+    wratio = "wratio"
+    tfidf = "tfidf"
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    threshold: int = 50
+    top_k: int = 3
+    engine: SearchEngine = SearchEngine.wratio
+
+class OrderLine(BaseModel):
+    medicine_id: int
+    quantity: int
+
+class OrderRequest(BaseModel):
+    lines: List[OrderLine]
+    cart_id: Optional[str] = None
+
+class ReservationRequest(BaseModel):
+    lines: List[OrderLine]
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class ImportFormat(str, Enum):
+    csv = "csv"
+    parquet = "parquet"
+
 class StockStatus(str, Enum):
     OUT_OF_STOCK = "out_of_stock"
     LOW_STOCK = "low_stock"
@@ -78,97 +149,783 @@ def get_stock_status(quantity: int, expiry_date: str, low_stock_threshold: int =
     
     return status
 
-# Fetch all medicine data into a DataFrame
-def fetch_medicine_data():
+# Thresholds used by the inventory views
+LOW_STOCK_THRESHOLD = 5
+EXPIRING_SOON_DAYS = 15
+
+# Order in which status flags are reported for a medicine
+STATUS_ORDER = [
+    StockStatus.OUT_OF_STOCK, StockStatus.LOW_STOCK, StockStatus.IN_STOCK,
+    StockStatus.EXPIRED, StockStatus.EXPIRING_SOON
+]
+
+def get_stock_status_masks(quantity, expiry, now):
+    """
+    Vectorized stock status for typed quantity (int64) and expiry (datetime64) arrays.
+    Returns one boolean mask per StockStatus.
+    """
+    has_expiry = ~np.isnat(expiry)
+    # Whole days until expiry, floored like timedelta.days
+    days_until_expiry = np.floor_divide(
+        expiry.astype(np.int64) - np.datetime64(now, 'ns').astype(np.int64),
+        np.timedelta64(1, 'D').astype('timedelta64[ns]').astype(np.int64)
+    )
+    expired = has_expiry & (days_until_expiry <= 0)
+    return {
+        StockStatus.OUT_OF_STOCK: quantity <= 0,
+        StockStatus.LOW_STOCK: (quantity > 0) & (quantity < LOW_STOCK_THRESHOLD),
+        StockStatus.IN_STOCK: quantity >= LOW_STOCK_THRESHOLD,
+        StockStatus.EXPIRED: expired,
+        StockStatus.EXPIRING_SOON: has_expiry & ~expired & (days_until_expiry <= EXPIRING_SOON_DAYS),
+    }
+
+# Columns selected from the medicine table, in DataFrame order
+MEDICINE_COLUMNS = [
+    "id", "name", "price", "quantity_available", "pack_size_label",
+    "short_composition1", "short_composition2",
+    "substitute0", "substitute1", "substitute2", "substitute3", "substitute4",
+    "sideEffect0", "sideEffect1", "sideEffect2", "sideEffect3", "sideEffect4",
+    "use0", "use1", "use2", "use3", "use4",
+    "therapeutic_class", "action_class", "expiry_date", "updated_at"
+]
+USE_COLUMNS = [f"use{i}" for i in range(5)]
+
+# Fields a client can ask for with `fields=`, in response order
+LISTING_FIELDS = [column for column in MEDICINE_COLUMNS if column not in USE_COLUMNS] + ["status", "uses"]
+# Fields listed and exported when `fields=` is not given; updated_at only tracks catalog refreshes
+DEFAULT_LISTING_FIELDS = [field for field in LISTING_FIELDS if field != "updated_at"]
+# Stock held by open carts (see ReservationBook), added to search results per request
+HOLD_FIELDS = ["held", "available_to_sell"]
+SEARCH_FIELDS = MEDICINE_FIELDS + ["similarity_score"] + HOLD_FIELDS
+
+def parse_fields(fields, allowed):
+    """
+    Fields requested with (repeated and/or comma-separated) `fields=`, in `allowed` order;
+    None when every field is wanted.
+    """
+    requested = {field.strip() for value in fields or [] for field in value.split(",") if field.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Choose from: {', '.join(allowed)}."
+        )
+    return [field for field in allowed if field in requested] or None
+
+def listing_columns(fields):
+    """Catalog columns a listing record reduced to `fields` is formatted from (see format_medicine)."""
+    return [
+        column for column in MEDICINE_COLUMNS
+        if column in fields or (column in USE_COLUMNS and "uses" in fields)
+    ]
+
+# Fetch medicine data into a DataFrame; with `since`, only rows changed at or after it
+def fetch_medicine_data(since=None, ids=None):
     query = """
     SELECT id, name, price, quantity_available, pack_size_label, 
            short_composition1, short_composition2,
            substitute0, substitute1, substitute2, substitute3, substitute4,
            "sideEffect0", "sideEffect1", "sideEffect2", "sideEffect3", "sideEffect4",
            use0, use1, use2, use3, use4,
-           therapeutic_class, action_class, expiry_date
-    FROM medicine;
-    """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    columns = [
-        "id", "name", "price", "quantity_available", "pack_size_label",
-        "short_composition1", "short_composition2",
-        "substitute0", "substitute1", "substitute2", "substitute3", "substitute4",
-        "sideEffect0", "sideEffect1", "sideEffect2", "sideEffect3", "sideEffect4",
-        "use0", "use1", "use2", "use3", "use4",
-        "therapeutic_class", "action_class", "expiry_date"
-    ]
-    return pd.DataFrame(rows, columns=columns)
+           therapeutic_class, action_class, expiry_date, updated_at
+    FROM medicine
+    """
+    params = None
+    if since is not None:
+        query += " WHERE updated_at >= %s ORDER BY updated_at"
+        params = (since.to_pydatetime(),)
+    elif ids is not None:
+        query += " WHERE id = ANY(%s::bigint[])"
+        params = (list(ids),)
 
-df_medicines = fetch_medicine_data()
+    with db.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
 
-def clean_text(text):
-    """Removes non-alphanumeric chars and converts to lowercase for fuzzy matching."""
-    if pd.isna(text) or not isinstance(text, str):
-        return ""
-    return re.sub(r'[^a-zA-Z0-9 ]', '', text).lower().strip()
+    return pd.DataFrame(rows, columns=MEDICINE_COLUMNS)
+
+def fetch_transaction_horizon():
+    """
+    Start of the oldest transaction open on the database (this one if none other is): rows it
+    writes get an updated_at no earlier than that, however late it commits. Other roles' sessions
+    only count if the database role may see their pg_stat_activity details (pg_read_all_stats).
+    """
+    with db.cursor() as cursor:
+        cursor.execute("""
+        SELECT min(xact_start) FROM pg_stat_activity
+        WHERE datname = current_database() AND backend_type = 'client backend'
+        """)
+        horizon, = cursor.fetchone()
+    return pd.Timestamp(horizon) if horizon is not None else None
+
+# Seconds between polls for changed catalog rows
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))
+
+# TF-IDF search engine fitted offline (build_tfidf_index.py) or in the background after the first
+# start, reused across restarts
+TFIDF_INDEX_PATH = os.getenv("TFIDF_INDEX_PATH", os.path.join(os.path.dirname(__file__), "tfidf_index.npz"))
+
+def load_tfidf_index(path):
+    """Persisted (TfidfIndex, medicine ids), or None if there is no usable file."""
+    try:
+        return TfidfIndex.load(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, KeyError, ValueError) as e:
+        print(f" Ignoring unreadable TF-IDF index {path}: {e}")
+        return None
+
+# Local copy of the loaded catalog and its prebuilt indexes, so restarts can serve right away and
+# reconcile with the database in the background (empty path disables it)
+CATALOG_SNAPSHOT_PATH = os.getenv(
+    "CATALOG_SNAPSHOT_PATH", os.path.join(os.path.dirname(__file__), "catalog_snapshot.pkl")
+)
+# A saved snapshot is only reused by a backend with the same columns and stock thresholds
+CATALOG_SNAPSHOT_STAMP = {
+    "columns": MEDICINE_COLUMNS,
+    "low_stock_threshold": LOW_STOCK_THRESHOLD,
+    "expiring_soon_days": EXPIRING_SOON_DAYS,
+}
+
+def load_catalog_snapshot(path):
+    if not path:
+        return None
+    try:
+        return load_snapshot(path, CATALOG_SNAPSHOT_STAMP)
+    except Exception as e:
+        print(f" Ignoring unreadable catalog snapshot {path}: {e}")
+        return None
+
+def save_catalog_snapshot():
+    if not CATALOG_SNAPSHOT_PATH:
+        return
+    try:
+        save_snapshot(catalog.snapshot, CATALOG_SNAPSHOT_PATH, CATALOG_SNAPSHOT_STAMP)
+    except OSError as e:
+        print(f" Could not save catalog snapshot to {CATALOG_SNAPSHOT_PATH}: {e}")
+
+# Directory (ideally on tmpfs, e.g. /dev/shm/mediscan) through which the worker processes of one
+# server share a single catalog: one leader loads and refreshes it, the others map it read-only.
+# Empty keeps a private catalog per process.
+CATALOG_SHARED_DIR = os.getenv("CATALOG_SHARED_DIR", "")
+shared_catalog = SharedCatalog(CATALOG_SHARED_DIR, CATALOG_SNAPSHOT_STAMP) if CATALOG_SHARED_DIR else None
+
+def leads_catalog():
+    """Whether this process loads, refreshes and saves the catalog (always, unless it is shared)."""
+    return shared_catalog is None or shared_catalog.is_leader
+
+attached_snapshot = None
+if shared_catalog is not None and not shared_catalog.try_lead():
+    attached_snapshot = shared_catalog.wait_for_snapshot()
+restored_snapshot = load_catalog_snapshot(CATALOG_SNAPSHOT_PATH) if attached_snapshot is None else None
+
+if attached_snapshot is not None:
+    catalog = Catalog(
+        low_stock_threshold=LOW_STOCK_THRESHOLD,
+        expiring_soon_days=EXPIRING_SOON_DAYS,
+        snapshot=attached_snapshot
+    )
+    print(f" Attached to shared catalog version {catalog.version} in {CATALOG_SHARED_DIR}")
+elif restored_snapshot is not None:
+    catalog = Catalog(
+        low_stock_threshold=LOW_STOCK_THRESHOLD,
+        expiring_soon_days=EXPIRING_SOON_DAYS,
+        snapshot=restored_snapshot
+    )
+    print(f" Restored catalog version {catalog.version} from {CATALOG_SNAPSHOT_PATH}")
+else:
+    # The TF-IDF engine is fitted or loaded afterwards by tfidf_fitter
+    catalog = Catalog(
+        fetch_medicine_data(),
+        low_stock_threshold=LOW_STOCK_THRESHOLD,
+        expiring_soon_days=EXPIRING_SOON_DAYS
+    )
+    save_catalog_snapshot()
+if shared_catalog is not None and shared_catalog.is_leader:
+    # Published right away: the other workers are waiting for it before they can start
+    shared_catalog.publish(catalog.snapshot)
+print(f" Loaded {len(catalog.snapshot.df)} medicines ({catalog.snapshot.memory_bytes() / 2**20:.1f} MiB in memory)")
+catalog_refresher = CatalogRefresher(
+    catalog, fetch_medicine_data, interval=CATALOG_REFRESH_INTERVAL, fetch_horizon=fetch_transaction_horizon
+)
+
+def save_tfidf_index(index, ids):
+    try:
+        index.save(TFIDF_INDEX_PATH, ids)
+    except OSError as e:
+        print(f" Could not save TF-IDF index to {TFIDF_INDEX_PATH}: {e}")
+
+tfidf_fitter = TfidfFitter(
+    catalog, load_persisted=lambda: load_tfidf_index(TFIDF_INDEX_PATH), on_fitted=save_tfidf_index
+)
 
-def fuzzy_medicine_search(query, df, threshold=50, top_k=3):
-    """Fuzzy search for a medicine name in DataFrame, returning top_k matches above threshold."""
+def fetch_medicine_ids():
+    with db.cursor() as cursor:
+        cursor.execute("SELECT id FROM medicine")
+        return {row[0] for row in cursor.fetchall()}
+
+def reconcile_catalog():
+    """
+    Bring a catalog restored from disk up to date: apply rows changed since its watermark, reload
+    fully if rows were deleted meanwhile, and save the snapshot again if anything changed.
+    """
+    try:
+        version = catalog.version
+        catalog_refresher.refresh_once()
+        if fetch_medicine_ids() != set(catalog.snapshot.row_of_id):
+            catalog.replace(fetch_medicine_data(), tfidf=load_tfidf_index(TFIDF_INDEX_PATH))
+            # Orders and refreshes applied while the reload was being built
+            catalog_refresher.refresh_once()
+        if catalog.version != version:
+            save_catalog_snapshot()
+        print(f" Catalog reconciled with the database, version {catalog.version}")
+    except Exception as e:
+        print(f"Error reconciling catalog: {str(e)}")
+
+# Search results cached per (cleaned query, threshold, top_k, mode, engine) for the current catalog version
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "4096"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+search_cache = SearchCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+# Seconds a cart's stock reservations last unless renewed. Holds are kept in the database, shared by
+# all workers; the held totals a worker shows in search results are reloaded in the background
+# when read more than RESERVATION_SYNC_INTERVAL seconds after the last load.
+RESERVATION_TTL = float(os.getenv("RESERVATION_TTL", "900"))
+RESERVATION_SYNC_INTERVAL = float(os.getenv("RESERVATION_SYNC_INTERVAL", "1"))
+reservations = ReservationBook(db, ttl=RESERVATION_TTL, max_age=RESERVATION_SYNC_INTERVAL)
+
+# Bounded thread pool for the CPU-heavy part of handlers, keeping the event loop responsive
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+CPU_POOL_QUEUE = int(os.getenv("CPU_POOL_QUEUE", "64"))
+CPU_POOL_TIMEOUT = float(os.getenv("CPU_POOL_TIMEOUT", "30"))
+cpu_pool = CPUPool(workers=CPU_POOL_WORKERS, max_queue=CPU_POOL_QUEUE, timeout=CPU_POOL_TIMEOUT)
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run fn on the CPU pool; a saturated pool answers 503 and work past the timeout 504."""
+    try:
+        return await cpu_pool.run(fn, *args, **kwargs)
+    except PoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry.", headers={"Retry-After": "1"})
+    except PoolTimeout:
+        raise HTTPException(status_code=504, detail=f"Request took longer than {CPU_POOL_TIMEOUT:g}s.")
+
+# GET endpoints whose response is determined by the catalog snapshot, today's date and the URL,
+# plus the reservation holds for HOLD_PATHS
+HOLD_PATHS = {"/search_medicine/"}
+CONDITIONAL_PATHS = {
+    "/catalog/version", "/inventory_stats", "/search_medicine/",
+    "/management/medicines", "/management/medicines/export"
+}
+CONDITIONAL_PREFIXES = ("/medicine/",)
+
+def catalog_etag(scope):
+    """
+    Weak ETag of a catalog-backed GET: catalog epoch and version, today's date (stock statuses
+    depend on it), the reservation revision where holds are shown and a digest of the path and
+    query string. The epoch changes on every full load or restore, so a version number reused
+    after a restart, or counted separately by another worker, never matches an older tag.
+    None for listings read from Postgres (pushdown).
+    """
+    path = scope["path"]
+    if path not in CONDITIONAL_PATHS and not path.startswith(CONDITIONAL_PREFIXES):
+        return None
+    query = scope.get("query_string", b"")
+    params = parse_qs(query.decode("latin-1"))
+    if params.get("pushdown", ["false"])[-1].lower() in ("1", "true", "on", "yes"):
+        return None
+    for cursor in params.get("cursor", []):
+        try:
+            if decode_cursor(cursor).get("src") == "db":
+                return None
+        except InvalidCursor:
+            return None
+    digest = hashlib.blake2b(path.encode() + b"?" + query, digest_size=8).hexdigest()
+    snapshot = catalog.snapshot
+    version = f"{snapshot.epoch}.{snapshot.version}"
+    if path in HOLD_PATHS:
+        version += f".{reservations.revision}"
+    return f'W/"{version}-{datetime.now():%Y%m%d}-{digest}"'
+
+# Conditional GETs are answered before compression, which then covers every other response
+app.add_middleware(ETagMiddleware, tag=catalog_etag)
+app.add_middleware(CompressionMiddleware)
+
+def fuzzy_medicine_search(query, snapshot, threshold=50, top_k=3, mode=SearchMode.fuzzy,
+                          engine=SearchEngine.wratio, fields=None):
+    """
+    Fuzzy search for a medicine name in a catalog snapshot, returning (rows, encoded matches) of the
+    top_k matches above threshold, or None.
+    In phonetic mode only names that sound like the query are scored.
+    The tfidf engine scores by n-gram TF-IDF cosine similarity (x100) over names and compositions.
+    `fields` limits each match to those SEARCH_FIELDS.
+    """
     query_clean = clean_text(query)
     if len(query_clean) < 2:  # skip very short queries
         return None
 
-    # Prepare a list of all medicine names in cleaned form
-    medicine_names = df["name"].dropna().apply(clean_text).tolist()
-
-    # RapidFuzz fuzzy matching
-    fuzzy_results = process.extract(query_clean, medicine_names, scorer=fuzz.WRatio, limit=top_k)
-    matched_medicines = []
-
-    for match, score, _ in fuzzy_results:
-        if score >= threshold:
-            # match is the cleaned text, find the original row
-            # We compare by cleaned name to find the correct row
-            row = df[df["name"].apply(clean_text) == match].iloc[0]
-            matched_medicines.append({
-                "name": row["name"],
-                "price": row["price"],
-                "quantity_available": row["quantity_available"],
-                "pack_size_label": row["pack_size_label"],
-                "short_composition1": row["short_composition1"],
-                "short_composition2": row["short_composition2"],
-                "substitute0": row["substitute0"],
-                "substitute1": row["substitute1"],
-                "substitute2": row["substitute2"],
-                "substitute3": row["substitute3"],
-                "substitute4": row["substitute4"],
-                "sideEffect0": row["sideEffect0"],
-                "sideEffect1": row["sideEffect1"],
-                "sideEffect2": row["sideEffect2"],
-                "sideEffect3": row["sideEffect3"],
-                "sideEffect4": row["sideEffect4"],
-                "use0": row["use0"],
-                "use1": row["use1"],
-                "use2": row["use2"],
-                "use3": row["use3"],
-                "use4": row["use4"],
-                "therapeutic_class": row["therapeutic_class"],
-                "action_class": row["action_class"],
-                "expiry_date": row["expiry_date"],
-                "similarity_score": score / 100.0
-            })
-
-    return matched_medicines if matched_medicines else None
+    # One RapidFuzz pass over the prebuilt cleaned names, then only the k hits are materialized
+    if engine == SearchEngine.tfidf:
+        hits = snapshot.index.tfidf.search_many([query_clean], threshold=threshold, top_k=top_k)[0]
+    elif mode == SearchMode.phonetic:
+        hits = snapshot.index.search_phonetic(query_clean, threshold=threshold, top_k=top_k)
+    else:
+        hits = snapshot.index.search(query_clean, threshold=threshold, top_k=top_k)
+    matched_medicines = snapshot.matches(hits, fields)
+
+    return (snapshot.hit_rows(hits), matched_medicines) if matched_medicines else None
+
+def with_holds(snapshot, result, fields=None):
+    """
+    Encoded match list of a search result, (rows, matches) as the search cache keeps it, with the
+    current holds of each match appended (HOLD_FIELDS, unless `fields` leaves them out); None when
+    nothing matched. Holds change without the catalog changing, so they are never cached.
+    """
+    if not result:
+        return None
+    rows, matches = result
+    wanted = [field for field in HOLD_FIELDS if fields is None or field in fields]
+    if not wanted:
+        return Raw(encode(matches))
+    ids = snapshot.df["id"].to_numpy()
+    extended = []
+    for row, match in zip(rows, matches):
+        held = reservations.held_of(int(ids[row]))
+        values = {"held": held, "available_to_sell": max(0, int(snapshot.quantity[row]) - held)}
+        extended.append(extend_object(match, {field: values[field] for field in wanted}))
+    return Raw(encode(extended))
+
+def fuzzy_medicine_search_batch(queries, snapshot, threshold=50, top_k=3, engine=SearchEngine.wratio):
+    """Fuzzy search for many medicine names at once; returns one (rows, matches) or None per query."""
+    cleaned = [clean_text(query) for query in queries]
+    # Very short queries are skipped, exactly like the single search
+    searchable = [i for i, query_clean in enumerate(cleaned) if len(query_clean) >= 2]
+
+    matched_batch = [None] * len(queries)
+    searcher = snapshot.index.tfidf if engine == SearchEngine.tfidf else snapshot.index
+    hits_batch = searcher.search_many([cleaned[i] for i in searchable], threshold=threshold, top_k=top_k)
+    for i, hits in zip(searchable, hits_batch):
+        if hits:
+            matched_batch[i] = (snapshot.hit_rows(hits), snapshot.matches(hits))
+    return matched_batch
+
+def lead_catalog():
+    """
+    Start the background work of the process owning the catalog: reconcile, refresh, fit, publish,
+    and sweep expired reservations.
+    """
+    if restored_snapshot is not None:
+        threading.Thread(target=reconcile_catalog, name="catalog-reconcile", daemon=True).start()
+    tfidf_fitter.start()
+    reservations.start()
+    if CATALOG_REFRESH_INTERVAL > 0:
+        catalog_refresher.start()
+    if shared_catalog is not None:
+        shared_catalog.publish_changes(catalog, apply_forwarded=apply_forwarded)
+
+def apply_forwarded(message):
+    """
+    Apply a change a follower forwarded to this process (see SharedCatalog.forward): the stock of
+    an order, or the ids of imported rows, read again here.
+    """
+    if "stock" in message:
+        catalog.apply_stock({
+            medicine_id: (quantity, pd.Timestamp(updated_at))
+            for medicine_id, quantity, updated_at in message["stock"]
+        })
+    if "ids" in message:
+        catalog.apply_changes(fetch_medicine_data(ids=message["ids"]))
+
+@app.on_event("startup")
+def start_catalog_refresher():
+    if leads_catalog():
+        lead_catalog()
+    else:
+        shared_catalog.follow(catalog, on_lead=lead_catalog)
+
+@app.on_event("shutdown")
+def close_database_pool():
+    catalog_refresher.stop()
+    tfidf_fitter.stop()
+    reservations.stop()
+    if shared_catalog is not None:
+        shared_catalog.stop()
+    cpu_pool.shutdown()
+    if leads_catalog():
+        save_catalog_snapshot()
+    db.close()
+
+@app.get("/catalog/version")
+async def get_catalog_version():
+    """
+    Current catalog version; increases every time medicine rows change. Versions are only
+    comparable within one epoch, which changes whenever the catalog is loaded in full or restored.
+    """
+    snapshot = catalog.snapshot
+    return {
+        "version": snapshot.version,
+        "epoch": snapshot.epoch,
+        "total_items": len(snapshot.df),
+        "updated_at": snapshot.watermark,
+        "memory_bytes": snapshot.memory_bytes()
+    }
+
+@app.get("/cpu_pool")
+async def get_cpu_pool_stats():
+    """Size, queue depth, timeout and load counters of the pool running CPU-heavy request work."""
+    return cpu_pool.stats()
+
+@app.get("/search_medicine/cache")
+async def get_search_cache_stats():
+    """Hit, miss, eviction and expiry counters of the search result cache."""
+    return search_cache.stats()
+
+def require_engine(snapshot, engine):
+    """503 for engine=tfidf until the background fit has given the catalog its TF-IDF engine."""
+    if engine == SearchEngine.tfidf and snapshot.index.tfidf is None:
+        raise HTTPException(
+            status_code=503, detail="The TF-IDF engine is still being fitted, please retry.",
+            headers={"Retry-After": "5"}
+        )
 
 @app.get("/search_medicine/")
-async def search_medicine(query: str):
+async def search_medicine(
+    query: str,
+    mode: SearchMode = SearchMode.fuzzy,
+    engine: SearchEngine = SearchEngine.wratio,
+    fields: Optional[List[str]] = Query(None)
+):
     """
     Provide a 'query' string and retrieve up to 3 fuzzy matches from the 'medicine' table.
-    Example: /search_medicine?query=Amoxicillin
+    mode=phonetic only considers names that sound like the query (Double Metaphone), which
+    holds up better on misspellings from handwritten prescriptions.
+    engine=tfidf ranks by character n-gram TF-IDF similarity over names and compositions instead of WRatio.
+    fields: Only return these fields of each match (repeat or comma-separate them); default all
+    Each match also reports the quantity held by open carts ("held") and "available_to_sell".
+    Example: /search_medicine?query=Amoxicillin, /search_medicine?query=Azitrol&mode=phonetic,
+    /search_medicine?query=Pan 40&fields=name,price,similarity_score
     """
     if not query:
         raise HTTPException(status_code=400, detail="Query cannot be empty.")
+    if engine == SearchEngine.tfidf and mode == SearchMode.phonetic:
+        raise HTTPException(status_code=400, detail="mode=phonetic is only supported by engine=wratio.")
+    fields = parse_fields(fields, SEARCH_FIELDS)
+
+    # Matches are cached already encoded, so a hit only has the current holds spliced in
+    snapshot = catalog.snapshot
+    require_engine(snapshot, engine)
+    cache_version = (snapshot.epoch, snapshot.version)
+    cache_key = (clean_text(query), 50, 3, mode.value, engine.value, tuple(fields) if fields else None)
+    result = search_cache.get(cache_key, cache_version)
+    if result is MISSING:
+        result = await run_cpu(
+            fuzzy_medicine_search, query, snapshot, threshold=50, top_k=3, mode=mode, engine=engine, fields=fields
+        )
+        search_cache.put(cache_key, cache_version, result)
+    matched_medicines = with_holds(snapshot, result, fields)
+    return RawJSONResponse(matched_medicines if matched_medicines else {"message": "No matches found"})
+
+@app.post("/search_medicine/batch")
+async def search_medicine_batch(request: BatchSearchRequest):
+    """
+    Provide a list of 'queries' and retrieve up to top_k fuzzy matches for each in one response.
+    Each query is scored like a single /search_medicine/ (trigram prefilter, then WRatio over the
+    candidates), or the whole batch with one sparse matrix multiply with "engine": "tfidf".
+    Example body: {"queries": ["Amoxicillin", "Pan 40"], "top_k": 3}
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="Queries cannot be empty.")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch.")
+
+    # Only queries not answered from the cache are scored; results are those of the single search,
+    # so both share cache entries
+    snapshot = catalog.snapshot
+    require_engine(snapshot, request.engine)
+    cache_version = (snapshot.epoch, snapshot.version)
+    cache_keys = [
+        (clean_text(query), request.threshold, request.top_k, SearchMode.fuzzy.value, request.engine.value, None)
+        for query in request.queries
+    ]
+    results = [search_cache.get(key, cache_version) for key in cache_keys]
+    uncached = [i for i, result in enumerate(results) if result is MISSING]
+    if uncached:
+        scored = await run_cpu(
+            fuzzy_medicine_search_batch, [request.queries[i] for i in uncached], snapshot,
+            threshold=request.threshold, top_k=request.top_k, engine=request.engine
+        )
+        for i, result in zip(uncached, scored):
+            results[i] = result
+            search_cache.put(cache_keys[i], cache_version, result)
+    matched_batch = [with_holds(snapshot, result) for result in results]
+    return RawJSONResponse({
+        "results": [
+            {"query": query, "matches": matches if matches else {"message": "No matches found"}}
+            for query, matches in zip(request.queries, matched_batch)
+        ]
+    })
+
+def substitute_records(snapshot, row, in_stock):
+    """Encoded catalog records of a row's substitutes, as resolved by the snapshot's SubstituteGraph."""
+    substitutes = []
+    for slot, target, match in snapshot.substitutes.of(row, snapshot.index):
+        if in_stock and snapshot.quantity[target] <= 0:
+            continue
+        name = snapshot.df[f"substitute{slot}"].iat[row]
+        fragment = snapshot.medicine_fragments([target])[0]
+        substitutes.append(close_object(fragment, {"substitute": name, "substitute_match": match}))
+    return substitutes
+
+def equivalent_records(snapshot, medicine_id, row, in_stock, limit):
+    """Equivalents response of a row: same-composition rows, cheapest per unit first."""
+    rows = snapshot.compositions.equivalents(row)
+    if in_stock:
+        rows = rows[snapshot.quantity[rows] > 0]
+    units = np.array([pack_units(label) for label in snapshot.df["pack_size_label"].iloc[rows]], dtype=np.float64)
+    price_per_unit = snapshot.price[rows] / units if len(rows) else np.array([])
+    order = np.lexsort((snapshot.df["id"].to_numpy()[rows], price_per_unit))
+    if limit is not None:
+        order = order[:limit]
 
-    matched_medicines = fuzzy_medicine_search(query, df_medicines, threshold=50, top_k=3)
-    return matched_medicines if matched_medicines else {"message": "No matches found"}
+    equivalents = [
+        close_object(fragment, {"price_per_unit": round(value, 4)})
+        for fragment, value in zip(snapshot.medicine_fragments(rows[order]), price_per_unit[order].tolist())
+    ]
+    return RawJSONResponse({
+        "medicine_id": medicine_id,
+        "composition_key": snapshot.compositions.key_of(row),
+        "total": len(rows),
+        "equivalents": equivalents
+    })
+
+@app.get("/medicine/{medicine_id}/substitutes")
+async def get_medicine_substitutes(medicine_id: int, in_stock: bool = False):
+    """
+    Catalog records of a medicine's substitutes (substitute0..substitute4), in one call.
+    Substitute names are resolved to catalog rows by exact name when the catalog is loaded or
+    changes; names without an exact match fall back to the best fuzzy match, as a /search_medicine/
+    lookup would.
+    Each record carries the listed `substitute` name and whether it matched "exact"ly or "fuzzy".
+    Example: /medicine/42/substitutes?in_stock=true
+    """
+    snapshot = catalog.snapshot
+    row = snapshot.row_of_id.get(medicine_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Medicine not found.")
+    substitutes = await run_cpu(substitute_records, snapshot, row, in_stock)
+    return RawJSONResponse({"medicine_id": medicine_id, "substitutes": substitutes})
+
+@app.get("/medicine/{medicine_id}/equivalents")
+async def get_medicine_equivalents(medicine_id: int, in_stock: bool = True, limit: Optional[int] = Query(None, ge=1)):
+    """
+    Generic equivalents of a medicine: every other product with the same active ingredients and
+    strengths (normalized short_composition1/2), cheapest per unit first.
+    price_per_unit is the pack price divided by the count in pack_size_label ("strip of 10 tablets" -> 10).
+    Example: /medicine/42/equivalents?in_stock=true&limit=10
+    """
+    snapshot = catalog.snapshot
+    row = snapshot.row_of_id.get(medicine_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Medicine not found.")
+    return await run_cpu(equivalent_records, snapshot, medicine_id, row, in_stock, limit)
+
+def format_medicine(medicine, quantity, price, status):
+    """Shape one medicine record for the management listing."""
+    medicine["status"] = status
+
+    # Format uses
+    uses = []
+    for i in range(5):
+        use = medicine.get(f'use{i}')
+        if use and isinstance(use, str) and use.strip():
+            uses.append(use.strip())
+    medicine['uses'] = uses
+
+    # Clean up response
+    for i in range(5):
+        medicine.pop(f'use{i}', None)
+
+    # Ensure all fields are properly formatted
+    medicine["name"] = str(medicine.get("name", ""))
+    medicine["price"] = float(price)
+    medicine["quantity_available"] = int(quantity)
+    medicine["expiry_date"] = str(medicine.get("expiry_date", "")) if medicine.get("expiry_date") else ""
+    return medicine
+
+def row_statuses(masks, shape=list):
+    """
+    Status flags of every row as `shape(list of StockStatus)`; each distinct combination of flags
+    is shaped once and shared by the rows carrying it.
+    """
+    combos = np.zeros(len(masks[STATUS_ORDER[0]]), dtype=np.int64)
+    for bit, status in enumerate(STATUS_ORDER):
+        combos |= masks[status].astype(np.int64) << bit
+    shaped = {
+        combo: shape([status for bit, status in enumerate(STATUS_ORDER) if combo >> bit & 1])
+        for combo in np.unique(combos).tolist()
+    }
+    return [shaped[combo] for combo in combos.tolist()]
+
+def status_keep(quantity, expiry, status_filter):
+    """Boolean mask of the rows flagged with any of the requested statuses."""
+    masks = get_stock_status_masks(quantity, expiry, datetime.now())
+    keep = np.zeros(len(quantity), dtype=bool)
+    for status in status_filter:
+        keep |= masks[status]
+    return keep
+
+def search_hit_rows(snapshot, search):
+    """Catalog rows matching a listing search (up to 100 fuzzy hits); None means no search applies."""
+    if not search:
+        return None
+    query_clean = clean_text(search)
+    if len(query_clean) < 2:
+        return None
+    hits = snapshot.index.search(query_clean, threshold=50, top_k=100)
+    if not hits:
+        return None
+    return np.array([snapshot.index.row_ids[position] for position, _ in hits])
+
+def project(medicine, fields):
+    return {field: medicine[field] for field in fields}
+
+def listing_values(snapshot, rows, field, masks):
+    """One listing field of catalog rows, formatted as format_medicine would, column at a time."""
+    if field == "name":
+        return [str(name) for name in snapshot.values(rows, "name")]
+    if field == "price":
+        return snapshot.price[rows].astype(float).tolist()
+    if field == "quantity_available":
+        return snapshot.quantity[rows].astype(int).tolist()
+    if field == "expiry_date":
+        return [expiry or "" for expiry in snapshot.values(rows, "expiry_date")]
+    if field == "status":
+        return row_statuses(masks)
+    if field == "uses":
+        return [
+            [use.strip() for use in uses if use and isinstance(use, str) and use.strip()]
+            for uses in zip(*(snapshot.values(rows, column) for column in USE_COLUMNS))
+        ]
+    return snapshot.values(rows, field)
+
+def listing_fragment(medicine):
+    """
+    A formatted listing record encoded once, split around its "status" field, which depends on
+    today's date: (open fragment up to status, encoded fields after it).
+    """
+    items = list(medicine.items())
+    at = list(medicine).index("status")
+    return open_object(dict(items[:at])), b"," + dumps(dict(items[at + 1:]))[1:]
+
+def listing_fragments(snapshot, rows):
+    """Pre-encoded listing records of catalog rows (see listing_fragment)."""
+    def encode_rows(missing):
+        return [
+            listing_fragment(format_medicine(medicine, snapshot.quantity[row], snapshot.price[row], None))
+            for medicine, row in zip(snapshot.records(missing, listing_columns(DEFAULT_LISTING_FIELDS)), missing)
+        ]
+    return snapshot.fragments.get("listing", [int(row) for row in rows], encode_rows)
+
+def get_medicines_from_database(search, sort_by, descending, status_filter, after, page_size, fields=None):
+    """
+    One keyset page of the medicine listing with filter, sort and limit pushed down to Postgres.
+    With `fields`, only the columns those fields need are selected.
+    """
+    columns = listing_columns(DEFAULT_LISTING_FIELDS)
+    if fields is not None:
+        # id keys the cursor; price, quantity and expiry feed the status flags
+        needed = set(listing_columns(fields)) | {"id", "price", "quantity_available", "expiry_date"}
+        columns = [column for column in MEDICINE_COLUMNS if column in needed]
+    page_query, page_params, count_query, count_params = build_medicines_sql(
+        columns, search, sort_by, descending, status_filter, after, page_size,
+        LOW_STOCK_THRESHOLD, EXPIRING_SOON_DAYS
+    )
+    with db.cursor() as cursor:
+        cursor.execute(count_query, count_params)
+        total = cursor.fetchone()[0]
+        cursor.execute(page_query, page_params)
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    page_df = pd.DataFrame([row[:-1] for row in rows], columns=columns)
+    quantity = parse_quantity(page_df["quantity_available"])
+    price = parse_price(page_df["price"])
+    masks = get_stock_status_masks(quantity, parse_expiry(page_df["expiry_date"]), datetime.now())
+    medicines = [
+        format_medicine(medicine, quantity[i], price[i], status)
+        for i, (medicine, status) in enumerate(zip(page_df.to_dict('records'), row_statuses(masks)))
+    ]
+    if fields is not None:
+        medicines = [project(medicine, fields) for medicine in medicines]
+
+    next_cursor = None
+    if has_more and rows:
+        last_key = rows[-1][-1]
+        if not isinstance(last_key, (int, float, str)):
+            last_key = str(last_key)
+        next_cursor = encode_cursor({
+            "src": "db", "q": search, "f": status_filter, "s": sort_by, "d": descending,
+            "k": last_key, "i": rows[-1][0]
+        })
+    return total, medicines, next_cursor
+
+def catalog_medicines_page(snapshot, search, sort_by, descending, status_filter, cursor, after, offset, page,
+                           page_size, fields):
+    """One page of the medicine listing from a catalog snapshot, as an encoded response."""
+    sort_index = snapshot.sort_index(sort_by)
+
+    # Apply search if provided; a search result is small, so it is paged by offset
+    hit_rows = search_hit_rows(snapshot, search)
+
+    if hit_rows is not None:
+        rows = sort_rows(sort_index, snapshot.df["id"].to_numpy(), hit_rows, descending)
+        if status_filter:
+            rows = rows[status_keep(snapshot.quantity[rows], snapshot.expiry[rows], status_filter)]
+        total = len(rows)
+        page_rows = rows[offset:offset + page_size]
+        has_more = total > offset + page_size
+        next_state = {"o": offset + page_size}
+    else:
+        # Status flags for the whole catalog as boolean masks
+        keep = None
+        if status_filter:
+            keep = status_keep(snapshot.quantity, snapshot.expiry, status_filter)
+        total = int(np.count_nonzero(keep)) if keep is not None else len(snapshot.df)
+
+        # Walk the precomputed sort order: keyset after a cursor, by offset otherwise
+        if cursor:
+            page_rows, has_more = keyset_page(sort_index, descending, keep, after, page_size)
+        else:
+            page_rows, has_more = offset_page(sort_index, descending, keep, offset, page_size)
+        next_state = None
+        if len(page_rows):
+            last_row = page_rows[-1]
+            next_state = {
+                "k": cursor_key(sort_index, last_row), "i": int(snapshot.df["id"].iat[last_row])
+            }
+
+    # Splice today's status flags into the pre-encoded records of the requested page
+    page_masks = get_stock_status_masks(snapshot.quantity[page_rows], snapshot.expiry[page_rows], datetime.now())
+    if fields is None:
+        page_statuses = row_statuses(page_masks, lambda statuses: b',"status":' + dumps(statuses))
+        paginated_medicines = [
+            Raw(head + status + tail)
+            for (head, tail), status in zip(listing_fragments(snapshot, page_rows), page_statuses)
+        ]
+    else:
+        # Only the requested columns are materialized, and the page is encoded in one call
+        columns = [listing_values(snapshot, page_rows, field, page_masks) for field in fields]
+        paginated_medicines = Raw(dumps([dict(zip(fields, values)) for values in zip(*columns)]))
+
+    return RawJSONResponse({
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "medicines": paginated_medicines,
+        "next_cursor": encode_cursor(dict(
+            next_state, q=search, f=status_filter, s=sort_by, d=descending
+        )) if has_more and next_state else None
+    })
 
 @app.get("/management/medicines")
 async def get_medicines(
@@ -177,162 +934,353 @@ async def get_medicines(
     sort_order: Optional[SortOrder] = SortOrder.asc,
     status_filter: Optional[List[StockStatus]] = Query(None),
     page: int = 1,
-    page_size: int = 50
+    page_size: int = 50,
+    cursor: Optional[str] = None,
+    pushdown: bool = False,
+    fields: Optional[List[str]] = Query(None)
 ):
     """
     Get medicines with sorting, filtering, and pagination.
     - search: Optional search term for medicine name
-    - sort_by: Column to sort by (quantity_available, expiry_date, price, name)
+    - sort_by: Column to sort by (quantity_available, expiry_date, price, name, id); default id
     - sort_order: asc or desc
     - status_filter: Filter by stock status (out_of_stock, low_stock, expired, expiring_soon, in_stock)
-    - page: Page number
+    - page: Page number (ignored when a cursor is given, and returned as null on cursor pages)
     - page_size: Number of items per page
+    - cursor: Opaque `next_cursor` from the previous page; deep pages cost the same as page 1
+    - pushdown: Filter, sort and limit in Postgres instead of the in-memory catalog
+      (search then becomes a substring match rather than a fuzzy match)
+    - fields: Only return these fields of each medicine (repeat or comma-separate them); default all
+      but updated_at, which is only returned when asked for.
+      Not carried by the cursor, so pass it with every page.
     """
+    if page < 1 or page_size < 1:
+        raise HTTPException(status_code=400, detail="page and page_size must be positive.")
+    fields = parse_fields(fields, LISTING_FIELDS)
+    after = None
+    offset = (page - 1) * page_size
+    if cursor:
+        try:
+            state = decode_cursor(cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # The cursor carries the filters and ordering it was issued for
+        search = state.get("q")
+        status_filter = [StockStatus(status) for status in state.get("f") or []]
+        sort_by = state.get("s")
+        sort_order = SortOrder.desc if state.get("d") else SortOrder.asc
+        pushdown = state.get("src") == "db"
+        if "o" in state:
+            offset = int(state["o"])
+        else:
+            after = (state.get("k"), state.get("i"))
+            offset = 0
+        # A cursor page has no page number
+        page = None
+    sort_by = sort_by or "id"
+    if sort_by not in SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {', '.join(SORTABLE_COLUMNS)}.")
+    descending = sort_order == SortOrder.desc
+
     try:
-        # Start with all medicines
-        medicines_df = df_medicines.copy()
-        
-        # Apply search if provided
-        if search:
-            matched_medicines = fuzzy_medicine_search(search, medicines_df, threshold=50, top_k=100)
-            if matched_medicines:
-                medicine_names = [m["name"] for m in matched_medicines]
-                medicines_df = medicines_df[medicines_df["name"].isin(medicine_names)]
-        
-        # Convert to list of dictionaries for processing
-        medicines = medicines_df.to_dict('records')
-        
-        # Add status flags to each medicine
-        for medicine in medicines:
-            try:
-                # Ensure numeric fields are properly converted
-                medicine["quantity_available"] = int(medicine["quantity_available"]) if medicine["quantity_available"] is not None else 0
-                medicine["price"] = float(medicine["price"]) if medicine["price"] is not None else 0.0
-                
-                # Calculate expiry status
-                is_expired = False
-                is_expiring_soon = False
-                if medicine.get("expiry_date"):
-                    try:
-                        expiry_date = datetime.strptime(str(medicine["expiry_date"]), '%Y-%m-%d')
-                        days_until_expiry = (expiry_date - datetime.now()).days
-                        if days_until_expiry <= 0:
-                            is_expired = True
-                        elif days_until_expiry <= 15:
-                            is_expiring_soon = True
-                    except (ValueError, TypeError):
-                        pass
-
-                # Set status flags
-                status_flags = []
-                if medicine["quantity_available"] <= 0:
-                    status_flags.append(StockStatus.OUT_OF_STOCK)
-                elif medicine["quantity_available"] < 5:
-                    status_flags.append(StockStatus.LOW_STOCK)
-                else:
-                    status_flags.append(StockStatus.IN_STOCK)
-                
-                if is_expired:
-                    status_flags.append(StockStatus.EXPIRED)
-                elif is_expiring_soon:
-                    status_flags.append(StockStatus.EXPIRING_SOON)
-                
-                medicine["status"] = status_flags
-            except (ValueError, TypeError):
-                medicine["quantity_available"] = 0
-                medicine["price"] = 0.0
-                medicine["status"] = [StockStatus.OUT_OF_STOCK]
-        
-        # Apply status filter if provided
-        if status_filter:
-            medicines = [
-                m for m in medicines 
-                if any(status in m["status"] for status in status_filter)
-            ]
-        
-        # Apply sorting
-        if sort_by:
-            reverse = sort_order == SortOrder.desc
-            medicines.sort(
-                key=lambda x: (
-                    x.get(sort_by, 0) if sort_by != 'expiry_date' 
-                    else datetime.strptime(str(x.get('expiry_date', '2000-01-01')), '%Y-%m-%d')
-                ),
-                reverse=reverse
+        if pushdown:
+            # Blocking database I/O goes to the default thread pool, not the CPU pool
+            total, medicines, next_cursor = await run_in_threadpool(
+                get_medicines_from_database, search, sort_by, descending, status_filter, after, page_size, fields
             )
-        
-        # Apply pagination
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        paginated_medicines = medicines[start_idx:end_idx]
-        
-        # Format response
-        for medicine in paginated_medicines:
-            # Format uses
-            uses = []
-            for i in range(5):
-                use = medicine.get(f'use{i}')
-                if use and isinstance(use, str) and use.strip():
-                    uses.append(use.strip())
-            medicine['uses'] = uses
-            
-            # Clean up response
-            for i in range(5):
-                medicine.pop(f'use{i}', None)
-            
-            # Ensure all fields are properly formatted
-            medicine["name"] = str(medicine.get("name", ""))
-            medicine["price"] = float(medicine.get("price", 0))
-            medicine["quantity_available"] = int(medicine.get("quantity_available", 0))
-            medicine["expiry_date"] = str(medicine.get("expiry_date", "")) if medicine.get("expiry_date") else ""
-        
-        return {
-            "total": len(medicines),
-            "page": page,
-            "page_size": page_size,
-            "medicines": paginated_medicines
-        }
-        
+            return {
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "medicines": medicines,
+                "next_cursor": next_cursor
+            }
+
+        # Read one immutable snapshot for the whole request; no copy needed
+        return await run_cpu(
+            catalog_medicines_page, catalog.snapshot, search, sort_by, descending, status_filter,
+            cursor, after, offset, page, page_size, fields
+        )
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_medicines: {str(e)}")  # Add logging
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# Rows materialized and encoded per chunk of a streamed export
+EXPORT_CHUNK_ROWS = 1000
+
+EXPORT_MEDIA_TYPES = {ExportFormat.ndjson: "application/x-ndjson", ExportFormat.csv: "text/csv"}
+
+def csv_cell(value):
+    """A listing value as one CSV cell; lists (status, uses) are joined with "; "."""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "; ".join(item.value if isinstance(item, Enum) else str(item) for item in value)
+    return value
+
+def export_chunks(snapshot, rows, fields, export_format):
+    """
+    Encoded export of catalog rows, EXPORT_CHUNK_ROWS at a time (CSV starts with a header line).
+    Only one chunk of records exists at any moment, whatever the number of rows.
+    """
+    if export_format == ExportFormat.csv:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(fields)
+        yield buffer.getvalue().encode()
+    for start in range(0, len(rows), EXPORT_CHUNK_ROWS):
+        chunk = rows[start:start + EXPORT_CHUNK_ROWS]
+        masks = get_stock_status_masks(snapshot.quantity[chunk], snapshot.expiry[chunk], datetime.now())
+        columns = [listing_values(snapshot, chunk, field, masks) for field in fields]
+        if export_format == ExportFormat.ndjson:
+            yield b"".join(dumps(dict(zip(fields, values))) + b"\n" for values in zip(*columns))
+        else:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows([csv_cell(value) for value in values] for values in zip(*columns))
+            yield buffer.getvalue().encode()
+
+def export_rows(snapshot, search, sort_by, descending, status_filter):
+    """Every catalog row the listing filters select, in listing order."""
+    sort_index = snapshot.sort_index(sort_by)
+    hit_rows = search_hit_rows(snapshot, search)
+    if hit_rows is not None:
+        rows = sort_rows(sort_index, snapshot.df["id"].to_numpy(), hit_rows, descending)
+    else:
+        rows = sort_index.order[::-1] if descending else sort_index.order
+    if status_filter:
+        rows = rows[status_keep(snapshot.quantity[rows], snapshot.expiry[rows], status_filter)]
+    return rows
+
+@app.get("/management/medicines/export")
+async def export_medicines(
+    export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+    search: Optional[str] = None,
+    sort_by: Optional[str] = None,
+    sort_order: Optional[SortOrder] = SortOrder.asc,
+    status_filter: Optional[List[StockStatus]] = Query(None),
+    fields: Optional[List[str]] = Query(None)
+):
+    """
+    Stream every medicine matching the listing filters as NDJSON (one record per line) or CSV.
+    Takes the same search, sort_by, sort_order, status_filter and fields parameters as
+    /management/medicines, without paging. Rows are read from one catalog snapshot and encoded
+    chunk by chunk while the response is sent.
+    Example: /management/medicines/export?format=csv&status_filter=expired
+    """
+    sort_by = sort_by or "id"
+    if sort_by not in SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {', '.join(SORTABLE_COLUMNS)}.")
+    descending = sort_order == SortOrder.desc
+    fields = parse_fields(fields, LISTING_FIELDS) or DEFAULT_LISTING_FIELDS
+
+    snapshot = catalog.snapshot
+    rows = await run_cpu(export_rows, snapshot, search, sort_by, descending, status_filter)
+    return StreamingResponse(
+        export_chunks(snapshot, rows, fields, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="medicines.{export_format.value}"'}
+    )
+
+# Uploads up to this size are buffered in memory, larger ones in a temporary file
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+def import_inventory(file, import_format):
+    """
+    Upsert an import file into the medicine table in one transaction and patch the catalog with
+    the inserted and changed rows only. Returns (lines read, medicines, inserted, changed rows).
+    """
+    with db.cursor() as cursor:
+        lines, medicines, inserted, rows = import_medicines(cursor, file, import_format.value, MEDICINE_COLUMNS)
+    changed = pd.DataFrame(rows, columns=MEDICINE_COLUMNS)
+    # A follower has the leader read the rows again and publish them, as orders do with their stock
+    if leads_catalog():
+        catalog.apply_changes(changed)
+    elif len(changed) and not shared_catalog.forward(catalog, {"ids": changed["id"].tolist()}):
+        print(" Could not reach the catalog leader; the imported rows show after its next refresh")
+    return lines, medicines, inserted, changed
+
+@app.post("/management/import")
+async def import_medicine_file(
+    request: Request,
+    import_format: ImportFormat = Query(ImportFormat.csv, alias="format")
+):
+    """
+    Bulk restock from a CSV (with a header line) or Parquet file sent as the request body.
+    Columns are a subset of the medicine fields and must include id; each row updates the medicine
+    with that id (the last row wins if an id repeats) or inserts it. Columns left out keep their
+    values and no medicine is deleted. The whole file is applied in one transaction, or not at all
+    if a value is invalid (400).
+    Example: curl -X POST --data-binary @restock.csv "http://localhost:8000/management/import?format=csv"
+    """
+    start = time.perf_counter()
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as file:
+        async for chunk in request.stream():
+            file.write(chunk)
+        if not file.tell():
+            raise HTTPException(status_code=400, detail="The request body is empty.")
+        file.seek(0)
+        try:
+            lines, medicines, inserted, changed = await run_in_threadpool(import_inventory, file, import_format)
+        except ImportRejected as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"Error in import_medicine_file: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    return {
+        "lines": lines,
+        "medicines": medicines,
+        "inserted": inserted,
+        "updated": len(changed) - inserted,
+        "unchanged": medicines - len(changed),
+        "catalog_version": catalog.version,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
 @app.get("/inventory_stats")
 async def get_inventory_stats():
     """Get inventory statistics including total items, low stock, out of stock, and expiring soon."""
     try:
-        medicines_df = df_medicines.copy()
-        total_items = len(medicines_df)
-        
-        # Calculate statistics
-        stats = {
-            "total_items": total_items,
-            "low_stock_items": 0,
-            "out_of_stock": 0,
-            "expiring_soon": 0
-        }
-        
-        # Process each medicine
-        for _, medicine in medicines_df.iterrows():
-            try:
-                quantity = int(medicine['quantity_available'])
-                if quantity <= 0:
-                    stats["out_of_stock"] += 1
-                elif quantity < 5:
-                    stats["low_stock_items"] += 1
-                    
-                # Check expiry
-                if medicine.get('expiry_date'):
-                    try:
-                        expiry_date = datetime.strptime(medicine['expiry_date'], '%Y-%m-%d')
-                        if expiry_date < datetime.now() + timedelta(days=15):
-                            stats["expiring_soon"] += 1
-                    except (ValueError, TypeError):
-                        pass
-            except (ValueError, TypeError):
-                stats["out_of_stock"] += 1
-        
-        return stats
+        # Running aggregates maintained by the catalog as rows change
+        return catalog.snapshot.counters.stats(datetime.now())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def take_order_stock(lines, cart_id=None):
+    """
+    Decrement the stock of an order's (medicine id, quantity) lines in one transaction, using up
+    the holds of `cart_id`, and patch the catalog with the updated rows. Returns the updated rows
+    as a DataFrame.
+    """
+    with db.cursor() as cursor:
+        changed = pd.DataFrame(take_stock(cursor, lines, MEDICINE_COLUMNS, cart_id), columns=MEDICINE_COLUMNS)
+    if cart_id is not None:
+        reservations.sync()
+    stock = dict(zip(
+        changed["id"].tolist(),
+        zip(parse_quantity(changed["quantity_available"]).tolist(), changed["updated_at"])
+    ))
+    if leads_catalog():
+        catalog.apply_stock(stock)
+    # A follower of a shared catalog has the leader apply and publish the stock, so the versions
+    # published by the leader stay the only ones, and serves that version before answering
+    elif not shared_catalog.forward(catalog, {"stock": [
+        [medicine_id, quantity, updated_at.isoformat()] for medicine_id, (quantity, updated_at) in stock.items()
+    ]}):
+        print(" Could not reach the catalog leader; the order's stock shows after its next refresh")
+    return changed
+
+def rejection(error):
+    """HTTP error for an OrderRejected: 404 naming unknown medicines, else 409 listing oversold lines."""
+    if error.unknown:
+        return HTTPException(status_code=404, detail={
+            "message": "Unknown medicines.", "unknown": error.unknown
+        })
+    return HTTPException(status_code=409, detail={
+        "message": "Not enough stock.",
+        "oversold": [
+            {"medicine_id": medicine_id, "requested": requested, "available": available}
+            for medicine_id, requested, available in error.oversold
+        ]
+    })
+
+@app.post("/orders")
+async def create_order(request: OrderRequest):
+    """
+    Take the stock of a checkout: each line's quantity is subtracted from the medicine's
+    quantity_available, all lines in one transaction and a single statement. If any line asks for
+    more than is available (409) or names an unknown medicine (404), no stock changes at all.
+    Lines for the same medicine are added up. Stock reserved by other carts counts as unavailable;
+    with "cart_id", that cart's own reservations are used up by the order.
+    Example body: {"lines": [{"medicine_id": 12, "quantity": 2}, {"medicine_id": 40, "quantity": 1}]}
+    """
+    if not request.lines:
+        raise HTTPException(status_code=400, detail="An order needs at least one line.")
+    if len(request.lines) > MAX_ORDER_LINES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ORDER_LINES} lines per order.")
+    if any(line.quantity <= 0 for line in request.lines):
+        raise HTTPException(status_code=400, detail="Quantities must be positive.")
+
+    lines = merge_lines((line.medicine_id, line.quantity) for line in request.lines)
+    try:
+        changed = await run_in_threadpool(take_order_stock, list(lines.items()), request.cart_id)
+    except OrderRejected as e:
+        raise rejection(e)
+    except Exception as e:
+        print(f"Error in create_order: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    rows = changed.set_index("id")
+    price = pd.Series(parse_price(rows["price"]), index=rows.index)
+    remaining = pd.Series(parse_quantity(rows["quantity_available"]), index=rows.index)
+    order_lines = [
+        {
+            "medicine_id": medicine_id,
+            "name": rows.at[medicine_id, "name"],
+            "quantity": quantity,
+            "price": float(price[medicine_id]),
+            "subtotal": round(float(price[medicine_id]) * quantity, 2),
+            "quantity_available": int(remaining[medicine_id]),
+        }
+        for medicine_id, quantity in lines.items()
+    ]
+    return {
+        "lines": order_lines,
+        "total": round(sum(line["subtotal"] for line in order_lines), 2),
+        "catalog_version": catalog.version,
+    }
+
+def reservation_response(cart_id):
+    """
+    A cart's holds, each with the medicine's stock still available to sell as the database counts
+    it now, and their expiry.
+    """
+    cart = reservations.cart(cart_id)
+    held, expires_in = cart if cart is not None else ({}, 0.0)
+    lines = [
+        {"medicine_id": medicine_id, "quantity": quantity, "available_to_sell": available}
+        for medicine_id, (quantity, available) in held.items()
+    ]
+    return {"cart_id": cart_id, "lines": lines, "expires_in_seconds": round(expires_in, 1)}
+
+@app.get("/reservations")
+async def get_reservation_stats():
+    """Open carts, held units and the hold TTL of the reservation book."""
+    return await run_in_threadpool(reservations.stats)
+
+@app.put("/reservations/{cart_id}")
+async def reserve_stock(cart_id: str, request: ReservationRequest):
+    """
+    Hold stock for an open cart for RESERVATION_TTL seconds. The lines replace the cart's previous
+    holds (quantity 0 or an empty list releases them) and renew their expiry. Held stock is not
+    available to other carts' reservations or orders, and shows in /search_medicine/ results.
+    409 if a line asks for more than the stock minus what other carts hold, 404 for unknown
+    medicines; the cart's holds are then left as they were.
+    Example body: {"lines": [{"medicine_id": 12, "quantity": 2}]}
+    """
+    if len(request.lines) > MAX_ORDER_LINES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ORDER_LINES} lines per reservation.")
+    if any(line.quantity < 0 for line in request.lines):
+        raise HTTPException(status_code=400, detail="Quantities cannot be negative.")
+
+    lines = merge_lines((line.medicine_id, line.quantity) for line in request.lines)
+    try:
+        await run_in_threadpool(reservations.reserve, cart_id, lines)
+    except OrderRejected as e:
+        raise rejection(e)
+    except Exception as e:
+        print(f"Error in reserve_stock: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return await run_in_threadpool(reservation_response, cart_id)
+
+@app.get("/reservations/{cart_id}")
+async def get_reservation(cart_id: str):
+    """A cart's current holds and the seconds until they expire (no lines once expired)."""
+    return await run_in_threadpool(reservation_response, cart_id)
+
+@app.delete("/reservations/{cart_id}")
+async def release_reservation(cart_id: str):
+    """Release every hold of a cart, e.g. when it is abandoned."""
+    return {"cart_id": cart_id, "released": await run_in_threadpool(reservations.release, cart_id)}
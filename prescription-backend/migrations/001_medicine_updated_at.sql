@@ -0,0 +1,19 @@
+-- Track when each medicine row last changed so the backend can refresh its
+-- in-memory catalog incrementally (see CatalogRefresher in catalog.py).
+
+ALTER TABLE medicine
+    ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS medicine_updated_at_idx ON medicine (updated_at);
+
+CREATE OR REPLACE FUNCTION medicine_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS medicine_touch_updated_at ON medicine;
+CREATE TRIGGER medicine_touch_updated_at
+    BEFORE UPDATE ON medicine
+    FOR EACH ROW EXECUTE FUNCTION medicine_touch_updated_at();
@@ -0,0 +1,13 @@
+-- Stock held by open carts (see ReservationBook in reservations.py). Every worker reads and
+-- writes the holds here, so a cart reserved through one worker can check out through another.
+
+CREATE TABLE IF NOT EXISTS medicine_reservation (
+    cart_id text NOT NULL,
+    medicine_id bigint NOT NULL,
+    quantity integer NOT NULL CHECK (quantity > 0),
+    expires_at timestamptz NOT NULL,
+    PRIMARY KEY (cart_id, medicine_id)
+);
+
+CREATE INDEX IF NOT EXISTS medicine_reservation_medicine_idx ON medicine_reservation (medicine_id);
+CREATE INDEX IF NOT EXISTS medicine_reservation_expires_at_idx ON medicine_reservation (expires_at);
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+
+# Most lines one order may hold
+MAX_ORDER_LINES = 200
+
+# Casting through text works whether quantity_available is stored as a number or as text; the
+# difference is cast back to the column type on assignment
+QUANTITY = "COALESCE(NULLIF(m.quantity_available::text, '')::numeric, 0)"
+
+class OrderRejected(Exception):
+    """
+    The order was rolled back without changing any stock.
+    - unknown: medicine ids that do not exist
+    - oversold: (medicine id, requested, available) of lines asking for more than is in stock
+    """
+
+    def __init__(self, unknown, oversold):
+        super().__init__(f"{len(unknown)} unknown medicines, {len(oversold)} oversold lines")
+        self.unknown = unknown
+        self.oversold = oversold
+
+def merge_lines(lines):
+    """{medicine id: total quantity} of (medicine id, quantity) lines, in first-seen order."""
+    merged = OrderedDict()
+    for medicine_id, quantity in lines:
+        merged[medicine_id] = merged.get(medicine_id, 0) + quantity
+    return merged
+
+# Units of each requested medicine held by live reservations of carts other than the given one
+# (medicine_reservation, see reservations.py). Params: (cart id or None); needs a `requested` CTE.
+HELD_CTE = """
+    held AS (
+        SELECT h.medicine_id, sum(h.quantity) AS quantity
+        FROM medicine_reservation h JOIN requested r ON r.id = h.medicine_id
+        WHERE h.expires_at > now() AND h.cart_id IS DISTINCT FROM %s::text
+        GROUP BY h.medicine_id
+    )"""
+
+def lock_medicines(cursor, medicine_ids):
+    """
+    Lock the medicine rows of the given ids in id order until the transaction ends. Statements run
+    after this see every hold committed before the lock was granted, which a statement that waits
+    for the lock itself would not (it keeps the snapshot it started with).
+    """
+    cursor.execute(
+        "SELECT id FROM medicine WHERE id = ANY(%s::bigint[]) ORDER BY id FOR UPDATE",
+        (list(medicine_ids),)
+    )
+
+def build_order_sql(columns):
+    """
+    One statement taking the stock of every order line at once: the rows are locked in id order
+    (so concurrent orders over the same medicines cannot deadlock), decremented only where enough
+    is available besides what other carts hold, and reported line by line.
+    Params: (medicine ids, quantities, ordering cart id or None).
+    Each result row is (id, requested, available before the order, updated) followed by the
+    updated row's `columns`, which are NULL where the line was not taken.
+    """
+    returning = ", ".join(f'm."{column}"' for column in columns)
+    updated_columns = ", ".join(f'u."{column}"' for column in columns)
+    return f"""
+    WITH requested AS (
+        SELECT * FROM unnest(%s::bigint[], %s::integer[]) AS r(id, quantity)
+    ),{HELD_CTE},
+    locked AS (
+        SELECT m.id, GREATEST({QUANTITY} - COALESCE(h.quantity, 0), 0) AS available
+        FROM medicine m JOIN requested r ON r.id = m.id
+        LEFT JOIN held h ON h.medicine_id = m.id
+        ORDER BY m.id
+        FOR UPDATE OF m
+    ),
+    updated AS (
+        UPDATE medicine m
+        SET quantity_available = {QUANTITY} - r.quantity
+        FROM requested r JOIN locked l ON l.id = r.id
+        WHERE m.id = r.id AND l.available >= r.quantity
+        RETURNING {returning}
+    )
+    SELECT r.id, r.quantity, l.available, u.id IS NOT NULL, {updated_columns}
+    FROM requested r
+    LEFT JOIN locked l ON l.id = r.id
+    LEFT JOIN updated u ON u.id = r.id
+    """
+
+def take_stock(cursor, lines, columns, cart_id=None):
+    """
+    Decrement the stock of every (medicine id, quantity) line, counting stock held by other carts
+    as unavailable; the holds of `cart_id` are used up by the order and deleted.
+    Returns the updated rows (values of `columns`). Raises OrderRejected if any line names an
+    unknown medicine or asks for more than is available; the caller must then roll back, which
+    the connection context of DatabasePool does for any exception.
+    """
+    merged = merge_lines(lines)
+    lock_medicines(cursor, sorted(merged))
+    cursor.execute(build_order_sql(columns), (list(merged), list(merged.values()), cart_id))
+    results = cursor.fetchall()
+
+    unknown, oversold, updated = [], [], []
+    for medicine_id, requested, available, taken, *row in results:
+        if available is None:
+            unknown.append(medicine_id)
+        elif not taken:
+            oversold.append((medicine_id, requested, int(available)))
+        else:
+            updated.append(row)
+    if unknown or oversold:
+        raise OrderRejected(unknown, oversold)
+    if cart_id is not None:
+        cursor.execute("DELETE FROM medicine_reservation WHERE cart_id = %s", (cart_id,))
+    return updated
@@ -0,0 +1,237 @@
+import base64
+import json
+
+import numpy as np
+
+# Stand-in expiry for rows without one when sorting by expiry_date
+MISSING_EXPIRY_SORT_KEY = np.datetime64('2000-01-01', 'ns')
+
+# Columns the medicine listing can be sorted by
+SORTABLE_COLUMNS = ["id", "name", "price", "quantity_available", "expiry_date"]
+
+# Stock status values a listing can be filtered by (the StockStatus values of main.py)
+STATUS_VALUES = ["out_of_stock", "low_stock", "in_stock", "expired", "expiring_soon"]
+
+# Keys a cursor payload may carry: source, search, status filter, sort column, descending,
+# offset (search results), and sort key plus id of the last row (keyset pages)
+CURSOR_KEYS = {"src", "q", "f", "s", "d", "o", "k", "i"}
+
+# Rows examined per step while filling a keyset page from a precomputed order
+SCAN_CHUNK = 2048
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(payload):
+    """Opaque, URL-safe cursor for a JSON-able payload."""
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+    if not isinstance(payload, dict):
+        raise InvalidCursor("Invalid cursor")
+    check_cursor(payload)
+    return payload
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_number(value):
+    return is_integer(value) or isinstance(value, float)
+
+def check_cursor(payload):
+    """Raise InvalidCursor unless every value of a decoded cursor has the type and range it is issued with."""
+    def require(condition):
+        if not condition:
+            raise InvalidCursor("Invalid cursor")
+
+    require(CURSOR_KEYS.issuperset(payload))
+    require(payload.get("src") in (None, "db"))
+    require(payload.get("q") is None or isinstance(payload["q"], str))
+    statuses = payload.get("f")
+    require(statuses is None or (
+        isinstance(statuses, list) and all(status in STATUS_VALUES for status in statuses)
+    ))
+    require(payload.get("s") is None or payload["s"] in SORTABLE_COLUMNS)
+    require(isinstance(payload.get("d", False), bool))
+    if "o" in payload:
+        require(is_integer(payload["o"]) and payload["o"] >= 0)
+        return
+    require(is_integer(payload.get("i")))
+    key = payload.get("k")
+    if payload.get("src") == "db":
+        # Database sort keys that are not plain numbers (e.g. numerics) are carried as text
+        require(is_number(key) or isinstance(key, str))
+    elif payload.get("s") == "name":
+        require(isinstance(key, str))
+    else:
+        require(is_number(key))
+
+def sort_keys_for(snapshot, sort_by):
+    """Sort keys for every catalog row, as a numpy array comparable with searchsorted."""
+    if sort_by == "id":
+        return snapshot.df["id"].to_numpy()
+    if sort_by == "quantity_available":
+        return snapshot.quantity
+    if sort_by == "price":
+        return snapshot.price
+    if sort_by == "expiry_date":
+        expiry = np.where(np.isnat(snapshot.expiry), MISSING_EXPIRY_SORT_KEY, snapshot.expiry)
+        return expiry.astype(np.int64)
+    if sort_by == "name":
+        names = snapshot.df["name"].astype(object)
+        return names.where(names.notna(), "").to_numpy(dtype=object)
+    raise ValueError(f"Unsupported sort column: {sort_by}")
+
+class SortIndex:
+    """
+    Precomputed ascending order of catalog rows by (key, id).
+    - order: row positions in sorted order
+    - keys/ids: sort key and medicine id of each row in `order`
+    - row_keys: sort key of each row by row position, for building cursors
+    Descending order is the exact reverse, so one index serves both directions.
+    """
+
+    def __init__(self, keys, ids):
+        self.row_keys = keys
+        self.order = np.lexsort((ids, keys))
+        self.keys = keys[self.order]
+        self.ids = ids[self.order]
+
+    def _tie_range(self, key):
+        return np.searchsorted(self.keys, key, 'left'), np.searchsorted(self.keys, key, 'right')
+
+    def position_after(self, key, medicine_id):
+        """First position in `order` strictly after (key, id)."""
+        lo, hi = self._tie_range(key)
+        return lo + int(np.searchsorted(self.ids[lo:hi], medicine_id, 'right'))
+
+    def position_before(self, key, medicine_id):
+        """First position in `order` at or after (key, id); everything before it sorts lower."""
+        lo, hi = self._tie_range(key)
+        return lo + int(np.searchsorted(self.ids[lo:hi], medicine_id, 'left'))
+
+def cursor_key(sort_index, row):
+    """JSON-able sort key of a row for embedding in a cursor."""
+    key = sort_index.row_keys[row]
+    return key.item() if isinstance(key, np.generic) else key
+
+def keyset_page(sort_index, descending, keep, after, page_size):
+    """
+    Rows of one keyset page plus a flag for whether more rows follow.
+    - keep: boolean mask over catalog rows (None keeps everything)
+    - after: (key, id) of the last row of the previous page, or None for the first page
+    Rows are pulled from the precomputed order in chunks, so the cost depends on the page size
+    and the filter density, not on how deep the page is.
+    """
+    order = sort_index.order
+    if descending:
+        end = len(order) if after is None else sort_index.position_before(*after)
+        sequence = order[:end][::-1]
+    else:
+        start = 0 if after is None else sort_index.position_after(*after)
+        sequence = order[start:]
+
+    wanted = page_size + 1
+    collected = []
+    count = 0
+    step = max(SCAN_CHUNK, wanted)
+    for offset in range(0, len(sequence), step):
+        chunk = sequence[offset:offset + step]
+        if keep is not None:
+            chunk = chunk[keep[chunk]]
+        collected.append(chunk)
+        count += len(chunk)
+        if count >= wanted:
+            break
+    rows = np.concatenate(collected) if collected else np.array([], dtype=np.int64)
+    return rows[:page_size], len(rows) > page_size
+
+def offset_page(sort_index, descending, keep, offset, page_size):
+    """Rows of one page addressed by offset (the classic `page` parameter) plus a more-rows flag."""
+    sequence = sort_index.order[::-1] if descending else sort_index.order
+    if keep is not None:
+        sequence = sequence[keep[sequence]]
+    return sequence[offset:offset + page_size], len(sequence) > offset + page_size
+
+def like_pattern(text):
+    """ILIKE pattern matching `text` anywhere, its own %, _ and backslashes taken literally (ESCAPE '\\')."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def build_medicines_sql(columns, search, sort_by, descending, status_filter, after, page_size,
+                        low_stock_threshold, expiring_soon_days):
+    """
+    SQL for one keyset page of the medicine listing, with filtering, sorting and the limit
+    evaluated by Postgres. Returns (page query, page params, count query, count params).
+    Search is a case-insensitive substring match on the name, not a fuzzy match.
+    """
+    # Casting through text works whether the columns are stored as numbers/dates or as text
+    quantity = "COALESCE(NULLIF(quantity_available::text, '')::numeric, 0)"
+    expiry = (
+        "(CASE WHEN expiry_date::text ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}$' "
+        "THEN expiry_date::text::date END)"
+    )
+    sort_expressions = {
+        "id": "id",
+        "name": "COALESCE(name, '')",
+        "price": "COALESCE(NULLIF(price::text, '')::numeric, 0)",
+        "quantity_available": quantity,
+        "expiry_date": "COALESCE(expiry_date::text, '2000-01-01')",
+    }
+    sort_expression = sort_expressions[sort_by]
+    status_predicates = {
+        "out_of_stock": (f"{quantity} <= 0", []),
+        "low_stock": (f"({quantity} > 0 AND {quantity} < %s)", [low_stock_threshold]),
+        "in_stock": (f"{quantity} >= %s", [low_stock_threshold]),
+        # Same day counting as the in-memory masks: whole days from now to the expiry date's
+        # midnight, floored, so a medicine expiring tomorrow is already 0 days away
+        "expired": (f"{expiry} <= CURRENT_DATE + 1", []),
+        "expiring_soon": (
+            f"({expiry} > CURRENT_DATE + 1 AND {expiry} <= CURRENT_DATE + 1 + %s)", [expiring_soon_days]
+        ),
+    }
+
+    where, params = [], []
+    if search:
+        where.append("name ILIKE %s ESCAPE '\\'")
+        params.append(like_pattern(search))
+    if status_filter:
+        clauses = []
+        for status in status_filter:
+            clause, clause_params = status_predicates[status]
+            clauses.append(clause)
+            params.extend(clause_params)
+        where.append("(" + " OR ".join(clauses) + ")")
+
+    where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+    count_query = f"SELECT COUNT(*) FROM medicine{where_sql}"
+    count_params = list(params)
+
+    page_where = list(where)
+    page_params = list(params)
+    if after is not None:
+        comparison = "<" if descending else ">"
+        page_where.append(f"({sort_expression}, id) {comparison} (%s, %s)")
+        page_params.extend(after)
+    page_where_sql = f" WHERE {' AND '.join(page_where)}" if page_where else ""
+    direction = "DESC" if descending else "ASC"
+    select_columns = ", ".join(f'"{column}"' for column in columns)
+    page_query = (
+        f"SELECT {select_columns}, {sort_expression} AS sort_key FROM medicine{page_where_sql} "
+        f"ORDER BY {sort_expression} {direction}, id {direction} LIMIT %s"
+    )
+    page_params.append(page_size + 1)
+    return page_query, page_params, count_query, count_params
+
+def sort_rows(sort_index, ids, rows, descending):
+    """Sort an arbitrary set of catalog rows by (key, id), e.g. the rows of a search result."""
+    order = np.lexsort((ids[rows], sort_index.row_keys[rows]))
+    if descending:
+        order = order[::-1]
+    return rows[order]
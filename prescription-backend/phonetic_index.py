@@ -0,0 +1,95 @@
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+from phonetics import dmetaphone
+
+from flat_arrays import Postings
+
+# Tokens shorter than this carry too little sound to key on ("mg", "sr", ...)
+MIN_TOKEN_LENGTH = 3
+
+@lru_cache(maxsize=65536)
+def token_keys(token):
+    """Double Metaphone keys (primary and, if different, alternate) of one alphabetic token."""
+    try:
+        return frozenset(key for key in dmetaphone(token) if key)
+    except IndexError:
+        # dmetaphone trips over a few degenerate inputs
+        return frozenset()
+
+def name_tokens(text):
+    """Alphabetic tokens of a cleaned name worth keying; digits (strengths, pack sizes) are dropped."""
+    tokens = ("".join(ch for ch in word if ch.isalpha()) for word in text.split())
+    return [token for token in tokens if len(token) >= MIN_TOKEN_LENGTH]
+
+def phonetic_keys(text):
+    """One set of Double Metaphone keys per token of a cleaned name."""
+    return [keys for keys in map(token_keys, name_tokens(text)) if keys]
+
+class PhoneticIndex:
+    """
+    Index from Double Metaphone key to the positions of names containing a token with that key,
+    so names that sound like the query ("azitrol" -> "azithral") are found without scoring every name.
+    - postings: key -> sorted int32 array of name positions, as one CSR pair plus the keys
+      changed since building (flat_arrays.Postings), so a shared catalog keeps it in the mapping
+    Posting arrays are replaced, never mutated, so copies share them and only copy the changed keys.
+    """
+
+    def __init__(self, names):
+        grouped = defaultdict(list)
+        for position, name in enumerate(names):
+            for key in frozenset().union(*phonetic_keys(name)):
+                grouped[key].append(position)
+        self.postings = Postings.from_lists(grouped, np.int32)
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        clone.postings = self.postings.copy()
+        return clone
+
+    def update(self, changed, previous):
+        """
+        Re-index (position, cleaned name) pairs; `previous` maps each position to the name it was
+        indexed under ("" for appended positions).
+        """
+        removed, added = defaultdict(list), defaultdict(list)
+        # The last name given for a position wins
+        for position, name in dict(changed).items():
+            old_keys = frozenset().union(*phonetic_keys(previous[position]))
+            new_keys = frozenset().union(*phonetic_keys(name))
+            for key in old_keys - new_keys:
+                removed[key].append(position)
+            for key in new_keys - old_keys:
+                added[key].append(position)
+
+        for key in removed.keys() | added.keys():
+            positions = self.postings.get(key, np.array([], dtype=np.int32))
+            if key in removed:
+                positions = np.setdiff1d(positions, removed[key])
+            if key in added:
+                positions = np.union1d(positions, added[key])
+            self.postings.set(key, positions.astype(np.int32))
+
+    def candidates(self, query_clean, limit):
+        """
+        Up to `limit` name positions sharing a phonetic key with the query, those matching the most
+        query tokens first (ties by position). Returned in position order.
+        """
+        matched = []
+        for keys in phonetic_keys(query_clean):
+            # A name counts once per query token, however many of the token's keys it matches
+            per_token = [positions for positions in map(self.postings.get, keys) if positions is not None]
+            if per_token:
+                matched.append(np.unique(np.concatenate(per_token)))
+        if not matched:
+            return np.array([], dtype=np.int32)
+
+        positions, counts = np.unique(np.concatenate(matched), return_counts=True)
+        if len(positions) > limit:
+            # Stable sort keeps position order within the same token count
+            positions = np.sort(positions[np.argsort(-counts, kind='stable')[:limit]])
+        return positions
+
+    def memory_bytes(self):
+        return self.postings.memory_bytes()
@@ -0,0 +1,237 @@
+import hashlib
+import heapq
+import threading
+import time
+
+from orders import HELD_CTE, QUANTITY, OrderRejected, lock_medicines
+
+# Stock each reservation line can take: the medicine's stock minus the live holds of other carts.
+# Params: (medicine ids, quantities, cart id). Rows: (id, requested, available), available NULL
+# for unknown medicines.
+RESERVE_SQL = f"""
+    WITH requested AS (
+        SELECT * FROM unnest(%s::bigint[], %s::integer[]) AS r(id, quantity)
+    ),{HELD_CTE}
+    SELECT r.id, r.quantity, CASE WHEN m.id IS NOT NULL THEN GREATEST({QUANTITY} - COALESCE(h.quantity, 0), 0) END
+    FROM requested r
+    LEFT JOIN medicine m ON m.id = r.id
+    LEFT JOIN held h ON h.medicine_id = r.id
+    """
+
+HOLD_SQL = """
+    INSERT INTO medicine_reservation (cart_id, medicine_id, quantity, expires_at)
+    SELECT %s, r.id, r.quantity, now() + %s * interval '1 second'
+    FROM unnest(%s::bigint[], %s::integer[]) AS r(id, quantity)
+    """
+
+HELD_TOTALS_SQL = """
+    SELECT medicine_id, sum(quantity) FROM medicine_reservation
+    WHERE expires_at > now()
+    GROUP BY medicine_id
+    """
+
+# Live holds of a cart with the stock of each medicine still available to sell (stock minus
+# every live hold) and the seconds until they expire. Params: (cart id).
+CART_SQL = f"""
+    SELECT c.medicine_id, c.quantity, GREATEST({QUANTITY} - (
+        SELECT sum(h.quantity) FROM medicine_reservation h
+        WHERE h.medicine_id = c.medicine_id AND h.expires_at > now()
+    ), 0), extract(epoch FROM c.expires_at - now())
+    FROM medicine_reservation c
+    JOIN medicine m ON m.id = c.medicine_id
+    WHERE c.cart_id = %s AND c.expires_at > now()
+    """
+
+# Deletes the expired holds and returns the seconds until the next live one expires (NULL if none)
+SWEEP_SQL = """
+    WITH swept AS (DELETE FROM medicine_reservation WHERE expires_at <= now())
+    SELECT extract(epoch FROM min(expires_at) - now()) FROM medicine_reservation WHERE expires_at > now()
+    """
+
+# Seconds the sweeper waits past an expiry, so the holds of carts reserved together go at once
+SWEEP_SLACK = 0.05
+# Seconds before the sweeper tries again after a database error
+SWEEP_RETRY = 5.0
+
+def totals_digest(held):
+    """Revision of a set of held totals, equal in every process that read the same holds."""
+    return hashlib.blake2b(repr(sorted(held.items())).encode(), digest_size=6).hexdigest()
+
+class ReservationBook:
+    """
+    Time-limited stock holds of open carts, kept in the medicine_reservation table so that every
+    worker process sees them (migrations/002_medicine_reservation.sql). Whether a reservation or
+    an order fits is decided by expiry-aware queries on the table, never from a cache.
+    - held: medicine id -> quantity held by all carts, a per-process cache of the table shown in
+      search results, so available-to-sell is stock - held[id], O(1) per row. Changes made
+      through this process reload it right away; holds made through other workers show once it
+      is older than `max_age` seconds and read again, which reloads it in the background (an
+      idle worker sends no queries)
+    - revision: digest of the held totals, the same in every process that read the same holds,
+      so responses showing holds can be tagged with it
+    - a min-heap of expiry times for the sweeper, run by one process only (`start`): it sleeps
+      until the earliest one, deletes the expired holds and pushes the expiry of the next live
+      one. Holds made meanwhile, through any worker, expire `ttl` after they are made, so never
+      before it; the holds this process makes push their expiry as well.
+    Reservations and orders lock the medicine rows before counting holds (orders.lock_medicines),
+    so two carts cannot take the same units, whichever workers they go through. Each cart's holds
+    share one expiry, renewed whenever the cart reserves again.
+    """
+
+    def __init__(self, db, ttl=900.0, max_age=1.0):
+        self.db = db
+        self.ttl = ttl
+        self.max_age = max_age
+        self._revision = totals_digest({})
+        self._held = {}
+        self._synced_at = float("-inf")
+        # Serializes syncs, so an older read never replaces a newer one
+        self._lock = threading.Lock()
+        self._reloading = threading.Lock()
+        self._heap = []
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._sweeper = threading.Thread(target=self._sweep, name="reservation-sweeper", daemon=True)
+
+    def start(self):
+        """Sweep expired holds from this process (the one owning the catalog)."""
+        self._sweeper.start()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+
+    @property
+    def revision(self):
+        self._reload_if_stale()
+        return self._revision
+
+    def held_of(self, medicine_id):
+        """Quantity of a medicine held by active carts, as of the last sync."""
+        self._reload_if_stale()
+        return self._held.get(medicine_id, 0)
+
+    def sync(self):
+        """Reload the held totals from the database."""
+        with self._lock:
+            started = time.monotonic()
+            with self.db.cursor() as cursor:
+                cursor.execute(HELD_TOTALS_SQL)
+                held = dict(cursor.fetchall())
+            self._held = held
+            self._revision = totals_digest(held)
+            self._synced_at = started
+
+    def _reload_if_stale(self):
+        if time.monotonic() - self._synced_at < self.max_age or not self._reloading.acquire(blocking=False):
+            return
+
+        def reload():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error syncing reservations: {str(e)}")
+            finally:
+                self._reloading.release()
+
+        threading.Thread(target=reload, name="reservation-sync", daemon=True).start()
+
+    def reserve(self, cart_id, lines):
+        """
+        Make {medicine id: quantity} the holds of a cart, replacing its previous ones, for `ttl`
+        seconds from now. Raises OrderRejected, leaving the cart as it was, if a line names an
+        unknown medicine or asks for more than the stock minus what other carts hold.
+        Returns the seconds until the holds expire.
+        """
+        lines = {medicine_id: quantity for medicine_id, quantity in lines.items() if quantity > 0}
+        with self.db.cursor() as cursor:
+            if lines:
+                lock_medicines(cursor, sorted(lines))
+                cursor.execute(RESERVE_SQL, (list(lines), list(lines.values()), cart_id))
+                unknown, oversold = [], []
+                for medicine_id, quantity, available in cursor.fetchall():
+                    if available is None:
+                        unknown.append(medicine_id)
+                    elif quantity > available:
+                        oversold.append((medicine_id, quantity, int(available)))
+                if unknown or oversold:
+                    raise OrderRejected(unknown, oversold)
+            cursor.execute("DELETE FROM medicine_reservation WHERE cart_id = %s", (cart_id,))
+            if lines:
+                cursor.execute(HOLD_SQL, (cart_id, self.ttl, list(lines), list(lines.values())))
+        self.sync()
+        if lines and self._sweeper.is_alive():
+            self._schedule(self.ttl + SWEEP_SLACK)
+        return self.ttl if lines else 0.0
+
+    def release(self, cart_id):
+        """Drop every hold of a cart; returns whether it had any that were still active."""
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM medicine_reservation WHERE cart_id = %s RETURNING expires_at > now()", (cart_id,)
+            )
+            released = any(active for active, in cursor.fetchall())
+        self.sync()
+        return released
+
+    def cart(self, cart_id):
+        """
+        ({medicine id: (quantity, available to sell)}, seconds until expiry) of a cart's live
+        holds, or None; available to sell is the medicine's stock minus every live hold.
+        """
+        with self.db.cursor() as cursor:
+            cursor.execute(CART_SQL, (cart_id,))
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+        lines = {medicine_id: (quantity, int(available)) for medicine_id, quantity, available, _ in rows}
+        return lines, max(0.0, float(rows[0][3]))
+
+    def stats(self):
+        with self.db.cursor() as cursor:
+            cursor.execute("""
+            SELECT count(DISTINCT cart_id), count(DISTINCT medicine_id), COALESCE(sum(quantity), 0)
+            FROM medicine_reservation
+            WHERE expires_at > now()
+            """)
+            carts, medicines_held, units_held = cursor.fetchone()
+        return {
+            "carts": carts,
+            "medicines_held": medicines_held,
+            "units_held": int(units_held),
+            "ttl_seconds": self.ttl,
+            "revision": self.revision,
+        }
+
+    def _schedule(self, delay):
+        """Have the sweeper wake up `delay` seconds from now."""
+        due = time.monotonic() + delay
+        with self._wakeup:
+            if not self._heap or due < self._heap[0]:
+                self._wakeup.notify()
+            heapq.heappush(self._heap, due)
+
+    def _sweep(self):
+        while True:
+            with self._wakeup:
+                while not self._stopped and self._heap and self._heap[0] > time.monotonic():
+                    self._wakeup.wait(self._heap[0] - time.monotonic())
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                while self._heap and self._heap[0] <= now:
+                    heapq.heappop(self._heap)
+            try:
+                with self.db.cursor() as cursor:
+                    cursor.execute(SWEEP_SQL)
+                    next_expiry, = cursor.fetchone()
+            except Exception as e:
+                print(f"Error sweeping reservations: {str(e)}")
+                self._schedule(SWEEP_RETRY)
+                continue
+            if next_expiry is None:
+                # Holds made from now on expire `ttl` later at the earliest
+                self._schedule(self.ttl)
+            else:
+                self._schedule(max(float(next_expiry), 0.0) + SWEEP_SLACK)
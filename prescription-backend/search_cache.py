@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by SearchCache.get when nothing usable is cached (None is a legitimate cached result)
+MISSING = object()
+
+class SearchCache:
+    """
+    Bounded LRU cache of search results with a time-to-live, tied to one catalog version.
+    - maxsize: entries kept; the least recently used entry is evicted beyond it
+    - ttl: seconds an entry stays valid (0 or less disables expiry)
+    Entries belong to one catalog version, an (epoch, version number) pair: the first access with a
+    newer version, or one from another epoch, drops everything cached for the previous one, and
+    requests still running on an older snapshot of the same epoch neither read nor write.
+    """
+
+    def __init__(self, maxsize=4096, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _is_current(self, version):
+        # Numbers only compare within one epoch (see CatalogSnapshot.epoch)
+        if self._version is None or version[0] != self._version[0] or version[1] > self._version[1]:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self._version = version
+        return version == self._version
+
+    def get(self, key, version):
+        """Cached value for key under the given catalog version, or MISSING."""
+        with self._lock:
+            entry = self._entries.get(key) if self._is_current(version) else None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, stored_at = entry
+            if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, version, value):
+        with self._lock:
+            if not self._is_current(version):
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,292 @@
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from catalog_store import attach_shared, load_stock_delta, publish_shared, publish_stock_delta
+
+# Published files kept besides the current one, so followers still opening an older one find it
+KEEP_PUBLISHED = 2
+# Rows a stock delta may carry before the whole catalog is published again instead
+DELTA_MAX_ROWS = 20000
+# Seconds a follower waits for the leader to apply and publish a change it forwarded
+FORWARD_TIMEOUT = 5.0
+# Largest forwarded message or reply accepted, in bytes
+FORWARD_MAX_BYTES = 64 * 2**20
+
+class SharedCatalog:
+    """
+    One catalog shared by the worker processes of a server (e.g. uvicorn --workers N) through a
+    directory, ideally on tmpfs such as /dev/shm:
+    - the leader, whichever process holds the directory's lock, loads and refreshes the catalog and
+      publishes every new version as a memory-mappable file (see catalog_store.publish_shared)
+    - followers attach to the latest published file read-only: its arrays, strings included (see
+      flat_arrays), stay in the shared page cache, so an extra worker adds little of its own
+    - versions that only changed stock (orders) are published as a small delta file instead,
+      holding every row changed since the last full file (see Catalog.stock_delta); followers
+      apply it with with_stock. Once a delta outgrows DELTA_MAX_ROWS the whole catalog is
+      published again.
+    - a pointer file names the current full file and delta, if any, and is swapped atomically;
+      followers poll it
+    - changes a follower makes (e.g. the stock of an order) are forwarded to the leader as JSON
+      over a unix socket in the directory, applied and published at once, so the follower can
+      serve them before answering. Connections authenticate with a random key the leader writes
+      to the directory, readable by its owner only, as is the directory when created here.
+    When the leader exits its lock is released and the next follower to poll takes over.
+    """
+
+    def __init__(self, directory, stamp, poll_interval=1.0):
+        self.directory = directory
+        self.stamp = stamp
+        self.poll_interval = poll_interval
+        self.current_path = os.path.join(directory, "current")
+        self.socket_path = os.path.join(directory, "leader.sock")
+        self.key_path = os.path.join(directory, "leader.key")
+        # Full file (and its version) and delta published or attached last, and version published last
+        self.attached = None
+        self.attached_version = None
+        self.attached_delta = None
+        self.published = None
+        self._lock_file = None
+        self._listener = None
+        self._attach_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @property
+    def is_leader(self):
+        return self._lock_file is not None
+
+    def try_lead(self):
+        """Take the leader lock if no other process holds it; returns whether this process leads."""
+        if self._lock_file is None:
+            import fcntl
+
+            lock_file = open(os.path.join(self.directory, "leader.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+            # The lock lasts as long as the file stays open, i.e. until this process exits
+            self._lock_file = lock_file
+        return True
+
+    def publish(self, snapshot):
+        """Make `snapshot` the version followers attach to and drop files older than KEEP_PUBLISHED."""
+        name = publish_shared(snapshot, self.directory, self.stamp)
+        self._point_to(name)
+        self.attached, self.attached_version, self.attached_delta = name, snapshot.version, None
+        self._prune("catalog-")
+
+    def publish_stock(self, snapshot, stock):
+        """
+        Make `snapshot` the version followers attach to by publishing `stock`, the rows it changed
+        since the full file published last.
+        """
+        name = publish_stock_delta(snapshot, stock, self.attached, self.directory, self.stamp)
+        self._point_to(self.attached, name)
+        self.attached_delta = name
+        self._prune("delta-")
+
+    def _point_to(self, *names):
+        pointer = os.path.join(self.directory, ".current.tmp")
+        with open(pointer, "w") as f:
+            f.write("\n".join(names))
+        os.replace(pointer, self.current_path)
+
+    def _prune(self, prefix):
+        published = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.startswith(prefix)),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in published[:-(KEEP_PUBLISHED + 1)]:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def attach_latest(self, current=None):
+        """
+        The latest published snapshot if it is not the one already attached, else None. A delta
+        published on top of the full file already attached is applied to `current`, the snapshot
+        attached last.
+        """
+        try:
+            with open(self.current_path) as f:
+                names = f.read().split()
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        name, delta_name = names[0], names[1] if len(names) > 1 else None
+        if name == self.attached and delta_name == self.attached_delta:
+            return None
+
+        snapshot = current
+        if name != self.attached or current is None:
+            try:
+                snapshot = attach_shared(os.path.join(self.directory, name), self.stamp)
+            except FileNotFoundError:
+                # Pruned between reading the pointer and opening it; the next poll finds a newer one
+                return None
+            if snapshot is None:
+                return None
+            self.attached, self.attached_version, self.attached_delta = name, snapshot.version, None
+        if delta_name is None:
+            return snapshot
+
+        try:
+            delta = load_stock_delta(os.path.join(self.directory, delta_name), self.stamp)
+        except FileNotFoundError:
+            delta = None
+        if delta is None or delta["base"] != name:
+            # A newer delta or full file replaced it; the next poll finds that
+            return snapshot if snapshot is not current else None
+        result = snapshot.with_stock(delta["stock"])
+        if result is not None:
+            snapshot = result[0]
+        self.attached_delta = delta_name
+        return snapshot.renumbered(delta["version"])
+
+    def wait_for_snapshot(self):
+        """
+        Block until a snapshot is published and return it, or return None as soon as this process
+        becomes the leader instead (e.g. the previous leader exited before publishing).
+        """
+        while True:
+            snapshot = self.attach_latest()
+            if snapshot is not None:
+                return snapshot
+            if self.try_lead():
+                return None
+            time.sleep(self.poll_interval)
+
+    def catch_up(self, catalog):
+        """Swap the latest published version into `catalog` if it is not the one attached already."""
+        with self._attach_lock:
+            snapshot = self.attach_latest(catalog.snapshot)
+            if snapshot is not None:
+                catalog.swap(snapshot)
+
+    def follow(self, catalog, on_lead):
+        """
+        Keep `catalog` on the latest published version in a background thread, until this process
+        takes over the leadership: then `on_lead()` is called and following stops.
+        """
+        def run():
+            while not self._stop_event.wait(self.poll_interval):
+                try:
+                    if self.try_lead():
+                        print(f" Took over the shared catalog at version {catalog.version}")
+                        on_lead()
+                        return
+                    self.catch_up(catalog)
+                except Exception as e:
+                    print(f"Error following shared catalog: {str(e)}")
+
+        threading.Thread(target=run, name="shared-catalog-follower", daemon=True).start()
+
+    def forward(self, catalog, message):
+        """
+        Have the leader apply `message`, a JSON-able change made by this follower (see the
+        `apply_forwarded` of publish_changes), and publish it at once, then bring `catalog` up to
+        that version. Returns False if the leader could not be reached or failed to apply it (e.g.
+        while another process takes over); its next refresh then picks the rows up.
+        """
+        try:
+            with open(self.key_path, "rb") as f:
+                authkey = f.read()
+            with Client(self.socket_path, family="AF_UNIX", authkey=authkey) as connection:
+                connection.send_bytes(json.dumps(message).encode())
+                if not connection.poll(FORWARD_TIMEOUT):
+                    return False
+                reply = json.loads(connection.recv_bytes(FORWARD_MAX_BYTES))
+        except (OSError, EOFError, AuthenticationError, ValueError):
+            return False
+        if reply.get("version") is None:
+            return False
+        self.catch_up(catalog)
+        return catalog.version >= reply["version"]
+
+    def publish_changes(self, catalog, interval=1.0, apply_forwarded=None):
+        """
+        Publish `catalog` from a background thread whenever its version changes, at most once per
+        `interval` seconds so bursts of changes become one publication. With `apply_forwarded`,
+        changes followers forward (see forward) are passed to it and published right away.
+        """
+        self.published = catalog.version if self.attached is not None else None
+
+        def run():
+            while not self._stop_event.wait(interval):
+                try:
+                    self.publish_latest(catalog)
+                except Exception as e:
+                    print(f"Error publishing shared catalog: {str(e)}")
+
+        threading.Thread(target=run, name="shared-catalog-publisher", daemon=True).start()
+        if apply_forwarded is not None:
+            self._serve_forwarded(catalog, apply_forwarded)
+
+    def publish_latest(self, catalog):
+        """
+        Publish the current version of `catalog` unless it is published already; versions that only
+        changed stock since the full file published last go out as a delta. Returns the version published.
+        """
+        with self._publish_lock:
+            if catalog.version != self.published:
+                delta = catalog.stock_delta(self.attached_version) if self.attached is not None else None
+                if delta is not None and len(delta[1]) <= DELTA_MAX_ROWS:
+                    snapshot, stock = delta
+                    self.publish_stock(snapshot, stock)
+                else:
+                    snapshot = catalog.snapshot
+                    self.publish(snapshot)
+                self.published = snapshot.version
+            return self.published
+
+    def _serve_forwarded(self, catalog, apply_forwarded):
+        """Apply and publish the changes followers forward, one connection at a time, from a background thread."""
+        authkey = secrets.token_bytes(32)
+        # Holding the leader lock, so a socket left behind belongs to a leader that exited
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self._listener = listener = Listener(self.socket_path, family="AF_UNIX", backlog=64, authkey=authkey)
+        os.chmod(self.socket_path, 0o600)
+        # mkstemp creates the file readable by its owner only
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".leader-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(authkey)
+        os.replace(temporary, self.key_path)
+
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    with listener.accept() as connection:
+                        if connection.poll(FORWARD_TIMEOUT):
+                            message = json.loads(connection.recv_bytes(FORWARD_MAX_BYTES))
+                            try:
+                                apply_forwarded(message)
+                                reply = {"version": self.publish_latest(catalog)}
+                            except Exception as e:
+                                print(f"Error applying forwarded change: {str(e)}")
+                                reply = {"version": None}
+                            connection.send_bytes(json.dumps(reply).encode())
+                except Exception as e:
+                    if self._stop_event.is_set():
+                        return
+                    print(f"Error receiving forwarded change: {str(e)}")
+
+        threading.Thread(target=run, name="shared-catalog-forwarded", daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._listener is not None:
+            self._listener.close()
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+from flat_arrays import PackedStrings
+
+SUBSTITUTE_COLUMNS = [f"substitute{i}" for i in range(5)]
+
+# Cleaned placeholder values that mean "no substitute"
+PLACEHOLDER_NAMES = {"", "unknown", "na", "not available", "none", "null"}
+
+# How a name was resolved to a catalog row
+EXACT, FUZZY = "exact", "fuzzy"
+
+# WRatio score a name without an exact match needs to resolve fuzzily (the /search_medicine/ default)
+FUZZY_THRESHOLD = 50
+# Trigram candidates reranked per fuzzy resolution; far fewer than a /search_medicine/ lookup
+# scores (the best match agrees >99% of the time)
+FUZZY_CANDIDATES = 200
+
+class SubstituteGraph:
+    """
+    Substitute names of every catalog row, resolved to catalog rows by exact cleaned name, or
+    failing that by the best WRatio match over the catalog names (as a /search_medicine/ lookup).
+    - clean: the text normalizer names are compared with (catalog.clean_text)
+    - name_ids: cleaned name -> name id, shared by catalog and substitute names; names: name id ->
+      cleaned name (both append-only, so copies can share them); pickled as PackedStrings only,
+      the dict being rebuilt once a name is added
+    - name_of_row: row -> name id of the row's own name (-1 if missing)
+    - slots: row x 5 array of the name ids of substitute0..substitute4 (-1 where empty)
+    - row_of_name: name id -> first catalog row with that name (-1 if none)
+    - fuzzy: name id -> (catalog row, WRatio) of the best fuzzy match, or None, for names without
+      an exact match. Searched on first lookup rather than on load, since a large catalog has
+      thousands of such names, and kept per process (not pickled); an update starts afresh, as
+      changed names can move any match.
+    Arrays are replaced, never mutated, on update.
+    """
+
+    def __init__(self, df, clean):
+        self.clean = clean
+        self.name_ids = {}
+        self.names = []
+        self.name_of_row = self._ids_of(df["name"])
+        self.slots = np.column_stack([self._ids_of(df[column]) for column in SUBSTITUTE_COLUMNS])
+        self.row_of_name = np.full(len(self.name_ids), -1, dtype=np.int64)
+        self.fuzzy = {}
+        self._resolve(self.name_of_row)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if not isinstance(self.names, PackedStrings):
+            state["names"] = PackedStrings(self.names)
+        state["name_ids"] = None
+        state["fuzzy"] = {}
+        return state
+
+    def _intern(self, value):
+        name = self.clean(value)
+        if name in PLACEHOLDER_NAMES:
+            return -1
+        if self.name_ids is None:
+            self.names = list(self.names)
+            self.name_ids = {name: name_id for name_id, name in enumerate(self.names)}
+        name_id = self.name_ids.setdefault(name, len(self.name_ids))
+        if name_id == len(self.names):
+            self.names.append(name)
+        return name_id
+
+    def _ids_of(self, values):
+        """Name ids of a column; categorical columns are cleaned once per category in use."""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            used = np.unique(codes[codes >= 0])
+            # The extra trailing slot maps code -1 (missing) to -1
+            category_ids = np.full(len(values.cat.categories) + 1, -1, dtype=np.int32)
+            category_ids[used] = [self._intern(value) for value in values.cat.categories[used].tolist()]
+            return category_ids[codes]
+        return np.array([-1 if pd.isna(value) else self._intern(value) for value in values], dtype=np.int32)
+
+    def _resolve(self, names):
+        """Point each of the given name ids at the first row carrying it (or -1)."""
+        names = np.unique(names)
+        names = names[names >= 0]
+        if not len(names):
+            return
+        self.row_of_name[names] = -1
+        holders = np.flatnonzero(np.isin(self.name_of_row, names))
+        found, first = np.unique(self.name_of_row[holders], return_index=True)
+        self.row_of_name[found] = holders[first]
+
+    def _fuzzy_match(self, name_id, index):
+        """(catalog row, WRatio) of the best fuzzy match of a name, or None; searched once per name."""
+        if name_id not in self.fuzzy:
+            hits = index.search(
+                self.names[name_id], threshold=FUZZY_THRESHOLD, top_k=1, candidates=FUZZY_CANDIDATES
+            )
+            self.fuzzy[name_id] = (int(index.row_ids[hits[0][0]]), hits[0][1]) if hits else None
+        return self.fuzzy[name_id]
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def update(self, df, rows):
+        """Re-resolve the given DataFrame row positions, appending rows not seen yet."""
+        rows = np.asarray(rows, dtype=np.int64)
+        grown = len(df) - len(self.name_of_row)
+        name_of_row = np.concatenate([self.name_of_row, np.full(grown, -1, dtype=np.int32)])
+        slots = np.concatenate([self.slots, np.full((grown, len(SUBSTITUTE_COLUMNS)), -1, dtype=np.int32)])
+
+        # Names a changed row used to carry may now resolve to another row (or none)
+        previous = name_of_row[rows]
+        name_of_row[rows] = self._ids_of(df["name"].iloc[rows])
+        for slot, column in enumerate(SUBSTITUTE_COLUMNS):
+            slots[rows, slot] = self._ids_of(df[column].iloc[rows])
+        self.name_of_row, self.slots = name_of_row, slots
+
+        self.row_of_name = grown_to(self.row_of_name, len(self.names), -1)
+        self._resolve(np.concatenate([previous, name_of_row[rows]]))
+        self.fuzzy = {}
+
+    def of(self, row, index):
+        """
+        (slot, catalog row, "exact" or "fuzzy") for each substitute of a row that resolves to a
+        catalog row; `index` is the CatalogIndex of the same snapshot, searched for fuzzy matches.
+        """
+        resolved = []
+        for slot, name_id in enumerate(self.slots[row].tolist()):
+            if name_id < 0:
+                continue
+            target = int(self.row_of_name[name_id])
+            if target >= 0:
+                resolved.append((slot, target, EXACT))
+                continue
+            match = self._fuzzy_match(name_id, index)
+            if match is not None:
+                resolved.append((slot, match[0], FUZZY))
+        return resolved
+
+    def memory_bytes(self):
+        return self.name_of_row.nbytes + self.slots.nbytes + self.row_of_name.nbytes
+
+def grown_to(values, size, fill):
+    """Copy of a 1-d array extended to `size` entries with `fill`."""
+    grown = np.full(size, fill, dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
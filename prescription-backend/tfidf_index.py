@@ -0,0 +1,209 @@
+import math
+import zlib
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from flat_arrays import KeyTable
+
+# Queries multiplied against the catalog at once; bounds the sparse score matrix
+QUERY_CHUNK = 64
+# n-grams found in more than this share of the catalog ("tab", "let" from "tablet") carry no signal
+MAX_DOCUMENT_FREQUENCY = 0.1
+
+def char_ngrams(text):
+    """Character trigrams of each word of a cleaned text, with counts; words are padded with spaces."""
+    grams = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def term_ids(vocab, grams):
+    """Term ids of n-grams (-1 outside the vocabulary); `vocab` is a dict while fitting, else a KeyTable."""
+    if isinstance(vocab, dict):
+        return np.fromiter((vocab.get(gram, -1) for gram in grams), dtype=np.int64, count=len(grams))
+    return vocab.lookup(grams)
+
+def vectorize_counted(counted, vocab, idf):
+    """L2-normalized TF-IDF rows (CSR) for n-gram counts, ignoring n-grams outside the vocabulary."""
+    grams = [gram for counts in counted for gram in counts]
+    counts = np.fromiter(
+        (count for counts in counted for count in counts.values()), dtype=np.float64, count=len(grams)
+    )
+    rows = np.repeat(np.arange(len(counted)), [len(counts) for counts in counted])
+    terms = term_ids(vocab, grams)
+    known = terms >= 0
+    rows, terms, counts = rows[known], terms[known], counts[known]
+    # Sublinear term frequency
+    weights = (1 + np.log(counts)) * idf[terms]
+    vectors = sparse.csr_matrix(
+        (weights.astype(np.float32), (rows, terms)), shape=(len(counted), len(vocab)), dtype=np.float32
+    )
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags((1 / norms).astype(np.float32)) @ vectors).tocsr()
+
+def text_checksum(text):
+    return zlib.crc32(text.encode())
+
+class TfidfIndex:
+    """
+    Character n-gram TF-IDF vectors of the catalog search texts (name plus compositions), searched by
+    cosine similarity with one sparse matrix multiply per chunk of queries.
+    - vocab: n-gram -> term id (a flat_arrays.KeyTable); idf: inverse document frequency per term
+      (fixed when fitted)
+    - vectors_t: term x position CSR matrix of L2-normalized row vectors (the transpose, so
+      queries @ vectors_t is a plain CSR product)
+    - checksums: CRC32 of each position's text, to tell which rows a persisted index still matches
+    - overlay: vectors of texts changed or appended since fitting, whose base columns are `stale`
+    Base arrays are never mutated, so copies share them and only copy the overlay.
+    """
+
+    def __init__(self, vocab, idf, vectors_t, checksums):
+        self.vocab = vocab
+        self.idf = idf
+        self.vectors_t = vectors_t
+        self.checksums = checksums
+        self.size = vectors_t.shape[1]
+        self.stale = np.zeros(self.size, dtype=bool)
+        self.overlay = {}
+        self._overlay_t = None
+
+    @classmethod
+    def fit(cls, texts):
+        """Fit the vocabulary and IDF weights on the given texts and vectorize them."""
+        counted = [char_ngrams(text) for text in texts]
+        document_frequency = Counter()
+        for grams in counted:
+            document_frequency.update(grams.keys())
+        max_df = max(1, int(MAX_DOCUMENT_FREQUENCY * len(texts)))
+        vocab = {}
+        for gram, df in document_frequency.items():
+            if df <= max_df:
+                vocab[gram] = len(vocab)
+        idf = np.ones(len(vocab), dtype=np.float32)
+        for gram, term in vocab.items():
+            idf[term] = math.log((1 + len(texts)) / (1 + document_frequency[gram])) + 1
+        vectors = vectorize_counted(counted, vocab, idf)
+        return cls(
+            KeyTable(vocab), idf, vectors.T.tocsr(),
+            np.array([text_checksum(text) for text in texts], dtype=np.uint32)
+        )
+
+    def vectorize(self, texts):
+        """L2-normalized TF-IDF rows for texts, with n-grams outside the fitted vocabulary ignored."""
+        return vectorize_counted([char_ngrams(text) for text in texts], self.vocab, self.idf)
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        clone.vocab, clone.idf, clone.vectors_t = self.vocab, self.idf, self.vectors_t
+        clone.checksums = self.checksums
+        clone.size = self.size
+        clone.stale = self.stale
+        clone.overlay = dict(self.overlay)
+        clone._overlay_t = self._overlay_t
+        return clone
+
+    def update(self, changed):
+        """Re-vectorize (position, text) pairs; positions beyond the current size are appended."""
+        changed = list(changed)
+        if not changed:
+            return
+        self.size = max([self.size] + [position + 1 for position, _ in changed])
+        stale = np.zeros(self.size, dtype=bool)
+        stale[:len(self.stale)] = self.stale
+        vectors = self.vectorize([text for _, text in changed])
+        for (position, _), vector in zip(changed, vectors):
+            stale[position] = True
+            self.overlay[position] = vector
+        self.stale = stale
+        self._overlay_t = None
+
+    def aligned(self, position_ids, ids, texts):
+        """
+        This (persisted) index rearranged for a catalog whose positions hold medicine `position_ids`
+        with search `texts`, given the medicine `ids` of this index's positions. Positions whose
+        medicine is missing here or whose text changed since fitting go to the overlay.
+        """
+        known = {medicine_id: position for position, medicine_id in enumerate(ids)}
+        source = np.array([known.get(medicine_id, -1) for medicine_id in position_ids], dtype=np.int64)
+        checksums = np.array([text_checksum(text) for text in texts], dtype=np.uint32)
+        fresh = source >= 0
+        fresh[fresh] = self.checksums[source[fresh]] == checksums[fresh]
+
+        # Stale columns are kept as empty vectors so positions line up with the catalog
+        vectors_t = self.vectors_t[:, np.where(fresh, source, 0)].tocsc()
+        vectors_t = (vectors_t @ sparse.diags(fresh.astype(np.float32))).tocsr()
+        vectors_t.eliminate_zeros()
+        index = type(self)(self.vocab, self.idf, vectors_t, checksums)
+        index.update((int(position), texts[position]) for position in np.flatnonzero(~fresh))
+        return index
+
+    def search_many(self, queries_clean, threshold=30, top_k=3):
+        """Top-k (position, score) pairs per query by cosine similarity scaled to 0-100, best first."""
+        overlay_positions = np.array(list(self.overlay), dtype=np.int64)
+        if self.overlay and self._overlay_t is None:
+            self._overlay_t = sparse.vstack(list(self.overlay.values())).T.tocsr()
+        overlay_t = self._overlay_t
+        results = []
+        for start in range(0, len(queries_clean), QUERY_CHUNK):
+            queries = self.vectorize(queries_clean[start:start + QUERY_CHUNK])
+            scores = (queries @ self.vectors_t).tocsr()
+            overlay_scores = (queries @ overlay_t).toarray() if overlay_t is not None else None
+            for i in range(queries.shape[0]):
+                positions = scores.indices[scores.indptr[i]:scores.indptr[i + 1]].astype(np.int64)
+                values = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+                keep = ~self.stale[positions]
+                positions, values = positions[keep], values[keep]
+                if overlay_scores is not None:
+                    positions = np.concatenate([positions, overlay_positions])
+                    values = np.concatenate([values, overlay_scores[i]])
+                results.append(self._top_k(positions, values * 100, threshold, top_k))
+        return results
+
+    @staticmethod
+    def _top_k(positions, values, threshold, top_k):
+        keep = values >= threshold
+        positions, values = positions[keep], values[keep]
+        if len(positions) > top_k:
+            # Everything tied with the k-th best score stays in, so ties resolve by position
+            kth_score = -np.partition(-values, top_k - 1)[top_k - 1]
+            keep = values >= kth_score
+            positions, values = positions[keep], values[keep]
+        order = np.lexsort((positions, -values))[:top_k]
+        return [(int(positions[j]), round(float(values[j]), 2)) for j in order]
+
+    def save(self, path, ids):
+        """Persist the fitted index, with the medicine `ids` of its positions, as one .npz file."""
+        if self.overlay:
+            raise ValueError("Only freshly fitted indexes can be saved")
+        terms = self.vocab.keys_by_value()
+        np.savez(
+            path,
+            vocab=np.frombuffer("\n".join(terms).encode(), dtype=np.uint8),
+            idf=self.idf,
+            data=self.vectors_t.data, indices=self.vectors_t.indices, indptr=self.vectors_t.indptr,
+            shape=np.array(self.vectors_t.shape), checksums=self.checksums,
+            ids=np.asarray(ids, dtype=np.int64)
+        )
+
+    @classmethod
+    def load(cls, path):
+        """(index, medicine ids of its positions) from a file written by `save`."""
+        with np.load(path) as saved:
+            terms = saved["vocab"].tobytes().decode().split("\n") if len(saved["vocab"]) else []
+            vectors_t = sparse.csr_matrix(
+                (saved["data"], saved["indices"], saved["indptr"]), shape=tuple(saved["shape"])
+            )
+            index = cls(KeyTable({term: i for i, term in enumerate(terms)}), saved["idf"], vectors_t, saved["checksums"])
+            return index, saved["ids"]
+
+    def memory_bytes(self):
+        return (
+            self.vectors_t.data.nbytes + self.vectors_t.indices.nbytes + self.vectors_t.indptr.nbytes
+            + self.vocab.memory_bytes()
+            + self.idf.nbytes + self.checksums.nbytes + self.stale.nbytes
+            + sum(vector.data.nbytes + vector.indices.nbytes for vector in self.overlay.values())
+        )
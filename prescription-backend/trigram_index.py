@@ -0,0 +1,80 @@
+import numpy as np
+
+from flat_arrays import KeyTable
+
+def trigrams(text):
+    """Character trigrams of a cleaned name, padded so word starts and ends count too."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """
+    Character-trigram inverted index over cleaned names, used to pick a bounded candidate set
+    that the WRatio scorer then reranks.
+    - vocab: trigram -> id (a flat_arrays.KeyTable); postings for id t are
+      postings[offsets[t]:offsets[t + 1]] (name positions)
+    - overlay: position -> trigram set for names changed or appended since the postings were built;
+      their postings entries are ignored via `stale`
+    The postings arrays are never mutated, so copies share them and only copy the small overlay.
+    """
+
+    def __init__(self, names):
+        vocab = {}
+        term_ids, positions = [], []
+        for position, name in enumerate(names):
+            for gram in trigrams(name):
+                term_ids.append(vocab.setdefault(gram, len(vocab)))
+                positions.append(position)
+        term_ids = np.array(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind='stable')
+        self.vocab = KeyTable(vocab)
+        self.postings = np.array(positions, dtype=np.int32)[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocab)))])
+        self.size = len(names)
+        self.stale = np.zeros(len(names), dtype=bool)
+        self.overlay = {}
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        clone.vocab, clone.postings, clone.offsets = self.vocab, self.postings, self.offsets
+        clone.size = self.size
+        clone.stale = self.stale
+        clone.overlay = dict(self.overlay)
+        return clone
+
+    def update(self, changed):
+        """Re-index (position, cleaned name) pairs; positions beyond the current size are appended."""
+        changed = list(changed)
+        self.size = max([self.size] + [position + 1 for position, _ in changed])
+        stale = np.zeros(self.size, dtype=bool)
+        stale[:len(self.stale)] = self.stale
+        for position, name in changed:
+            stale[position] = True
+            self.overlay[position] = trigrams(name)
+        self.stale = stale
+
+    def candidates(self, query_clean, limit):
+        """Up to `limit` name positions sharing the most trigrams with the query (ties by position)."""
+        query_grams = trigrams(query_clean)
+        terms = self.vocab.lookup(query_grams)
+        slices = [self.postings[self.offsets[term]:self.offsets[term + 1]] for term in terms[terms >= 0].tolist()]
+        if slices:
+            counts = np.bincount(np.concatenate(slices), minlength=self.size)
+        else:
+            counts = np.zeros(self.size, dtype=np.int64)
+        counts[self.stale] = 0
+        for position, grams in self.overlay.items():
+            counts[position] = len(query_grams & grams)
+
+        matched = np.flatnonzero(counts)
+        if len(matched) > limit:
+            # Keep the best `limit` by shared trigrams, breaking ties by position
+            shared = counts[matched]
+            kth = np.partition(shared, len(shared) - limit)[len(shared) - limit]
+            above = matched[shared > kth]
+            ties = matched[shared == kth][:limit - len(above)]
+            matched = np.sort(np.concatenate([above, ties]))
+        return matched
+
+    def memory_bytes(self):
+        return self.vocab.memory_bytes() + self.postings.nbytes + self.offsets.nbytes + self.stale.nbytes